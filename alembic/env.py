@@ -38,6 +38,7 @@ from src.Metrica_goals import models
 from src.Users import models
 from src.goals_metrika import models
 from src.goals import models
+from src.MetricaLogs import models
 
 target_metadata = Base.metadata
 
@@ -0,0 +1,30 @@
+"""add token_expires_at
+
+Revision ID: 3c1f9a7e2b4d
+Revises: a50bca6fc345
+Create Date: 2026-10-19 12:10:41.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c1f9a7e2b4d'
+down_revision: Union[str, None] = 'a50bca6fc345'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('token_expires_at', sa.DateTime(), nullable=True), schema='public')
+    op.create_index(op.f('ix_public_users_token_expires_at'), 'users', ['token_expires_at'], unique=False, schema='public')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_public_users_token_expires_at'), table_name='users', schema='public')
+    op.drop_column('users', 'token_expires_at', schema='public')
@@ -0,0 +1,47 @@
+"""add metrica_visits
+
+Revision ID: 5b7e2d9c4a1f
+Revises: 3c1f9a7e2b4d
+Create Date: 2026-10-19 18:42:07.631905
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7e2d9c4a1f'
+down_revision: Union[str, None] = '3c1f9a7e2b4d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('metrica_visits',
+    sa.Column('counter_id', sa.BigInteger(), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('visit_id', sa.Numeric(precision=20, scale=0), nullable=False),
+    sa.Column('client_id', sa.Numeric(precision=20, scale=0), nullable=True),
+    sa.Column('date_time', sa.DateTime(), nullable=True),
+    sa.Column('is_new_user', sa.Boolean(), nullable=True),
+    sa.Column('page_views', sa.Integer(), nullable=True),
+    sa.Column('visit_duration', sa.Integer(), nullable=True),
+    sa.Column('bounce', sa.Boolean(), nullable=True),
+    sa.Column('traffic_source', sa.String(), nullable=True),
+    sa.Column('goals_id', postgresql.ARRAY(sa.BigInteger()), nullable=True),
+    sa.PrimaryKeyConstraint('counter_id', 'date', 'visit_id'),
+    schema='public',
+    postgresql_partition_by='RANGE (date)'
+    )
+    # Индекс на секционированной таблице создается и на всех ее секциях
+    op.create_index('ix_metrica_visits_counter_date', 'metrica_visits', ['counter_id', 'date', 'traffic_source'], unique=False, schema='public')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_metrica_visits_counter_date', table_name='metrica_visits', schema='public')
+    op.drop_table('metrica_visits', schema='public')
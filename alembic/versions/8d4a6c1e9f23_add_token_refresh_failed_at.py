@@ -0,0 +1,28 @@
+"""add token_refresh_failed_at
+
+Revision ID: 8d4a6c1e9f23
+Revises: 5b7e2d9c4a1f
+Create Date: 2026-10-19 19:26:53.118402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d4a6c1e9f23'
+down_revision: Union[str, None] = '5b7e2d9c4a1f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('token_refresh_failed_at', sa.DateTime(), nullable=True), schema='public')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'token_refresh_failed_at', schema='public')
@@ -1,9 +1,21 @@
 from celery.schedules import crontab
-from src.ReportsDirect import celery_app
+from src.ReportsDirect.celery import celery_app
+from src.ReportsDirect.scheduler import REFRESH_WINDOW_START_HOUR
 
 celery_app.conf.beat_schedule = {
-    "update_reports_cache_daily": {
-        "task": "update_reports_cache",
-        "schedule": crontab(hour=0, minute=0),  # Запускать каждый день в 00:00
+    # Обновления отдельных пользователей распределяются по окну, а не стартуют разом в 00:00
+    "schedule_report_refreshes_daily": {
+        "task": "schedule_report_refreshes",
+        "schedule": crontab(hour=REFRESH_WINDOW_START_HOUR, minute=0),
+    },
+    # Токены обновляются заранее, до ночного обновления отчетов
+    "refresh_expiring_tokens_hourly": {
+        "task": "refresh_expiring_tokens",
+        "schedule": crontab(minute=30),
+    },
+    # Сырые визиты за вчера одной выгрузкой Logs API; Метрика дообрабатывает данные ночью
+    "ingest_metrica_logs_daily": {
+        "task": "ingest_metrica_logs",
+        "schedule": crontab(hour=5, minute=0),
     },
 }
@@ -0,0 +1,15 @@
+#!/bin/bash
+# Реплика для проверки чтений через DATABASE_REPLICA_URL: при первом запуске
+# копирует основную базу (pg_basebackup -R) и дальше работает как hot standby
+set -e
+
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+  until pg_isready -h postgres -U "$POSTGRES_USER"; do
+    sleep 1
+  done
+  PGPASSWORD="$POSTGRES_PASSWORD" pg_basebackup -h postgres -U "$POSTGRES_USER" -D "$PGDATA" -R -X stream
+  chown -R postgres:postgres "$PGDATA"
+  chmod 0700 "$PGDATA"
+fi
+
+exec docker-entrypoint.sh postgres
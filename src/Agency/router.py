@@ -0,0 +1,96 @@
+import os
+import asyncio
+import logging
+from typing import AsyncIterator
+
+import orjson
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+
+from src.Agency.schemas import BulkAccountsRequest
+from src.Campanies.service import get_campaigns
+from src.clients import get_redis_client
+from src.ReportsDirect.router import get_report_response_data
+from src.responses import ORJSON_OPTIONS
+from src.units import split_by_units
+from src.upstreams import local_deadline
+from src.Users.service import get_user_credentials
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/agency", tags=["agency"])
+
+# Сколько аккаунтов обрабатывается одновременно в одном запросе
+AGENCY_BULK_CONCURRENCY = int(os.getenv("AGENCY_BULK_CONCURRENCY", 10))
+# Маршрут потоковый и идет без общего дедлайна, поэтому у каждого аккаунта свой бюджет времени, секунд
+AGENCY_ACCOUNT_DEADLINE = float(os.getenv("AGENCY_ACCOUNT_DEADLINE", 30))
+# Пока обновление отчета аккаунта стоит в очереди, повторные запросы не ставят его снова, секунд
+AGENCY_REPORT_REFRESH_TTL = int(os.getenv("AGENCY_REPORT_REFRESH_TTL", 600))
+AGENCY_REPORT_REFRESH_KEY = "agency_report_refresh:{user_id}"
+
+
+async def request_report_refresh(user_id: int):
+    """Ставит обновление отчета в очередь Celery, не чаще раза в AGENCY_REPORT_REFRESH_TTL."""
+    from src.ReportsDirect.tasks import refresh_user_report
+
+    key = AGENCY_REPORT_REFRESH_KEY.format(user_id=user_id)
+    if await get_redis_client().set(key, 1, ex=AGENCY_REPORT_REFRESH_TTL, nx=True):
+        refresh_user_report.delay(user_id)
+
+
+async def load_account(user_id: int, request: BulkAccountsRequest) -> dict:
+    user = await get_user_credentials(user_id)
+    if not user:
+        return {"user_id": user_id, "error": "Пользователь не авторизован в Яндексе"}
+
+    account = {"user_id": user_id}
+    if request.campaigns:
+        # Аккаунты с почти исчерпанными баллами не трогаем, чтобы не мешать их интерактивной работе
+        _, deferred = await split_by_units([user.login] if user.login else [])
+        if deferred:
+            account["error"] = "Недостаточно баллов API Яндекс.Директ, запрос отложен"
+        else:
+            account["campaigns"] = await get_campaigns(user, field_names=request.field_names)
+    if request.reports:
+        cached = await get_report_response_data(get_redis_client(), user_id)
+        if cached:
+            # Отчет из кеша уже сериализован — вставляем его в строку ответа без разбора
+            account["report"] = orjson.Fragment(cached[0])
+        else:
+            # Директ формирует отчет минутами: поток его не ждет, отчет соберет воркер,
+            # а клиент заберет его следующим запросом
+            await request_report_refresh(user_id)
+            account["report_status"] = "pending"
+    return account
+
+
+async def stream_accounts(request: BulkAccountsRequest) -> AsyncIterator[bytes]:
+    semaphore = asyncio.Semaphore(AGENCY_BULK_CONCURRENCY)
+
+    async def load(user_id: int) -> dict:
+        # Учетные данные, баллы и вызовы Директа — все под общим ограничением параллельности
+        async with semaphore:
+            try:
+                with local_deadline(AGENCY_ACCOUNT_DEADLINE):
+                    return await load_account(user_id, request)
+            except HTTPException as e:
+                return {"user_id": user_id, "error": e.detail, "status_code": e.status_code}
+            except Exception as e:
+                logger.error(f"Ошибка при загрузке аккаунта user_id={user_id}: {e}")
+                return {"user_id": user_id, "error": str(e)}
+
+    tasks = [asyncio.create_task(load(user_id)) for user_id in dict.fromkeys(request.user_ids)]
+    try:
+        # Строки уходят клиенту по мере готовности, медленный аккаунт не задерживает остальные
+        for task in asyncio.as_completed(tasks):
+            account = await task
+            yield orjson.dumps(account, option=ORJSON_OPTIONS) + b"\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@router.post("/accounts", summary="Кампании и отчеты сразу по многим аккаунтам (NDJSON)")
+async def get_agency_accounts(request: BulkAccountsRequest):
+    return StreamingResponse(stream_accounts(request), media_type="application/x-ndjson")
@@ -0,0 +1,10 @@
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class BulkAccountsRequest(BaseModel):
+    user_ids: List[int] = Field(..., min_length=1, max_length=1000)
+    campaigns: bool = True
+    reports: bool = False
+    field_names: Optional[List[str]] = None
@@ -1,11 +1,11 @@
-from fastapi import Depends, HTTPException, APIRouter
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
-from src.database import get_db
-from src.Users.models import User
+from typing import List, Optional
+
+from fastapi import HTTPException, APIRouter, Query
+from src.Users.service import get_user_credentials
 import logging
 
-from src.utils import request_yandex_direct
+from src.Campanies.service import get_campaigns
+from src.units import get_units_metrics
 
 router = APIRouter()
 
@@ -13,26 +13,25 @@ logger = logging.getLogger(__name__)
 
 
 @router.get("/yandex/direct/campaigns")
-async def get_yandex_campaigns(user_id: int, db: AsyncSession = Depends(get_db), resource: str = "campaigns"):
+async def get_yandex_campaigns(
+    user_id: int,
+    resource: str = "campaigns",
+    field_names: Optional[List[str]] = Query(None, description="FieldNames, по умолчанию основные поля"),
+    ids: Optional[List[int]] = Query(None, description="Фильтр по Id"),
+    states: Optional[List[str]] = Query(None, description="Фильтр по State (ON, OFF, SUSPENDED, ...)"),
+):
     """Получение данных из Яндекс.Директ для указанного ресурса (например, кампании)."""
 
-    # Ищем пользователя по ID
-    result = await db.execute(select(User).where(User.id == user_id))
-    user = result.scalars().first()
+    # Ищем пользователя по ID (из кеша процесса, в БД только при промахе)
+    user = await get_user_credentials(user_id)
 
-    if not user or not user.access_token:
+    if not user:
         logger.warning(f"Пользователь {user_id} не найден или не авторизован в Яндексе")
         raise HTTPException(status_code=403, detail="Пользователь не авторизован в Яндексе")
 
-    # Делаем запрос в Яндекс.Директ API с динамическим ресурсом
-    response = await request_yandex_direct("get", user.access_token, resource, {
-        "SelectionCriteria": {},
-        "FieldNames": ["Id", "Name", "Status", "ClientInfo", "ExcludedSites", "NegativeKeywords"]
-    })
-
-    if response is None:
-        logger.error(f"Ошибка при получении данных из Яндекс.Директ для user_id={user_id}")
-        raise HTTPException(status_code=500, detail="Ошибка при получении данных из Яндекс.Директ")
+    return await get_campaigns(user, resource, field_names, ids, states)
 
-    return response
 
+@router.get("/yandex/direct/units", summary="Расход баллов API Яндекс.Директ по логинам")
+async def get_direct_units():
+    return {"logins": await get_units_metrics()}
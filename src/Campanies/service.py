@@ -0,0 +1,127 @@
+import os
+import json
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+import orjson
+from fastapi import HTTPException
+
+from src.cache import DIRECT_CACHE_TTL, add_tag_commands, direct_cache, user_tag
+from src.clients import get_redis_client
+from src.responses import make_etag
+from src.utils import request_yandex_direct_all_pages
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAMPAIGN_FIELDS = ["Id", "Name", "Status", "ClientInfo", "ExcludedSites", "NegativeKeywords"]
+
+CAMPAIGN_NAMES_KEY = "campaign_names:{user_id}"
+CAMPAIGN_NAMES_META_KEY = "campaign_names_meta:{user_id}"
+# Справочник Id -> Name кампаний; после истечения перечитывается из Директа
+CAMPAIGN_NAMES_TTL = int(os.getenv("CAMPAIGN_NAMES_TTL", 6 * 3600))
+
+
+async def get_campaigns(
+    user,
+    resource: str = "campaigns",
+    field_names: Optional[List[str]] = None,
+    ids: Optional[List[int]] = None,
+    states: Optional[List[str]] = None,
+) -> dict:
+    """Объекты ресурса Директа со всех страниц; ответ кэшируется на DIRECT_CACHE_TTL."""
+    selection_criteria = {}
+    if ids:
+        selection_criteria["Ids"] = ids
+    if states:
+        selection_criteria["States"] = states
+    params = {
+        "SelectionCriteria": selection_criteria,
+        "FieldNames": field_names or DEFAULT_CAMPAIGN_FIELDS,
+    }
+
+    # Повторные просмотры в пределах DIRECT_CACHE_TTL не тратят баллы
+    cache_key = direct_cache.key({"user_id": user.id, "resource": resource, **selection_criteria,
+                                  "FieldNames": params["FieldNames"]})
+    cached = await direct_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Делаем запрос в Яндекс.Директ API с динамическим ресурсом, проходя по всем страницам
+    response = await request_yandex_direct_all_pages("get", user.access_token, resource, params, login=user.login)
+
+    if response is None:
+        logger.error(f"Ошибка при получении данных из Яндекс.Директ для user_id={user.id}")
+        raise HTTPException(status_code=500, detail="Ошибка при получении данных из Яндекс.Директ")
+
+    if "error" not in response:
+        await direct_cache.set(cache_key, response, DIRECT_CACHE_TTL, tags=[user_tag(user.id)])
+        # Полный список кампаний с названиями заодно обновляет справочник для отчетов
+        if resource == "campaigns" and not selection_criteria and {"Id", "Name"} <= set(params["FieldNames"]):
+            await store_campaign_names(user.id, response.get("result", {}).get("Campaigns", []))
+
+    return response
+
+
+async def store_campaign_names(user_id: int, campaigns: list[dict]) -> dict:
+    """Сохраняет справочник Id -> Name кампаний пользователя и его ETag."""
+    names = {str(c["Id"]): c["Name"] for c in campaigns if "Id" in c and "Name" in c}
+    metadata = {
+        "etag": make_etag(orjson.dumps(names, option=orjson.OPT_SORT_KEYS)),
+        "updated_at": datetime.utcnow().isoformat(),
+    }
+
+    names_key = CAMPAIGN_NAMES_KEY.format(user_id=user_id)
+    async with get_redis_client().pipeline(transaction=True) as pipe:
+        pipe.delete(names_key)
+        if names:
+            pipe.hset(names_key, mapping=names)
+            pipe.expire(names_key, CAMPAIGN_NAMES_TTL)
+        pipe.setex(CAMPAIGN_NAMES_META_KEY.format(user_id=user_id), CAMPAIGN_NAMES_TTL, json.dumps(metadata))
+        add_tag_commands(
+            pipe,
+            [names_key, CAMPAIGN_NAMES_META_KEY.format(user_id=user_id)],
+            [user_tag(user_id)],
+            CAMPAIGN_NAMES_TTL,
+        )
+        await pipe.execute()
+    return metadata
+
+
+async def refresh_campaign_names(user) -> Optional[dict]:
+    response = await get_campaigns(user, field_names=["Id", "Name"])
+    if "error" in response:
+        logger.error(f"Не удалось обновить справочник кампаний user_id={user.id}: {response['error']}")
+        return None
+    return await store_campaign_names(user.id, response.get("result", {}).get("Campaigns", []))
+
+
+async def get_campaign_names_meta(user_id: int, user=None) -> Optional[dict]:
+    """Метаданные справочника (etag, updated_at); при отсутствии и известном user — перечитывает его."""
+    metadata = await get_redis_client().get(CAMPAIGN_NAMES_META_KEY.format(user_id=user_id))
+    if metadata:
+        return json.loads(metadata)
+    if user is None:
+        return None
+    try:
+        return await refresh_campaign_names(user)
+    except HTTPException as e:
+        logger.error(f"Справочник кампаний недоступен для user_id={user_id}: {e.detail}")
+        return None
+
+
+async def get_campaign_names(user_id: int) -> dict[str, str]:
+    names = await get_redis_client().hgetall(CAMPAIGN_NAMES_KEY.format(user_id=user_id))
+    return {
+        (k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+        for k, v in names.items()
+    }
+
+
+async def join_campaign_names(user_id: int, rows: list[dict]) -> list[dict]:
+    """Новые строки отчета с CampaignName по справочнику; исходные строки не меняются."""
+    names = await get_campaign_names(user_id)
+    return [
+        {**row, "CampaignName": names.get(row.get("CampaignId"), row.get("CampaignName", ""))}
+        for row in rows
+    ]
@@ -0,0 +1,158 @@
+import io
+import csv
+import logging
+from datetime import date, datetime, time
+from typing import AsyncIterator, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import BigInteger, Date, DateTime, Float, Integer, String, select
+
+from src.database import async_read_session
+from src.goals.models import GoalStatFinal
+from src.Metrica_goals.models import GoalStat
+from src.ReportsMetrica.models import TrafficSourceData
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/export", tags=["exports"])
+
+EXPORT_CHUNK_SIZE = 5000
+
+EXPORT_MODELS = {
+    "goal_stats_final": GoalStatFinal,
+    "goal_stats": GoalStat,
+    "traffic_source_data": TrafficSourceData,
+}
+
+
+def build_export_query(model, date1: Optional[date], date2: Optional[date], goal_id: Optional[int], counter_id: Optional[str]):
+    columns = model.__table__.columns
+    stmt = select(*columns).order_by(columns["date"], columns["id"])
+
+    date_column = columns["date"]
+    if date1 is not None:
+        stmt = stmt.where(date_column >= (datetime.combine(date1, time.min) if model is TrafficSourceData else date1))
+    if date2 is not None:
+        stmt = stmt.where(date_column <= (datetime.combine(date2, time.max) if model is TrafficSourceData else date2))
+    if goal_id is not None and "goal_id" in columns:
+        stmt = stmt.where(columns["goal_id"] == goal_id)
+    if counter_id is not None and "counter_id" in columns:
+        stmt = stmt.where(columns["counter_id"] == counter_id)
+
+    # yield_per включает серверный курсор: строки читаются из БД порциями
+    return stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE)
+
+
+ARROW_TYPES = {
+    Integer: pa.int64(),
+    BigInteger: pa.int64(),
+    Float: pa.float64(),
+    String: pa.string(),
+    Date: pa.date32(),
+    DateTime: pa.timestamp("us"),
+}
+
+
+def arrow_schema(model) -> pa.Schema:
+    """Схема Parquet по колонкам модели, чтобы типы не зависели от содержимого первой порции."""
+    return pa.schema([
+        pa.field(column.name, ARROW_TYPES[type(column.type)], nullable=column.nullable)
+        for column in model.__table__.columns
+    ])
+
+
+async def stream_partitions(stmt) -> AsyncIterator[tuple[list[str], list]]:
+    # Сессия открывается внутри генератора: он выполняется уже после выхода из обработчика
+    async with async_read_session() as session:
+        result = await session.stream(stmt)
+        columns = list(result.keys())
+        async for rows in result.partitions():
+            yield columns, rows
+
+
+async def stream_csv(stmt) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header_written = False
+
+    async for columns, rows in stream_partitions(stmt):
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+
+class _ChunkSink:
+    """Файлоподобный приемник для ParquetWriter, отдающий записанные байты порциями."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def stream_parquet(stmt, schema: pa.Schema) -> AsyncIterator[bytes]:
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+
+    async for columns, rows in stream_partitions(stmt):
+        # Каждая порция курсора становится отдельной row group
+        table = pa.Table.from_pylist([dict(zip(columns, row)) for row in rows], schema=schema)
+        writer.write_table(table)
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+
+@router.get("/{dataset}", summary="Потоковая выгрузка сохраненной статистики в CSV или Parquet")
+async def export_dataset(
+    dataset: str,
+    format: str = Query("csv", pattern="^(csv|parquet)$"),
+    date1: Optional[date] = Query(None),
+    date2: Optional[date] = Query(None),
+    goal_id: Optional[int] = Query(None),
+    counter_id: Optional[str] = Query(None),
+):
+    model = EXPORT_MODELS.get(dataset)
+    if model is None:
+        raise HTTPException(status_code=404, detail=f"Неизвестный набор данных: {dataset}")
+
+    stmt = build_export_query(model, date1, date2, goal_id, counter_id)
+
+    if format == "parquet":
+        body, media_type = stream_parquet(stmt, arrow_schema(model)), "application/vnd.apache.parquet"
+    else:
+        body, media_type = stream_csv(stmt), "text/csv; charset=utf-8"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{dataset}.{format}"'},
+    )
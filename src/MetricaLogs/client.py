@@ -0,0 +1,156 @@
+import os
+import glob
+import asyncio
+import logging
+from datetime import date
+from typing import AsyncIterator, Optional, Sequence
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from src.clients import get_http_client
+from src.metrica import metrica_limiter
+from src.upstreams import metrica_logs_gate
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+METRICA_LOGS_URL = os.getenv("METRICA_LOGS_URL", "https://api-metrika.yandex.net/management/v1/counter")
+METRICA_LOGS_TOKEN = os.getenv("METRICA_LOGS_TOKEN", os.getenv("API_TOKEN"))
+# Каталог с TSV-файлами вместо Logs API (для тестов и локальной разработки): <dir>/<counter_id>/*.tsv
+METRICA_LOGS_LOCAL_DIR = os.getenv("METRICA_LOGS_LOCAL_DIR")
+# Через сколько секунд задача снова проверит готовность выгрузки
+METRICA_LOGS_POLL_INTERVAL = float(os.getenv("METRICA_LOGS_POLL_INTERVAL", 60))
+# Сколько ждать подготовки выгрузки на стороне Метрики, секунд
+METRICA_LOGS_POLL_TIMEOUT = float(os.getenv("METRICA_LOGS_POLL_TIMEOUT", 3 * 3600))
+# Части выгрузки бывают по сотням мегабайт; таймаут на чтение очередного фрагмента
+METRICA_LOGS_DOWNLOAD_TIMEOUT = float(os.getenv("METRICA_LOGS_DOWNLOAD_TIMEOUT", 300))
+
+LOG_REQUEST_FAILED_STATUSES = {"canceled", "processing_failed", "cleaned_by_user", "cleaned_automatically_as_too_old"}
+
+
+class LogsAPIClient:
+    """
+    Клиент Logs API Метрики: оценка, создание, опрос, скачивание частей и очистка выгрузки.
+
+    Все вызовы идут через общий HTTP-клиент под собственным шлюзом metrica_logs_gate: скачивание части
+    занимает минуты и не должно отнимать слоты metrica_gate у интерактивных запросов к Метрике.
+    Общий metrica_limiter ограничивает только частоту запросов.
+    """
+
+    def __init__(self, token: str = METRICA_LOGS_TOKEN, base_url: str = METRICA_LOGS_URL):
+        self.base_url = base_url.rstrip("/")
+        self.headers = {"Authorization": f"OAuth {token}"}
+
+    def _url(self, counter_id: int, path: str) -> str:
+        return f"{self.base_url}/{counter_id}/{path}"
+
+    async def _request(self, method: str, url: str, params: Optional[dict] = None) -> dict:
+        async with metrica_logs_gate.slot(), metrica_limiter:
+            response = await get_http_client().request(method, url, params=params, headers=self.headers)
+
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail={"error": "Failed to call Yandex Metrika Logs API", "response": response.text},
+            )
+        return response.json()
+
+    async def evaluate(self, counter_id: int, date1: date, date2: date, fields: Sequence[str], source: str) -> bool:
+        params = {"date1": str(date1), "date2": str(date2), "fields": ",".join(fields), "source": source}
+        data = await self._request("GET", self._url(counter_id, "logrequests/evaluate"), params)
+        return data["log_request_evaluation"]["possible"]
+
+    async def create(self, counter_id: int, date1: date, date2: date, fields: Sequence[str], source: str) -> int:
+        params = {"date1": str(date1), "date2": str(date2), "fields": ",".join(fields), "source": source}
+        data = await self._request("POST", self._url(counter_id, "logrequests"), params)
+        return data["log_request"]["request_id"]
+
+    async def status(self, counter_id: int, request_id: int) -> dict:
+        data = await self._request("GET", self._url(counter_id, f"logrequest/{request_id}"))
+        return data["log_request"]
+
+    async def download_part(self, counter_id: int, request_id: int, part_number: int) -> AsyncIterator[str]:
+        """Строки части выгрузки, первая — заголовок с именами полей."""
+        url = self._url(counter_id, f"logrequest/{request_id}/part/{part_number}/download")
+        async with metrica_logs_gate.slot(), metrica_limiter:
+            async with get_http_client().stream(
+                "GET", url, headers=self.headers, timeout=METRICA_LOGS_DOWNLOAD_TIMEOUT
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise HTTPException(
+                        status_code=response.status_code,
+                        detail={"error": "Failed to download Logs API part", "response": response.text},
+                    )
+                async for line in response.aiter_lines():
+                    if line:
+                        yield line
+
+    async def clean(self, counter_id: int, request_id: int):
+        await self._request("POST", self._url(counter_id, f"logrequest/{request_id}/clean"))
+
+
+class LocalLogsClient:
+    """
+    Замена Logs API на файлы: каждая часть выгрузки — TSV-файл <dir>/<counter_id>/*.tsv
+    в формате Logs API (заголовок с полями ym:s:*). Выгрузка готова сразу,
+    из файлов отдаются только строки за запрошенный период.
+
+    Период зашит в request_id (YYYYMMDDYYYYMMDD), поэтому выгрузку, созданную одной задачей,
+    может скачать другая — как и у настоящего Logs API.
+    """
+
+    def __init__(self, directory: str = METRICA_LOGS_LOCAL_DIR):
+        self.directory = directory
+
+    def _parts(self, counter_id: int) -> list[str]:
+        return sorted(glob.glob(os.path.join(self.directory, str(counter_id), "*.tsv")))
+
+    async def evaluate(self, counter_id: int, date1: date, date2: date, fields: Sequence[str], source: str) -> bool:
+        return True
+
+    async def create(self, counter_id: int, date1: date, date2: date, fields: Sequence[str], source: str) -> int:
+        return int(f"{date1:%Y%m%d}{date2:%Y%m%d}")
+
+    @staticmethod
+    def _period(request_id: int) -> tuple[date, date]:
+        date1, date2 = divmod(request_id, 10 ** 8)
+        return (
+            date(date1 // 10000, date1 // 100 % 100, date1 % 100),
+            date(date2 // 10000, date2 // 100 % 100, date2 % 100),
+        )
+
+    async def status(self, counter_id: int, request_id: int) -> dict:
+        parts = self._parts(counter_id)
+        return {
+            "request_id": request_id,
+            "status": "processed",
+            "parts": [{"part_number": i, "size": os.path.getsize(path)} for i, path in enumerate(parts)],
+        }
+
+    async def download_part(self, counter_id: int, request_id: int, part_number: int) -> AsyncIterator[str]:
+        date1, date2 = self._period(request_id)
+        lines = await asyncio.to_thread(self._read_part, self._parts(counter_id)[part_number])
+        header = lines[0]
+        date_index = header.split("\t").index("ym:s:date")
+        yield header
+        for line in lines[1:]:
+            if line and date1 <= date.fromisoformat(line.split("\t")[date_index]) <= date2:
+                yield line
+
+    @staticmethod
+    def _read_part(path: str) -> list[str]:
+        with open(path, encoding="utf-8") as f:
+            return f.read().splitlines()
+
+    async def clean(self, counter_id: int, request_id: int):
+        pass
+
+
+def get_logs_client():
+    if METRICA_LOGS_LOCAL_DIR:
+        return LocalLogsClient()
+    return LogsAPIClient()
+
@@ -0,0 +1,29 @@
+from sqlalchemy import ARRAY, BigInteger, Boolean, Column, Date, DateTime, Index, Integer, Numeric, String
+from src.database import Base
+
+
+class MetricaVisit(Base):
+    """
+    Сырые визиты из Logs API Метрики.
+
+    Таблица секционирована по месяцам (PARTITION BY RANGE (date)); секции
+    создаются перед загрузкой, см. service.ensure_partitions.
+    """
+    __tablename__ = "metrica_visits"
+    __table_args__ = (
+        Index("ix_metrica_visits_counter_date", "counter_id", "date", "traffic_source"),
+        {"schema": "public", "postgresql_partition_by": "RANGE (date)"},
+    )
+
+    counter_id = Column(BigInteger, primary_key=True)
+    date = Column(Date, primary_key=True)
+    # visitID и clientID в Метрике — UInt64, в BIGINT не помещаются
+    visit_id = Column(Numeric(20, 0), primary_key=True)
+    client_id = Column(Numeric(20, 0))
+    date_time = Column(DateTime)
+    is_new_user = Column(Boolean)
+    page_views = Column(Integer)
+    visit_duration = Column(Integer)
+    bounce = Column(Boolean)
+    traffic_source = Column(String)
+    goals_id = Column(ARRAY(BigInteger))
@@ -0,0 +1,88 @@
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database import get_read_db
+from src.goals.router import build_goal_groups, get_goals, parse_goal_fields
+from src.MetricaLogs.service import goal_rows, traffic_source_rows
+from src.ReportsMetrica.router import clean_chart_row, clean_summary_row
+from src.responses import conditional_json_response
+from src.security import require_admin
+
+router = APIRouter(prefix="/metrika_logs", tags=["metrica_logs"])
+
+
+@router.get("/summary", summary="Сводка по источникам трафика из сырых визитов")
+async def get_logs_summary(
+    counter_id: int = Query(...),
+    date1: Optional[date] = Query(None, description="Начальная дата (по умолчанию начало месяца)"),
+    date2: Optional[date] = Query(None, description="Конечная дата (по умолчанию вчера)"),
+    session: AsyncSession = Depends(get_read_db),
+):
+    date1 = date1 or date.today().replace(day=1)
+    date2 = date2 or date.today() - timedelta(days=1)
+    rows = await traffic_source_rows(session, counter_id, date1, date2)
+    if not rows:
+        return {"error": "Нет данных за указанный период"}
+    return [clean_summary_row(row) for row in rows]
+
+
+@router.get("/chart", summary="Источники трафика по дням из сырых визитов")
+async def get_logs_chart(
+    counter_id: int = Query(...),
+    date1: date = Query(...),
+    date2: date = Query(...),
+    session: AsyncSession = Depends(get_read_db),
+):
+    rows = await traffic_source_rows(session, counter_id, date1, date2, by_date=True)
+    return sorted((clean_chart_row(row) for row in rows), key=lambda x: x["date"])
+
+
+@router.get("/goals", summary="Статистика по целям из сырых визитов")
+async def get_logs_goal_stats(
+    request: Request,
+    counter_id: int = Query(...),
+    date1: date = Query(...),
+    date2: date = Query(...),
+    group_by: str = Query("day", pattern="^(day|week|month)$"),
+    goal_ids_filter: Optional[List[int]] = Query(None),
+    fields: Optional[List[str]] = Query(
+        None, description="Какие метрики вернуть: reaches, conversion_rate, visits (по умолчанию все)"
+    ),
+    session: AsyncSession = Depends(get_read_db),
+) -> Dict:
+    fields = parse_goal_fields(fields)
+    all_goals = await get_goals(str(counter_id))
+    filtered_goals = {
+        gid: name for gid, name in all_goals.items()
+        if (goal_ids_filter is None or gid in goal_ids_filter)
+    }
+    goal_ids = list(filtered_goals.keys())
+
+    if not goal_ids:
+        raise HTTPException(status_code=400, detail="No goals found for the given filter")
+
+    rows = await goal_rows(session, counter_id, goal_ids, date1, date2, fields)
+    result = build_goal_groups(rows, goal_ids, date1, date2, group_by, fields)
+
+    return conditional_json_response(request, {
+        "goal_meta": [{"id": gid, "name": filtered_goals[gid]} for gid in goal_ids],
+        "data": result
+    })
+
+
+@router.post("/ingest", summary="Запустить загрузку визитов из Logs API", dependencies=[Depends(require_admin)])
+async def start_logs_ingest(
+    counter_id: int = Query(...),
+    date1: date = Query(...),
+    date2: date = Query(...),
+):
+    from src.MetricaLogs.tasks import ingest_metrica_logs
+
+    if date2 < date1 or date2 >= date.today():
+        raise HTTPException(status_code=400, detail="Logs API отдает данные только за завершенные дни, date1 <= date2")
+
+    task = ingest_metrica_logs.delay(counter_id, str(date1), str(date2))
+    return {"task_id": task.id}
@@ -0,0 +1,276 @@
+import os
+import logging
+from datetime import date, timedelta
+from typing import AsyncIterator, Sequence
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database import async_session
+from src.MetricaLogs.client import get_logs_client
+from src.tracing import traced
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+METRICA_LOGS_SOURCE = "visits"
+# Размер порции данных, передаваемой в COPY
+METRICA_LOGS_COPY_CHUNK_BYTES = int(os.getenv("METRICA_LOGS_COPY_CHUNK_BYTES", 1024 * 1024))
+
+VISITS_TABLE = "metrica_visits"
+# Поле Logs API -> столбец metrica_visits
+VISIT_FIELDS = {
+    "ym:s:visitID": "visit_id",
+    "ym:s:clientID": "client_id",
+    "ym:s:date": "date",
+    "ym:s:dateTime": "date_time",
+    "ym:s:isNewUser": "is_new_user",
+    "ym:s:pageViews": "page_views",
+    "ym:s:visitDuration": "visit_duration",
+    "ym:s:bounce": "bounce",
+    # Атрибуция «последний значимый переход» — как у ym:s:trafficSource в stat/v1/data
+    "ym:s:lastsignTrafficSource": "traffic_source",
+    "ym:s:goalsID": "goals_id",
+}
+COPY_COLUMNS = ["counter_id", *VISIT_FIELDS.values()]
+
+# Logs API отдает коды источников, stat/v1/data — их названия; наружу отдаем названия, как раньше
+TRAFFIC_SOURCE_NAMES = {
+    "ad": "Переходы по рекламе",
+    "direct": "Прямые заходы",
+    "email": "Переходы по ссылкам из писем",
+    "internal": "Внутренние переходы",
+    "messenger": "Переходы из мессенджеров",
+    "organic": "Переходы из поисковых систем",
+    "qrcode": "Переходы по QR-коду",
+    "recommend": "Переходы из рекомендательных систем",
+    "referral": "Переходы по ссылкам на сайтах",
+    "saved": "Переходы с сохранённых страниц",
+    "social": "Переходы из социальных сетей",
+    "undefined": "Не определено",
+}
+
+
+def _copy_value(column: str, value: str) -> str:
+    """Значение TSV Logs API -> значение текстового формата COPY (экранирование у них совпадает)."""
+    if column == "goals_id":
+        # [1,2] -> {1,2}
+        return "{" + value.strip("[]") + "}"
+    if value == "" and column != "traffic_source":
+        return r"\N"
+    return value
+
+
+async def iter_copy_chunks(lines: AsyncIterator[str], counter_id: int) -> AsyncIterator[bytes]:
+    """
+    Преобразует строки части выгрузки в порции для COPY ... FROM STDIN.
+
+    Порядок полей берется из заголовка части, поэтому не зависит от порядка fields в запросе.
+    """
+    indexes = None
+    buffer, size = [], 0
+    async for line in lines:
+        values = line.split("\t")
+        if indexes is None:
+            indexes = [(values.index(field), column) for field, column in VISIT_FIELDS.items()]
+            continue
+
+        row = "\t".join([str(counter_id), *(_copy_value(column, values[i]) for i, column in indexes)]) + "\n"
+        buffer.append(row)
+        size += len(row)
+        if size >= METRICA_LOGS_COPY_CHUNK_BYTES:
+            yield "".join(buffer).encode()
+            buffer, size = [], 0
+
+    if buffer:
+        yield "".join(buffer).encode()
+
+
+def month_partitions(date1: date, date2: date) -> list[tuple[str, date, date]]:
+    """Секции (имя, начало, конец не включительно), покрывающие [date1, date2]."""
+    partitions = []
+    start = date1.replace(day=1)
+    while start <= date2:
+        end = (start + timedelta(days=32)).replace(day=1)
+        partitions.append((f"{VISITS_TABLE}_y{start.year}m{start.month:02d}", start, end))
+        start = end
+    return partitions
+
+
+async def ensure_partitions(session: AsyncSession, date1: date, date2: date):
+    for name, start, end in month_partitions(date1, date2):
+        await session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS public.{name} PARTITION OF public.{VISITS_TABLE} "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        ))
+
+
+async def copy_visits(session: AsyncSession, counter_id: int, lines: AsyncIterator[str]) -> int:
+    """Загружает часть выгрузки через COPY драйвера asyncpg, не собирая ее в памяти."""
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    status = await raw_connection.driver_connection.copy_to_table(
+        VISITS_TABLE,
+        source=iter_copy_chunks(lines, counter_id),
+        columns=COPY_COLUMNS,
+        schema_name="public",
+        format="text",
+    )
+    # asyncpg возвращает статус команды: "COPY <n>"
+    return int(status.split()[-1])
+
+
+@traced()
+async def create_visits_export(counter_id: int, date1: date, date2: date) -> int:
+    """Заказывает в Logs API выгрузку визитов счетчика за [date1, date2] и возвращает ее request_id."""
+    client = get_logs_client()
+    fields = list(VISIT_FIELDS)
+
+    if not await client.evaluate(counter_id, date1, date2, fields, METRICA_LOGS_SOURCE):
+        raise HTTPException(status_code=400, detail=f"Logs API не может подготовить выгрузку счетчика {counter_id} за {date1} — {date2}")
+    return await client.create(counter_id, date1, date2, fields, METRICA_LOGS_SOURCE)
+
+
+async def visits_export_state(counter_id: int, request_id: int) -> tuple[str, list[int]]:
+    """Статус выгрузки и номера ее частей (части есть только у статуса processed)."""
+    log_request = await get_logs_client().status(counter_id, request_id)
+    return log_request["status"], [part["part_number"] for part in log_request.get("parts", [])]
+
+
+async def clean_visits_export(counter_id: int, request_id: int):
+    """Удаляет выгрузку на стороне Метрики; ошибка очистки не должна ронять загрузку."""
+    try:
+        await get_logs_client().clean(counter_id, request_id)
+    except Exception as e:
+        logger.warning(f"Не удалось очистить выгрузку Logs API {request_id}: {e}")
+
+
+@traced()
+async def load_visits_export(counter_id: int, request_id: int, date1: date, date2: date, parts: Sequence[int]) -> int:
+    """
+    Загружает готовую выгрузку визитов счетчика за [date1, date2] в metrica_visits.
+
+    Период перезаписывается целиком в одной транзакции, поэтому повторный запуск
+    за те же даты безопасен. Возвращает число загруженных визитов.
+    """
+    client = get_logs_client()
+    loaded = 0
+    try:
+        async with async_session() as session:
+            async with session.begin():
+                await ensure_partitions(session, date1, date2)
+                await session.execute(
+                    text(f"DELETE FROM public.{VISITS_TABLE} WHERE counter_id = :counter_id AND date BETWEEN :date1 AND :date2"),
+                    {"counter_id": counter_id, "date1": date1, "date2": date2},
+                )
+                for part_number in parts:
+                    loaded += await copy_visits(session, counter_id, client.download_part(counter_id, request_id, part_number))
+    finally:
+        await clean_visits_export(counter_id, request_id)
+
+    logger.info(f"Счетчик {counter_id}: загружено {loaded} визитов за {date1} — {date2}")
+    return loaded
+
+
+TRAFFIC_SOURCE_SQL = """
+    SELECT traffic_source{date_column},
+           count(*) AS visits,
+           count(DISTINCT client_id) AS users,
+           avg(bounce::int) * 100 AS bounce_rate,
+           avg(page_views) AS page_depth,
+           avg(visit_duration) AS avg_visit_duration
+    FROM public.metrica_visits
+    WHERE counter_id = :counter_id AND date BETWEEN :date1 AND :date2
+    GROUP BY traffic_source{date_column}
+"""
+
+GOALS_SQL = """
+    WITH totals AS (
+        SELECT date, count(*) AS visits
+        FROM public.metrica_visits
+        WHERE counter_id = :counter_id AND date BETWEEN :date1 AND :date2
+        GROUP BY date
+    ),
+    reached AS (
+        SELECT v.date, g.goal_id, count(*) AS reaches, count(DISTINCT v.visit_id) AS visits
+        FROM public.metrica_visits v
+        CROSS JOIN LATERAL unnest(v.goals_id) AS g(goal_id)
+        WHERE v.counter_id = :counter_id AND v.date BETWEEN :date1 AND :date2
+          AND v.goals_id && CAST(:goal_ids AS BIGINT[])
+          AND g.goal_id = ANY(CAST(:goal_ids AS BIGINT[]))
+        GROUP BY v.date, g.goal_id
+    )
+    SELECT r.date, r.goal_id, r.reaches, r.visits, r.visits * 100.0 / t.visits AS conversion_rate
+    FROM reached r
+    JOIN totals t ON t.date = r.date
+"""
+
+
+@traced()
+async def traffic_source_rows(
+    session: AsyncSession, counter_id: int, date1: date, date2: date, by_date: bool = False
+) -> list[dict]:
+    """
+    Сводка по источникам трафика из сырых визитов в формате строк stat/v1/data
+    (dimensions: источник[, дата]; metrics: visits, users, bounceRate, pageDepth, avgVisitDurationSeconds),
+    чтобы ответы собирались теми же clean_chart_row / clean_summary_row.
+    """
+    sql = TRAFFIC_SOURCE_SQL.format(date_column=", date" if by_date else "")
+    result = await session.execute(text(sql), {"counter_id": counter_id, "date1": date1, "date2": date2})
+
+    rows = []
+    for row in result.mappings():
+        dimensions = [{"name": TRAFFIC_SOURCE_NAMES.get(row["traffic_source"], row["traffic_source"])}]
+        if by_date:
+            dimensions.append({"name": str(row["date"])})
+        rows.append({
+            "dimensions": dimensions,
+            "metrics": [
+                float(row["visits"]),
+                float(row["users"]),
+                float(row["bounce_rate"] or 0),
+                float(row["page_depth"] or 0),
+                float(row["avg_visit_duration"] or 0),
+            ],
+        })
+    return rows
+
+
+@traced()
+async def goal_rows(
+    session: AsyncSession,
+    counter_id: int,
+    goal_ids: Sequence[int],
+    date1: date,
+    date2: date,
+    fields: Sequence[str],
+) -> list[dict]:
+    """
+    Достижения целей по дням из сырых визитов в формате строк stat/v1/data для build_goal_groups:
+    метрики идут по целям, внутри цели — в порядке fields.
+    """
+    result = await session.execute(
+        text(GOALS_SQL),
+        {"counter_id": counter_id, "date1": date1, "date2": date2, "goal_ids": list(goal_ids)},
+    )
+
+    by_date: dict[str, dict[int, dict]] = {}
+    for row in result.mappings():
+        by_date.setdefault(str(row["date"]), {})[row["goal_id"]] = {
+            "reaches": row["reaches"],
+            "visits": row["visits"],
+            "conversion_rate": float(row["conversion_rate"]),
+        }
+
+    rows = []
+    for date_str in sorted(by_date):
+        goals = by_date[date_str]
+        metrics = []
+        for goal_id in goal_ids:
+            values = goals.get(goal_id, {})
+            metrics += [values.get(field, 0.0 if field == "conversion_rate" else 0) for field in fields]
+        rows.append({"dimensions": [{"name": date_str}], "metrics": metrics})
+    return rows
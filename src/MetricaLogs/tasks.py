@@ -0,0 +1,90 @@
+import os
+import time
+import logging
+from datetime import date, timedelta
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from src.MetricaLogs.client import LOG_REQUEST_FAILED_STATUSES, METRICA_LOGS_POLL_INTERVAL, METRICA_LOGS_POLL_TIMEOUT
+from src.MetricaLogs.service import (
+    clean_visits_export,
+    create_visits_export,
+    load_visits_export,
+    visits_export_state,
+)
+from src.ReportsDirect.celery import celery_app, run_async
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+METRICA_LOGS_COUNTER_IDS = [
+    int(counter_id) for counter_id in os.getenv("METRICA_LOGS_COUNTER_IDS", "181494,72372934").split(",") if counter_id
+]
+
+
+@celery_app.task(name="ingest_metrica_logs")
+def ingest_metrica_logs(counter_id: Optional[int] = None, date1: Optional[str] = None, date2: Optional[str] = None):
+    """
+    Заказывает выгрузки сырых визитов из Logs API. По умолчанию — вчерашний день всех счетчиков
+    METRICA_LOGS_COUNTER_IDS: одна выгрузка вместо сотен запросов агрегатов к stat/v1/data.
+
+    Готовность выгрузок проверяет load_metrica_logs, поэтому задача не ждет Метрику.
+    """
+    yesterday = date.today() - timedelta(days=1)
+    date1 = date.fromisoformat(date1) if date1 else yesterday
+    date2 = date.fromisoformat(date2) if date2 else date1
+    counter_ids = [counter_id] if counter_id else METRICA_LOGS_COUNTER_IDS
+
+    requests = {}
+    for counter_id in counter_ids:
+        try:
+            request_id = run_async(create_visits_export(counter_id, date1, date2))
+        except Exception as e:
+            logger.error(f"Ошибка заказа выгрузки визитов счетчика {counter_id} за {date1} — {date2}: {e}")
+            continue
+        load_metrica_logs.apply_async(
+            args=[counter_id, request_id, str(date1), str(date2), time.time()],
+            countdown=METRICA_LOGS_POLL_INTERVAL,
+        )
+        requests[counter_id] = request_id
+    return requests
+
+
+@celery_app.task(name="load_metrica_logs")
+def load_metrica_logs(counter_id: int, request_id: int, date1: str, date2: str, requested_at: float):
+    """
+    Загружает выгрузку, если Метрика ее подготовила. Пока выгрузка готовится, задача
+    перепланирует себя с countdown, а не спит в воркере.
+    """
+    try:
+        status, parts = run_async(visits_export_state(counter_id, request_id))
+    except Exception as e:
+        logger.warning(f"Не удалось получить статус выгрузки Logs API {request_id}: {e}")
+        status, parts = None, []
+
+    if status == "processed":
+        try:
+            return run_async(load_visits_export(
+                counter_id, request_id, date.fromisoformat(date1), date.fromisoformat(date2), parts
+            ))
+        except Exception as e:
+            logger.error(f"Ошибка загрузки визитов счетчика {counter_id} за {date1} — {date2}: {e}")
+            return None
+
+    if status in LOG_REQUEST_FAILED_STATUSES:
+        logger.error(f"Выгрузка Logs API {request_id} счетчика {counter_id} завершилась со статусом {status}")
+        return None
+
+    if time.time() - requested_at > METRICA_LOGS_POLL_TIMEOUT:
+        logger.error(f"Выгрузка Logs API {request_id} счетчика {counter_id} не готова за отведенное время")
+        run_async(clean_visits_export(counter_id, request_id))
+        return None
+
+    logger.info(f"Выгрузка Logs API {request_id} счетчика {counter_id}: {status}, проверим позже")
+    load_metrica_logs.apply_async(
+        args=[counter_id, request_id, date1, date2, requested_at],
+        countdown=METRICA_LOGS_POLL_INTERVAL,
+    )
+    return None
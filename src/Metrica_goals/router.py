@@ -1,9 +1,9 @@
-from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi import APIRouter, HTTPException, Query, Depends, Request
 from pydantic import BaseModel
 from datetime import datetime, timedelta
 import httpx
 import os
-from typing import Optional, Annotated
+from typing import Annotated
 from aiolimiter import AsyncLimiter
 
 
@@ -13,7 +13,11 @@ from collections import defaultdict
 from sqlalchemy import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database import get_db
+from src.cache import counter_tag, goal_tag, metrica_cache, range_tags
+from src.clients import get_http_client
+from src.database import async_session, get_read_db, replica_engine
+from src.responses import conditional_json_response
+from src.upstreams import metrica_gate, upstream_timeout
 from .models import GoalStat
 
 router = APIRouter(
@@ -43,8 +47,8 @@ async def fetch_goals(client: httpx.AsyncClient, counter_id: int) -> list[dict]:
     url = f"https://api-metrika.yandex.ru/management/v1/counter/{counter_id}/goals"
     headers = {"Authorization": f"OAuth {YANDEX_OAUTH_TOKEN}"}
 
-    async with yandex_limiter:
-        response = await client.get(url, headers=headers)
+    async with metrica_gate.slot(), yandex_limiter:
+        response = await client.get(url, headers=headers, timeout=upstream_timeout())
     response.raise_for_status()
     goals = response.json().get("goals", [])
     return [g for g in goals if g["id"] in INTERESTING_GOALS]
@@ -62,14 +66,18 @@ async def fetch_goal_stats(client: httpx.AsyncClient, counter_id: int, goal_id:
         "accuracy": "full"
     }
 
-    async with yandex_limiter:
-        response = await client.get(url, headers=headers, params=params)
-    response.raise_for_status()
+    async def fetch():
+        async with metrica_gate.slot(), yandex_limiter:
+            response = await client.get(url, headers=headers, params=params, timeout=upstream_timeout())
+        response.raise_for_status()
 
-    try:
-        return int(response.json().get("totals", [0])[0])
-    except (IndexError, ValueError, KeyError):
-        return 0
+        try:
+            return int(response.json().get("totals", [0])[0])
+        except (IndexError, ValueError, KeyError):
+            return 0
+
+    tags = [counter_tag(counter_id), goal_tag(goal_id), *range_tags(date1, date2)]
+    return await metrica_cache.get_or_fetch(params, date2, fetch, tags=tags)
 
 
 def get_month_ranges(start_date: datetime, end_date: datetime) -> list[tuple[str, str, str, datetime]]:
@@ -96,92 +104,109 @@ def get_month_ranges(start_date: datetime, end_date: datetime) -> list[tuple[str
     return ranges
 
 
-@router.get("/", response_model=dict[str, list[GoalInfo]])
+async def load_goal_stats(db: AsyncSession, goal_ids: list[int], dates: list) -> dict:
+    stmt = select(GoalStat).where(
+        GoalStat.goal_id.in_(goal_ids),
+        GoalStat.date.in_(dates)
+    )
+    result_from_db = await db.execute(stmt)
+    return {(row.goal_id, row.date): row for row in result_from_db.scalars().all()}
+
+
+# Ответ собирается заранее сериализованным (conditional_json_response) и не валидируется,
+# поэтому схема только документируется
+@router.get("/", responses={200: {"model": dict[str, list[GoalInfo]]}})
 async def get_goals_by_date_range(
+        request: Request,
         start_date: Annotated[datetime, Query()],
         end_date: Annotated[datetime, Query()],
-        db: AsyncSession = Depends(get_db)
+        db: AsyncSession = Depends(get_read_db)
 ):
     if start_date > end_date:
         raise HTTPException(status_code=400, detail="Start date must be before end date")
 
     try:
-        async with httpx.AsyncClient() as client:
-            goals = await fetch_goals(client, COUNTER_ID)
-            month_ranges = get_month_ranges(start_date, end_date)
-
-            if not month_ranges:
-                return {}
-
-            # Список всех дат и ID целей
-            all_dates = [date for _, _, _, date in month_ranges]
-            goal_ids = [goal["id"] for goal in goals]
-
-            # Получаем уже сохранённые значения из базы
-            stmt = select(GoalStat).where(
-                GoalStat.goal_id.in_(goal_ids),
-                GoalStat.date.in_(all_dates)
-            )
-            result_from_db = await db.execute(stmt)
-            existing_stats = result_from_db.scalars().all()
-            existing_map = {(row.goal_id, row.date): row for row in existing_stats}
-
-            result = defaultdict(list)
-            stats_to_add = []
-
-            for month_str, from_date, to_date, db_date in month_ranges:
-                month_data = []
-
-                for goal in goals:
-                    key = (goal["id"], db_date)
-
-                    if key in existing_map:
-                        # Уже есть в базе — не запрашиваем повторно
-                        row = existing_map[key]
-                        month_data.append(GoalInfo(
-                            id=row.goal_id,
-                            name=row.goal_name,
-                            type=row.goal_type,
-                            conversions=row.conversions
-                        ))
-                    else:
-                        # Нет в базе — делаем запрос
-                        conversions = await fetch_goal_stats(client, COUNTER_ID, goal["id"], from_date, to_date)
-
-                        stats_to_add.append(GoalStat(
-                            goal_id=goal["id"],
-                            goal_name=goal["name"],
-                            goal_type=goal["type"],
-                            conversions=conversions,
-                            date=db_date
-                        ))
-
-                        month_data.append(GoalInfo(
-                            id=goal["id"],
-                            name=goal["name"],
-                            type=goal["type"],
-                            conversions=conversions
-                        ))
-
-                result[month_str] = month_data
-
-        # Добавляем в базу только то, чего ещё не было
+        client = get_http_client()
+        goals = await fetch_goals(client, COUNTER_ID)
+        month_ranges = get_month_ranges(start_date, end_date)
+
+        if not month_ranges:
+            return {}
+
+        # Список всех дат и ID целей
+        all_dates = [date for _, _, _, date in month_ranges]
+        goal_ids = [goal["id"] for goal in goals]
+
+        # Получаем уже сохранённые значения из базы (реплики, если она настроена)
+        existing_map = await load_goal_stats(db, goal_ids, all_dates)
+        needed = {(goal_id, db_date) for goal_id in goal_ids for db_date in all_dates}
+        if replica_engine is not None and not needed <= existing_map.keys():
+            # Реплика может отставать: недостающее перепроверяем в основной базе до запросов
+            # к Метрике, иначе только что сохраненные месяцы записались бы повторно
+            async with async_session() as primary:
+                existing_map = await load_goal_stats(primary, goal_ids, all_dates)
+
+        result = defaultdict(list)
+        stats_to_add = []
+
+        for month_str, from_date, to_date, db_date in month_ranges:
+            month_data = []
+
+            for goal in goals:
+                key = (goal["id"], db_date)
+
+                if key in existing_map:
+                    # Уже есть в базе — не запрашиваем повторно
+                    row = existing_map[key]
+                    month_data.append({
+                        "id": row.goal_id,
+                        "name": row.goal_name,
+                        "type": row.goal_type,
+                        "conversions": row.conversions
+                    })
+                else:
+                    # Нет в базе — делаем запрос
+                    conversions = await fetch_goal_stats(client, COUNTER_ID, goal["id"], from_date, to_date)
+
+                    stats_to_add.append(GoalStat(
+                        goal_id=goal["id"],
+                        goal_name=goal["name"],
+                        goal_type=goal["type"],
+                        conversions=conversions,
+                        date=db_date
+                    ))
+
+                    month_data.append({
+                        "id": goal["id"],
+                        "name": goal["name"],
+                        "type": goal["type"],
+                        "conversions": conversions
+                    })
+
+            result[month_str] = month_data
+
+        # Добавляем в базу только то, чего ещё не было; запись — всегда в основную базу
         if stats_to_add:
-            await db.execute(insert(GoalStat).values([
-                {
-                    "goal_id": s.goal_id,
-                    "goal_name": s.goal_name,
-                    "goal_type": s.goal_type,
-                    "conversions": s.conversions,
-                    "date": s.date
-                } for s in stats_to_add
-            ]))
-            await db.commit()
-
-        return result
+            async with async_session() as primary:
+                await primary.execute(insert(GoalStat).values([
+                    {
+                        "goal_id": s.goal_id,
+                        "goal_name": s.goal_name,
+                        "goal_type": s.goal_type,
+                        "conversions": s.conversions,
+                        "date": s.date
+                    } for s in stats_to_add
+                ]))
+                await primary.commit()
+
+        # Схема ответа описана в responses=, сами данные уже имеют нужную форму
+        return conditional_json_response(request, result)
 
     except httpx.HTTPStatusError as e:
         raise HTTPException(status_code=e.response.status_code, detail=f"Yandex API error: {e.response.text}")
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
@@ -0,0 +1,233 @@
+import os
+import json
+import fcntl
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+logger = logging.getLogger(__name__)
+
+# Локальный архив закрытых дней отчета Директа: файлы Arrow IPC по пользователю и месяцу.
+# Файлы читаются через memory map, поэтому воркеры на одной машине делят page cache.
+REPORT_ARCHIVE_DIR = os.getenv("REPORT_ARCHIVE_DIR", "data/report_archive")
+REPORT_ARCHIVE_MAX_BYTES = int(os.getenv("REPORT_ARCHIVE_MAX_BYTES", 1024 ** 3))
+# Директ может уточнять статистику задним числом; дни старше этого считаются закрытыми
+REPORT_SETTLE_DAYS = int(os.getenv("REPORT_SETTLE_DAYS", 3))
+
+ARCHIVE_SUFFIX = ".arrow"
+ARCHIVE_LOCK_NAME = ".lock"
+COVERAGE_METADATA_KEY = b"covered"
+
+
+def closed_date_border(today: Optional[date] = None) -> date:
+    """Последний день, статистика за который уже не меняется."""
+    return (today or date.today()) - timedelta(days=REPORT_SETTLE_DAYS)
+
+
+def _month_path(user_id: int, month: str) -> str:
+    return os.path.join(REPORT_ARCHIVE_DIR, str(user_id), f"{month}{ARCHIVE_SUFFIX}")
+
+
+def _month_ranges(date1: date, date2: date) -> list[tuple[str, date, date]]:
+    """Делит [date1, date2] на куски по календарным месяцам: (YYYY-MM, начало, конец)."""
+    ranges = []
+    current = date1
+    while current <= date2:
+        next_month = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+        month_end = min(next_month - timedelta(days=1), date2)
+        ranges.append((current.strftime("%Y-%m"), current, month_end))
+        current = month_end + timedelta(days=1)
+    return ranges
+
+
+def _merge_intervals(intervals: list[tuple[date, date]]) -> list[tuple[date, date]]:
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _is_covered(intervals: list[tuple[date, date]], date1: date, date2: date) -> bool:
+    return any(start <= date1 and date2 <= end for start, end in intervals)
+
+
+def _read_table(path: str) -> Optional[pa.Table]:
+    try:
+        with pa.memory_map(path, "r") as source:
+            return pa.ipc.open_file(source).read_all()
+    except FileNotFoundError:
+        return None
+
+
+def _coverage(table: pa.Table) -> list[tuple[date, date]]:
+    metadata = table.schema.metadata or {}
+    raw = metadata.get(COVERAGE_METADATA_KEY)
+    if not raw:
+        return []
+    return [(date.fromisoformat(start), date.fromisoformat(end)) for start, end in json.loads(raw)]
+
+
+def _write_table(path: str, rows: list[dict], coverage: list[tuple[date, date]]):
+    columns = sorted({key for row in rows for key in row})
+    schema = pa.schema(
+        [pa.field(name, pa.string()) for name in columns],
+        metadata={COVERAGE_METADATA_KEY: json.dumps([[str(start), str(end)] for start, end in coverage])},
+    )
+    table = pa.Table.from_pylist(rows, schema=schema)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            writer.write_table(table)
+    # Читатели, успевшие открыть старый файл, продолжают работать со своей копией
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _user_write_lock(user_id: int):
+    """
+    Эксклюзивная блокировка записи архива пользователя (между потоками и процессами на машине).
+
+    Запись — это чтение, слияние покрытия и замена файла; без блокировки
+    параллельные записи теряют интервалы друг друга.
+    """
+    user_dir = os.path.join(REPORT_ARCHIVE_DIR, str(user_id))
+    os.makedirs(user_dir, exist_ok=True)
+    with open(os.path.join(user_dir, ARCHIVE_LOCK_NAME), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _archive_files() -> list[tuple[float, int, str]]:
+    files = []
+    for root, _, names in os.walk(REPORT_ARCHIVE_DIR):
+        for name in names:
+            if not name.endswith(ARCHIVE_SUFFIX):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    return files
+
+
+def _evict(max_bytes: int = REPORT_ARCHIVE_MAX_BYTES) -> int:
+    """Удаляет давно не читавшиеся файлы, пока архив не уложится в max_bytes."""
+    files = sorted(_archive_files())
+    total = sum(size for _, size, _ in files)
+    evicted = 0
+    for _, size, path in files:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        evicted += 1
+    if evicted:
+        logger.info(f"Из архива отчетов удалено файлов: {evicted}")
+    return evicted
+
+
+def store_report_rows(user_id: int, rows: list[dict], date1: date, date2: date) -> int:
+    """
+    Сохраняет закрытые дни отчета за период [date1, date2].
+
+    Строки внутри периода заменяют ранее сохраненные, покрытие месяца
+    запоминается в метаданных файла. Возвращает число записанных файлов.
+    """
+    date2 = min(date2, closed_date_border())
+    if date1 > date2:
+        return 0
+
+    rows_by_month = defaultdict(list)
+    for row in rows:
+        day = row.get("Date")
+        if day and str(date1) <= day <= str(date2):
+            rows_by_month[day[:7]].append(row)
+
+    written = 0
+    with _user_write_lock(user_id):
+        for month, month_start, month_end in _month_ranges(date1, date2):
+            path = _month_path(user_id, month)
+            existing = _read_table(path)
+            coverage = [(month_start, month_end)]
+            month_rows = rows_by_month.get(month, [])
+            if existing is not None:
+                coverage += _coverage(existing)
+                month_rows = [
+                    row for row in existing.to_pylist()
+                    if not str(month_start) <= row["Date"] <= str(month_end)
+                ] + month_rows
+            month_rows.sort(key=lambda row: row["Date"])
+            _write_table(path, month_rows, _merge_intervals(coverage))
+            written += 1
+
+    _evict()
+    return written
+
+
+def read_report_rows(user_id: int, date1: date, date2: date) -> Optional[list[dict]]:
+    """
+    Строки отчета за [date1, date2] из архива или None, если период покрыт не полностью.
+    """
+    if date2 > closed_date_border():
+        return None
+
+    tables = []
+    for month, month_start, month_end in _month_ranges(date1, date2):
+        path = _month_path(user_id, month)
+        table = _read_table(path)
+        if table is None or not _is_covered(_coverage(table), month_start, month_end):
+            return None
+        # mtime служит отметкой последнего чтения для вытеснения
+        os.utime(path)
+        mask = pc.and_(
+            pc.greater_equal(table["Date"], str(month_start)),
+            pc.less_equal(table["Date"], str(month_end)),
+        ) if "Date" in table.column_names else None
+        tables.append(table.filter(mask) if mask is not None else table)
+
+    return [row for table in tables for row in table.to_pylist()]
+
+
+def delete_user_archive(user_id: int):
+    user_dir = os.path.join(REPORT_ARCHIVE_DIR, str(user_id))
+    if not os.path.isdir(user_dir):
+        return
+    with _user_write_lock(user_id):
+        for name in os.listdir(user_dir):
+            if name.endswith(ARCHIVE_SUFFIX):
+                os.remove(os.path.join(user_dir, name))
+
+
+async def store_report_rows_async(user_id: int, rows: list[dict], date1: date, date2: date) -> int:
+    try:
+        return await asyncio.to_thread(store_report_rows, user_id, rows, date1, date2)
+    except Exception as e:
+        logger.error(f"Не удалось сохранить отчет user_id={user_id} в архив: {e}")
+        return 0
+
+
+async def read_report_rows_async(user_id: int, date1: date, date2: date) -> Optional[list[dict]]:
+    try:
+        return await asyncio.to_thread(read_report_rows, user_id, date1, date2)
+    except Exception as e:
+        logger.error(f"Не удалось прочитать архив отчетов user_id={user_id}: {e}")
+        return None
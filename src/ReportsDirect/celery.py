@@ -1,9 +1,90 @@
+import os
+import asyncio
+import logging
+
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
+
+from src.ReportsDirect.scheduler import REFRESH_WINDOW_MINUTES
+
+logger = logging.getLogger(__name__)
+
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", CELERY_BROKER_URL)
+# Redis заново выдает неподтвержденную задачу через visibility_timeout (по умолчанию час), в том числе
+# задачу с countdown, которая еще ждет своего часа. Таймаут должен перекрывать все окно обновлений,
+# иначе обновления, запланированные дальше чем на час, выполнятся несколько раз
+CELERY_VISIBILITY_TIMEOUT = int(os.getenv("CELERY_VISIBILITY_TIMEOUT", REFRESH_WINDOW_MINUTES * 60 + 3600))
 
 celery_app = Celery(
     "reports",
-    broker="redis://localhost:6379/0",  # Используем Redis как брокер сообщений
-    backend="redis://localhost:6379/0"
+    broker=CELERY_BROKER_URL,  # Используем Redis как брокер сообщений
+    backend=CELERY_RESULT_BACKEND,
+    include=["src.ReportsDirect.tasks", "src.MetricaLogs.tasks"],
 )
 
-celery_app.conf.task_routes = {"Reports.tasks.*": {"queue": "reports"}}
+celery_app.conf.broker_transport_options = {"visibility_timeout": CELERY_VISIBILITY_TIMEOUT}
+
+# Задачи регистрируются с явными именами, поэтому маршрутизируем по ним
+celery_app.conf.task_routes = {
+    "update_reports_cache": {"queue": "reports"},
+    "schedule_report_refreshes": {"queue": "reports"},
+    "refresh_user_report": {"queue": "reports"},
+    "refresh_expiring_tokens": {"queue": "reports"},
+    "src.ReportsDirect.tasks.*": {"queue": "reports"},
+    # Загрузка Logs API (скачивание и COPY частей по сотням мегабайт) не должна задерживать
+    # обновления отчетов, поэтому у нее своя очередь: celery worker -Q metrica_logs
+    "ingest_metrica_logs": {"queue": "metrica_logs"},
+    "load_metrica_logs": {"queue": "metrica_logs"},
+    "src.MetricaLogs.tasks.*": {"queue": "metrica_logs"},
+}
+
+# Один event loop на процесс воркера: общие клиенты БД, Redis и HTTP живут между задачами
+_worker_loop = None
+
+
+def get_worker_loop() -> asyncio.AbstractEventLoop:
+    global _worker_loop
+    if _worker_loop is None or _worker_loop.is_closed():
+        _worker_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_worker_loop)
+    return _worker_loop
+
+
+def run_async(coro):
+    """Выполняет корутину в постоянном event loop процесса воркера."""
+    return get_worker_loop().run_until_complete(coro)
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    from src.database import all_engines
+    from src.tracing import TRACING_ENABLED, install_tracing
+
+    if TRACING_ENABLED:
+        install_tracing(all_engines)
+
+    # Соединения, унаследованные от родительского процесса после fork, не переиспользуем
+    for engine in all_engines:
+        engine.sync_engine.dispose(close=False)
+    get_worker_loop()
+    logger.info("Event loop воркера инициализирован")
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    from src.clients import close_clients
+    from src.database import all_engines
+    from src.tracing import exporter as span_exporter
+
+    span_exporter.shutdown()
+
+    if _worker_loop is None or _worker_loop.is_closed():
+        return
+
+    try:
+        run_async(close_clients())
+        for engine in all_engines:
+            run_async(engine.dispose())
+    finally:
+        _worker_loop.close()
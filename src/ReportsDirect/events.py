@@ -0,0 +1,89 @@
+import json
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Optional
+
+from src.clients import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+REPORT_EVENTS_CHANNEL = "yandex_report_updates:{user_id}"
+REPORT_EVENTS_PATTERN = "yandex_report_updates:*"
+SUBSCRIBER_QUEUE_SIZE = 16
+
+
+async def publish_report_updated(redis_client, user_id: int, last_updated: str):
+    """Сообщает всем процессам API, что кеш отчета пользователя обновлен."""
+    message = json.dumps({"user_id": user_id, "last_updated": last_updated})
+    try:
+        await redis_client.publish(REPORT_EVENTS_CHANNEL.format(user_id=user_id), message)
+    except Exception as e:
+        logger.warning(f"Не удалось опубликовать обновление отчета user_id={user_id}: {e}")
+
+
+class ReportEventHub:
+    """
+    Одна подписка на Redis pub/sub на процесс, события раздаются локальным очередям.
+
+    Так число соединений с Redis не растет вместе с числом открытых SSE-подключений.
+    """
+
+    def __init__(self):
+        self._subscribers: dict[int, set[asyncio.Queue]] = defaultdict(set)
+        self._listener: Optional[asyncio.Task] = None
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers[user_id].add(queue)
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user_id]
+        if not self._subscribers and self._listener is not None:
+            # Последний подписчик ушел: подписка не должна ждать следующего сообщения, чтобы закрыться
+            self._listener.cancel()
+            self._listener = None
+
+    def _dispatch(self, user_id: int, event: dict):
+        for queue in self._subscribers.get(user_id, ()):
+            if queue.full():
+                # Медленному клиенту важно только последнее событие
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def _listen(self):
+        while self._subscribers:
+            pubsub = get_redis_client().pubsub()
+            try:
+                await pubsub.psubscribe(REPORT_EVENTS_PATTERN)
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+                    try:
+                        event = json.loads(message["data"])
+                        user_id = int(event["user_id"])
+                    except (ValueError, TypeError, KeyError) as e:
+                        # Одно битое сообщение не должно рвать подписку
+                        logger.warning(f"Пропущено некорректное событие отчета: {e}")
+                        continue
+                    self._dispatch(user_id, event)
+                    if not self._subscribers:
+                        break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Подписка на обновления отчетов прервана: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+
+report_event_hub = ReportEventHub()
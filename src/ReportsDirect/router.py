@@ -1,18 +1,36 @@
-import httpx
 import logging
 import json
+import orjson
 import redis.asyncio as redis
 import asyncio
 
-from datetime import datetime, timedelta
-from fastapi import Depends, HTTPException, APIRouter, BackgroundTasks
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
-from src.database import get_db
-from src.Users.models import User
+from datetime import date, datetime, timedelta
+from typing import Optional
+from fastapi import HTTPException, APIRouter, BackgroundTasks, Query, Request
+from fastapi.responses import StreamingResponse
+from src.cache import invalidate_tags, tag_keys, user_tag
+from src.Campanies.service import get_campaign_names_meta, join_campaign_names, refresh_campaign_names
+from src.clients import get_http_client, get_redis_client
+from src.responses import (
+    ORJSON_OPTIONS,
+    RawJSONResponse,
+    conditional_headers,
+    conditional_json_response,
+    is_not_modified,
+    make_etag,
+    not_modified_response,
+)
+from src.ReportsDirect.archive import delete_user_archive, read_report_rows_async, store_report_rows_async
+from src.ReportsDirect.events import publish_report_updated, report_event_hub
+from src.ReportsDirect.scheduler import record_report_access
+from src.tracing import traced
+from src.upstreams import DEADLINE_MIN_BUDGET, direct_gate, remaining_budget, service_unavailable, upstream_timeout
+from src.units import DIRECT_REPORT_COST, ensure_units, record_units
+from src.Users.service import get_user_credentials
 
 YANDEX_DIRECT_API_URL = "https://api.direct.yandex.com/json/v5/reports"
 CACHE_TTL = 86400  # 24 часа
+SSE_HEARTBEAT_INTERVAL = 15
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -20,47 +38,171 @@ router = APIRouter()
 
 async def get_redis():
     try:
-        return redis.Redis(host="localhost", port=6380, decode_responses=True)
+        return get_redis_client()
     except redis.exceptions.ConnectionError as e:
         logger.error(f"Ошибка подключения к Redis: {e}")
         raise HTTPException(status_code=500, detail="Ошибка подключения к Redis")
 
 
-async def get_cached_report(redis_client, user_id):
+def is_cache_fresh(metadata: dict) -> bool:
+    last_updated = datetime.fromisoformat(metadata["last_updated"])
+    return datetime.utcnow() - last_updated < timedelta(hours=24)
+
+
+async def get_cache_metadata(redis_client, user_id) -> Optional[dict]:
+    """Метаданные свежего кеша (last_updated, etag) без чтения самого отчета."""
+    metadata = await redis_client.get(f"yandex_report_metadata_{user_id}")
+    if not metadata:
+        return None
+    metadata = json.loads(metadata)
+    return metadata if is_cache_fresh(metadata) else None
+
+
+def report_validators(metadata: dict) -> tuple[Optional[str], datetime]:
+    """ETag (по отправляемым байтам, уже с названиями кампаний) и Last-Modified отчета в кеше."""
+    return metadata.get("etag"), datetime.fromisoformat(metadata.get("last_modified") or metadata["last_updated"])
+
+
+def report_cache_headers(metadata: dict) -> dict:
+    return conditional_headers(*report_validators(metadata))
+
+
+async def names_are_current(user_id: int, metadata: dict) -> bool:
+    """Совпадает ли справочник кампаний с тем, по которому в кеше подставлены названия."""
+    names_meta = await get_campaign_names_meta(user_id)
+    return names_meta is None or names_meta["etag"] == metadata.get("names_etag")
+
+
+async def remerge_campaign_names(redis_client, user_id: int, metadata: dict, payload: bytes) -> tuple[bytes, dict]:
+    """
+    Подставляет названия по обновленному справочнику и сохраняет отчет обратно в кеш.
+
+    Выполняется один раз после смены справочника; если отчет тем временем
+    перезаписан, сохраненный не трогаем, а ответ собирается из прочитанного.
+    """
+    names_meta = await get_campaign_names_meta(user_id)
+    rows = await join_campaign_names(user_id, orjson.loads(payload))
+    payload = orjson.dumps(rows, option=ORJSON_OPTIONS)
+    metadata = {
+        **metadata,
+        "etag": make_etag(payload),
+        "names_etag": names_meta["etag"] if names_meta else None,
+        "last_modified": datetime.utcnow().isoformat(),
+    }
+
+    cache_key = f"yandex_report_{user_id}"
+    metadata_key = f"yandex_report_metadata_{user_id}"
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            await pipe.watch(metadata_key)
+            current = await pipe.get(metadata_key)
+            if current and json.loads(current).get("last_updated") == metadata["last_updated"]:
+                pipe.multi()
+                pipe.set(cache_key, payload, keepttl=True)
+                pipe.set(metadata_key, json.dumps(metadata), keepttl=True)
+                await pipe.execute()
+    except redis.WatchError:
+        logger.info(f"Отчет user_id={user_id} перезаписан во время подстановки названий")
+    except redis.RedisError as e:
+        logger.warning(f"Не удалось сохранить отчет с названиями user_id={user_id}: {e}")
+    return payload, metadata
+
+
+async def get_report_response_data(redis_client, user_id: int) -> Optional[tuple[bytes, dict]]:
+    """Отчет из кеша в отправляемом виде и его метаданные; названия пересобираются, только если справочник сменился."""
+    metadata = await get_cache_metadata(redis_client, user_id)
+    if not metadata:
+        return None
+    cached_report = await get_cached_report_raw(redis_client, user_id)
+    if not cached_report:
+        return None
+    if not await names_are_current(user_id, metadata):
+        return await remerge_campaign_names(redis_client, user_id, metadata, cached_report)
+    return cached_report, metadata
+
+
+async def get_cached_report_raw(redis_client, user_id) -> Optional[bytes]:
+    """Сериализованный отчет из кеша, если он свежее 24 часов."""
     cache_key = f"yandex_report_{user_id}"
     metadata_key = f"yandex_report_metadata_{user_id}"
 
-    cached_report = await redis_client.get(cache_key)
-    metadata = await redis_client.get(metadata_key)
+    cached_report, metadata = await redis_client.mget(cache_key, metadata_key)
 
-    if cached_report and metadata:
-        last_updated = datetime.fromisoformat(json.loads(metadata)["last_updated"])
-        now = datetime.utcnow()
-        if now - last_updated < timedelta(hours=24):
-            logger.info("Данные загружены из кэша")
-            return json.loads(cached_report)
+    if cached_report and metadata and is_cache_fresh(json.loads(metadata)):
+        logger.info("Данные загружены из кэша")
+        return cached_report
 
     return None
 
 
-async def update_cache(redis_client, user_id, report_data):
+async def get_cached_report(redis_client, user_id, date1: Optional[date] = None, date2: Optional[date] = None):
+    """
+    Отчет из кеша.
+
+    Если указан период, сначала проверяется отчет в Redis (если он покрывает весь период),
+    затем локальный архив закрытых дней.
+    """
+    if date1 is None or date2 is None:
+        cached_report = await get_cached_report_raw(redis_client, user_id)
+        return orjson.loads(cached_report) if cached_report else None
+
+    metadata = await get_cache_metadata(redis_client, user_id)
+    if metadata and "date1" in metadata and (
+        date.fromisoformat(metadata["date1"]) <= date1 and date2 <= date.fromisoformat(metadata["date2"])
+    ):
+        cached_report = await get_cached_report_raw(redis_client, user_id)
+        if cached_report:
+            return [row for row in orjson.loads(cached_report) if str(date1) <= row.get("Date", "") <= str(date2)]
+
+    rows = await read_report_rows_async(user_id, date1, date2)
+    if rows is not None:
+        logger.info("Данные загружены из архива отчетов")
+    return rows
+
+
+def report_date_range(today: Optional[date] = None) -> tuple[date, date]:
+    """Период LAST_30_DAYS: 30 дней, не считая текущего."""
+    today = today or date.today()
+    return today - timedelta(days=30), today - timedelta(days=1)
+
+
+async def update_cache(redis_client, user_id, report_data) -> tuple[bytes, dict]:
+    """Сохраняет отчет в кеш; возвращает сохраненные байты (с названиями кампаний) и метаданные."""
     cache_key = f"yandex_report_{user_id}"
     metadata_key = f"yandex_report_metadata_{user_id}"
 
+    # Названия кампаний подставляются один раз при записи: попадание в кеш отдает байты как есть
+    names_meta = await get_campaign_names_meta(user_id)
+    payload = orjson.dumps(await join_campaign_names(user_id, report_data), option=ORJSON_OPTIONS)
     now = datetime.utcnow().isoformat()
-    metadata = {"last_updated": now}
+    date1, date2 = report_date_range()
+    # ETag хранится рядом с отчетом, чтобы отвечать 304 без чтения и разбора самого отчета
+    metadata = {
+        "last_updated": now,
+        "etag": make_etag(payload),
+        "names_etag": names_meta["etag"] if names_meta else None,
+        "date1": str(date1),
+        "date2": str(date2),
+    }
 
-    await redis_client.setex(cache_key, CACHE_TTL, json.dumps(report_data))
+    await redis_client.setex(cache_key, CACHE_TTL, payload)
     await redis_client.setex(metadata_key, CACHE_TTL, json.dumps(metadata))
+    await tag_keys([cache_key, metadata_key], [user_tag(user_id)], CACHE_TTL)
+    # Закрытые дни уходят в локальный архив и больше не запрашиваются у Директа
+    await store_report_rows_async(user_id, report_data, date1, date2)
+    await publish_report_updated(redis_client, user_id, now)
+    return payload, metadata
 
 
-async def fetch_yandex_report(user):
+@traced()
+async def fetch_yandex_report(user, date1: Optional[date] = None, date2: Optional[date] = None):
     request_params = {
         "params": {
-            "ReportName": f"report_{datetime.now().strftime('%Y%m%d%H%M%S')}",
+            # Имя стабильно в пределах часа: повтор после 503 заберет отчет, уже сформированный офлайн
+            "ReportName": f"report_{user.login}_{datetime.now().strftime('%Y%m%d%H')}",
             "SelectionCriteria": {},
-            "FieldNames": ["CampaignId", "Date", "CampaignName", "Impressions", "Clicks",
-                           "Cost"],
+            # Название кампании не запрашивается: оно подставляется из справочника при ответе
+            "FieldNames": ["CampaignId", "Date", "Impressions", "Clicks", "Cost"],
             "ReportType": "CAMPAIGN_PERFORMANCE_REPORT",
             "DateRangeType": "LAST_30_DAYS",
             "Format": "TSV",
@@ -68,6 +210,10 @@ async def fetch_yandex_report(user):
             "IncludeDiscount": "NO",
         }
     }
+    if date1 is not None and date2 is not None:
+        request_params["params"]["ReportName"] += f"_{date1:%Y%m%d}_{date2:%Y%m%d}"
+        request_params["params"]["DateRangeType"] = "CUSTOM_DATE"
+        request_params["params"]["SelectionCriteria"] = {"DateFrom": str(date1), "DateTo": str(date2)}
 
     headers = {
         "Authorization": f"Bearer {user.access_token}",
@@ -76,8 +222,15 @@ async def fetch_yandex_report(user):
         "processingMode": "auto"
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(YANDEX_DIRECT_API_URL, headers=headers, json=request_params)
+    # Отчет не заказываем, если он исчерпает известный остаток баллов логина
+    await ensure_units(user.login, DIRECT_REPORT_COST)
+
+    client = get_http_client()
+    async with direct_gate.slot():
+        response = await client.post(
+            YANDEX_DIRECT_API_URL, headers=headers, json=request_params, timeout=upstream_timeout()
+        )
+    await record_units(user.login, response.headers)
 
     if response.status_code == 200:
         return response.text
@@ -89,9 +242,17 @@ async def fetch_yandex_report(user):
             retry_in = 60  # Значение по умолчанию
 
         for _ in range(20):
+            # В рамках HTTP-запроса не ждем отчет дольше бюджета: клиент повторит запрос позже
+            budget = remaining_budget()
+            if budget is not None and budget < retry_in + DEADLINE_MIN_BUDGET:
+                raise service_unavailable("Отчет формируется", retry_after=retry_in)
+
             await asyncio.sleep(retry_in)
-            async with httpx.AsyncClient() as client:
-                status_response = await client.post(YANDEX_DIRECT_API_URL, headers=headers, json=request_params)
+            async with direct_gate.slot():
+                status_response = await client.post(
+                    YANDEX_DIRECT_API_URL, headers=headers, json=request_params, timeout=upstream_timeout()
+                )
+            await record_units(user.login, status_response.headers)
 
             if status_response.status_code == 200:
                 return status_response.text
@@ -104,41 +265,122 @@ async def fetch_yandex_report(user):
 
 
 @router.get("/yandex-reports/{user_id}", summary="Получить отчет из Яндекс.Директ")
-async def get_yandex_reports(user_id: int, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(User).where(User.id == user_id))
-    user = result.scalars().first()
+async def get_yandex_reports(user_id: int, request: Request, background_tasks: BackgroundTasks):
+    user = await get_user_credentials(user_id)
 
-    if not user or not user.access_token:
+    if not user:
         raise HTTPException(status_code=403, detail="Пользователь не авторизован в Яндексе")
 
     redis_client = await get_redis()
-    cached_report = await get_cached_report(redis_client, user_id)
-
-    if cached_report:
-        background_tasks.add_task(refresh_cache_task, user_id, user)
-        return cached_report
+    # Активность пользователя определяет приоритет ночного обновления
+    await record_report_access(redis_client, user_id)
+
+    metadata = await get_cache_metadata(redis_client, user_id)
+    if metadata:
+        if await names_are_current(user_id, metadata) and is_not_modified(request, *report_validators(metadata)):
+            background_tasks.add_task(refresh_cache_task, user_id, user)
+            return not_modified_response(report_cache_headers(metadata))
+
+        cached = await get_report_response_data(redis_client, user_id)
+        if cached:
+            payload, metadata = cached
+            background_tasks.add_task(refresh_cache_task, user_id, user)
+            headers = report_cache_headers(metadata)
+            if is_not_modified(request, *report_validators(metadata)):
+                return not_modified_response(headers)
+            return RawJSONResponse(payload, headers=headers)
 
     try:
         raw_report = await fetch_yandex_report(user)
         parsed_report = parse_tsv_report(raw_report)
-        await update_cache(redis_client, user_id, parsed_report)
-        return parsed_report
+        await get_campaign_names_meta(user_id, user)
+        payload, metadata = await update_cache(redis_client, user_id, parsed_report)
+        return RawJSONResponse(payload, headers=report_cache_headers(metadata))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при получении отчета: {e}")
         raise HTTPException(status_code=500, detail="Ошибка при получении отчета")
 
 
 @router.get("/yandex-reports-cache/{user_id}", summary="Получить отчет из кеша Redis")
-async def get_yandex_report_from_cache(user_id: int):
+async def get_yandex_report_from_cache(user_id: int, request: Request):
     redis_client = await get_redis()
-    cached_report = await get_cached_report(redis_client, user_id)
 
-    if cached_report:
-        return cached_report
+    metadata = await get_cache_metadata(redis_client, user_id)
+    if metadata:
+        if await names_are_current(user_id, metadata) and is_not_modified(request, *report_validators(metadata)):
+            return not_modified_response(report_cache_headers(metadata))
+
+        cached = await get_report_response_data(redis_client, user_id)
+        if cached:
+            payload, metadata = cached
+            headers = report_cache_headers(metadata)
+            if is_not_modified(request, *report_validators(metadata)):
+                return not_modified_response(headers)
+            return RawJSONResponse(payload, headers=headers)
 
     raise HTTPException(status_code=404, detail="Отчет не найден в кеше")
 
 
+@router.get("/yandex-reports-history/{user_id}", summary="Отчет Директа за произвольный период")
+async def get_yandex_report_history(
+    user_id: int,
+    request: Request,
+    date1: date = Query(...),
+    date2: date = Query(...),
+):
+    if date1 > date2:
+        raise HTTPException(status_code=400, detail="date1 должна быть не позже date2")
+
+    user = await get_user_credentials(user_id)
+    if not user:
+        raise HTTPException(status_code=403, detail="Пользователь не авторизован в Яндексе")
+
+    rows = await get_cached_report(await get_redis(), user_id, date1, date2)
+    if rows is None:
+        raw_report = await fetch_yandex_report(user, date1, date2)
+        rows = parse_tsv_report(raw_report)
+        await store_report_rows_async(user_id, rows, date1, date2)
+
+    await get_campaign_names_meta(user_id, user)
+    return conditional_json_response(request, await join_campaign_names(user_id, rows))
+
+
+@router.get("/yandex-reports-events/{user_id}", summary="Подписка на обновления отчета (Server-Sent Events)")
+async def stream_report_events(user_id: int, request: Request, include_payload: bool = False):
+    queue = report_event_hub.subscribe(user_id)
+
+    async def event_stream():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    # Комментарий-heartbeat не дает прокси закрыть соединение
+                    yield ": ping\n\n"
+                    continue
+
+                # Событие общее для всех подписчиков пользователя: отчет добавляется только в свою копию
+                payload = event
+                if include_payload:
+                    cached = await get_report_response_data(get_redis_client(), user_id)
+                    if cached:
+                        payload = {**event, "report": orjson.Fragment(cached[0])}
+                yield f"event: report_updated\ndata: {orjson.dumps(payload).decode()}\n\n"
+        finally:
+            report_event_hub.unsubscribe(user_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@traced()
 async def refresh_cache_task(user_id, user):
     """
     Фоновая задача для обновления кеша отчета.
@@ -149,6 +391,8 @@ async def refresh_cache_task(user_id, user):
     try:
         raw_report = await fetch_yandex_report(user)
         parsed_report = parse_tsv_report(raw_report)
+        # Сначала справочник: новый отчет сохраняется уже с актуальными названиями
+        await refresh_campaign_names(user)
         await update_cache(redis_client, user_id, parsed_report)
     except Exception as e:
         logger.error(f"Ошибка при обновлении кеша для user_id {user_id}: {e}")
@@ -171,9 +415,9 @@ def parse_tsv_report(report_text):
 
 
 
-@router.delete("/yandex-reports-cache/{user_id}", summary="Удалить кеш отчета из Redis")
+@router.delete("/yandex-reports-cache/{user_id}", summary="Удалить все кеши пользователя")
 async def delete_report_cache(user_id: int):
-    redis_client = await get_redis()
-    await redis_client.delete(f"yandex_report_{user_id}")
-    await redis_client.delete(f"yandex_report_metadata_{user_id}")
-    return {"message": "Кеш удален"}
+    # Отчет, справочник кампаний и ответы Директа пользователя помечены тегом user:{id}
+    deleted = await invalidate_tags(user_tag(user_id))
+    await asyncio.to_thread(delete_user_archive, user_id)
+    return {"message": "Кеш удален", "deleted_keys": deleted}
@@ -0,0 +1,65 @@
+import os
+import time
+import random
+import logging
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+REPORT_ACCESS_KEY = "yandex_report_access"
+
+# Окно, по которому распределяются ночные обновления отчетов
+REFRESH_WINDOW_START_HOUR = int(os.getenv("REFRESH_WINDOW_START_HOUR", 0))
+REFRESH_WINDOW_MINUTES = int(os.getenv("REFRESH_WINDOW_MINUTES", 240))
+# Пользователи, не открывавшие отчеты столько дней, не обновляются
+REFRESH_IDLE_DAYS = int(os.getenv("REFRESH_IDLE_DAYS", 7))
+
+
+async def record_report_access(redis_client, user_id: int):
+    """Запоминает время последнего обращения пользователя к отчету."""
+    try:
+        await redis_client.zadd(REPORT_ACCESS_KEY, {str(user_id): time.time()})
+    except Exception as e:
+        logger.warning(f"Не удалось записать обращение к отчету user_id={user_id}: {e}")
+
+
+async def get_report_access_times(redis_client, idle_days: int = REFRESH_IDLE_DAYS) -> dict[int, float]:
+    # Записи старше окна простоя больше не влияют на планирование
+    await redis_client.zremrangebyscore(REPORT_ACCESS_KEY, 0, time.time() - idle_days * 86400)
+    entries = await redis_client.zrange(REPORT_ACCESS_KEY, 0, -1, withscores=True)
+    return {int(member): score for member, score in entries}
+
+
+def plan_refreshes(
+    user_ids: list[int],
+    access_times: dict[int, float],
+    window_seconds: int,
+    idle_days: int,
+    now: Optional[float] = None,
+    jitter: bool = True,
+) -> list[tuple[int, int]]:
+    """
+    Распределяет обновления по окну и возвращает [(user_id, задержка в секундах)].
+
+    Недавно активные пользователи получают более ранние слоты, пользователи без
+    обращений за idle_days (или вообще без обращений) пропускаются.
+    """
+    now = now if now is not None else time.time()
+    idle_border = now - idle_days * 86400
+
+    active = [uid for uid in user_ids if access_times.get(uid, 0) >= idle_border]
+    active.sort(key=lambda uid: access_times[uid], reverse=True)
+
+    if not active:
+        return []
+
+    slot = window_seconds / len(active)
+    plan = []
+    for i, user_id in enumerate(active):
+        offset = i * slot + (random.uniform(0, slot) if jitter else 0)
+        plan.append((user_id, int(offset)))
+    return plan
@@ -1,72 +1,117 @@
-import json
-import httpx
 import logging
 from datetime import datetime
-from src.ReportsDirect.celery import celery_app
-from src.database import get_db
-from sqlalchemy.ext.asyncio import AsyncSession
+from src.ReportsDirect.celery import celery_app, run_async
+from src.ReportsDirect.router import fetch_yandex_report, parse_tsv_report, update_cache
+from src.ReportsDirect.scheduler import (
+    REFRESH_IDLE_DAYS,
+    REFRESH_WINDOW_MINUTES,
+    get_report_access_times,
+    plan_refreshes,
+)
+from src.Campanies.service import refresh_campaign_names
+from src.clients import get_redis_client
+from src.database import async_read_session, read_session_for
+from src.units import split_by_units
+from src.Users.service import refresh_expiring_tokens, refresh_user_token
 from sqlalchemy.future import select
 from src.Users.models import User
-import redis.asyncio as redis
 
 logger = logging.getLogger(__name__)
 
-YANDEX_DIRECT_API_URL = "https://api.direct.yandex.com/json/v5/reports"
-
-async def get_redis():
-    return redis.Redis(host="localhost", port=6379, decode_responses=True)
-
-async def fetch_yandex_report(user):
-    request_params = {
-        "params": {
-            "ReportName": f"report_{datetime.now().strftime('%Y%m%d%H%M%S')}",
-            "SelectionCriteria": {},
-            "FieldNames": ["CampaignId", "Date", "CampaignName", "Impressions", "Clicks", "Cost"],
-            "ReportType": "CAMPAIGN_PERFORMANCE_REPORT",
-            "DateRangeType": "LAST_30_DAYS",
-            "Format": "TSV",
-            "IncludeVAT": "NO",
-            "IncludeDiscount": "NO"
-        }
-    }
-
-    headers = {
-        "Authorization": f"Bearer {user.access_token}",
-        "Client-Login": user.login,
-        "Accept-Language": "ru",
-        "processingMode": "auto"
-    }
-
-    async with httpx.AsyncClient() as client:
-        response = await client.post(YANDEX_DIRECT_API_URL, headers=headers, json=request_params)
-
-    if response.status_code == 200:
-        return response.text
-    else:
-        logger.error(f"Ошибка API Яндекса: {response.text}")
-        return None
+
+async def refresh_user_report_cache(redis_client, user) -> bool:
+    try:
+        raw_report = await fetch_yandex_report(user)
+        parsed_report = parse_tsv_report(raw_report)
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении кеша для пользователя {user.id}: {e}")
+        return False
+
+    # Справочник обновляется до записи отчета, чтобы названия в кеше были актуальными
+    try:
+        await refresh_campaign_names(user)
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении справочника кампаний для пользователя {user.id}: {e}")
+    await update_cache(redis_client, user.id, parsed_report)
+    logger.info(f"Кеш обновлен для пользователя {user.id}")
+    return True
+
 
 @celery_app.task(name="update_reports_cache")
 def update_reports_cache():
-    """Обновляет кеш отчетов всех пользователей каждые 24 часа."""
-    import asyncio
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(update_cache_task())
+    """Обновляет кеш отчетов всех пользователей сразу (ручной полный прогон)."""
+    run_async(update_cache_task())
+
 
 async def update_cache_task():
-    db: AsyncSession = next(get_db())
-    redis_client = await get_redis()
+    redis_client = get_redis_client()
 
-    users = await db.execute(select(User))
-    users = users.scalars().all()
+    async with async_read_session() as db:
+        users = await db.execute(select(User))
+        users = users.scalars().all()
 
     for user in users:
         if not user.access_token:
             continue
+        await refresh_user_report_cache(redis_client, user)
+
+
+@celery_app.task(name="schedule_report_refreshes")
+def schedule_report_refreshes():
+    """Раскладывает обновления отчетов активных пользователей по окну REFRESH_WINDOW_MINUTES."""
+    return run_async(schedule_report_refreshes_task())
+
+
+async def schedule_report_refreshes_task() -> int:
+    redis_client = get_redis_client()
+
+    async with async_read_session() as db:
+        result = await db.execute(select(User.id, User.login).where(User.access_token.isnot(None)))
+        user_logins = {user_id: login for user_id, login in result.all()}
+
+    # Пользователей с почти исчерпанными баллами откладываем до следующего окна
+    _, deferred = await split_by_units([login for login in user_logins.values() if login])
+    if deferred:
+        logger.warning(f"Обновление отложено из-за нехватки баллов: {', '.join(deferred)}")
+    ready_ids = [user_id for user_id, login in user_logins.items() if login not in deferred]
+
+    access_times = await get_report_access_times(redis_client)
+    plan = plan_refreshes(ready_ids, access_times, REFRESH_WINDOW_MINUTES * 60, REFRESH_IDLE_DAYS)
+
+    for user_id, countdown in plan:
+        refresh_user_report.apply_async(args=[user_id], countdown=countdown)
+
+    logger.info(
+        f"Запланировано обновлений: {len(plan)}, пропущено неактивных: {len(ready_ids) - len(plan)}"
+    )
+    return len(plan)
+
+
+@celery_app.task(name="refresh_user_report")
+def refresh_user_report(user_id: int):
+    """Обновляет кеш отчета одного пользователя."""
+    return run_async(refresh_user_report_task(user_id))
+
+
+async def refresh_user_report_task(user_id: int) -> bool:
+    async with (await read_session_for(user_id))() as db:
+        result = await db.execute(select(User).where(User.id == user_id))
+        user = result.scalars().first()
+
+    if not user or not user.access_token:
+        logger.warning(f"Пользователь {user_id} не найден или не авторизован, обновление пропущено")
+        return False
+
+    if user.token_expires_at is not None and user.token_expires_at <= datetime.utcnow():
+        # Истекший токен обновляем до запроса отчета, а не после ответа 401
+        user = await refresh_user_token(user_id)
+        if user is None:
+            return False
+
+    return await refresh_user_report_cache(get_redis_client(), user)
+
 
-        report_data = await fetch_yandex_report(user)
-        if report_data:
-            cache_key = f"yandex_report_{user.id}"
-            await redis_client.setex(cache_key, 86400, json.dumps(report_data))
-            logger.info(f"Кеш обновлен для пользователя {user.id}")
+@celery_app.task(name="refresh_expiring_tokens")
+def refresh_expiring_tokens_task():
+    """Заранее обновляет OAuth-токены, срок действия которых скоро истечет."""
+    return run_async(refresh_expiring_tokens())
@@ -1,10 +1,16 @@
-from fastapi import HTTPException, Query, APIRouter
-import requests
+from fastapi import Depends, HTTPException, Query, APIRouter
 from dotenv import load_dotenv
 from  datetime import date
+from typing import Callable, List
 
 import os
 
+from src.cache import counter_tag, invalidate_tags, metrica_cache, range_tags
+from src.clients import get_http_client
+from src.metrica import METRICA_STAT_URL, iter_stat_rows
+from src.security import require_admin
+from src.upstreams import metrica_gate, upstream_timeout
+
 router = APIRouter()
 
 load_dotenv()
@@ -16,9 +22,62 @@ API_TOKEN = os.getenv("API_TOKEN")
 COUNTER_IDS = [181494, 72372934]
 
 
+def format_duration(seconds: float) -> str:
+    """Секунды в формат MM:SS."""
+    return f"{int(seconds // 60)}:{int(seconds % 60):02d}"
+
+
+def clean_chart_row(item: dict) -> dict:
+    metrics = item["metrics"]
+    return {
+        "date": item["dimensions"][1]["name"],
+        "traffic_source": item["dimensions"][0]["name"],
+        "visits": metrics[0],
+        "users": metrics[1],
+        "bounce_rate": metrics[2],
+        "page_depth": metrics[3],
+        "avg_visit_duration": format_duration(metrics[4])
+    }
+
+
+def clean_summary_row(item: dict) -> dict:
+    metrics = item["metrics"]
+    return {
+        "traffic_source": item["dimensions"][0]["name"],
+        "total_visits": int(metrics[0]),
+        "total_users": int(metrics[1]),
+        "avg_bounce_rate": round(metrics[2], 2),
+        "avg_page_depth": round(metrics[3], 2),
+        "avg_visit_duration": format_duration(metrics[4])
+    }
+
+
+async def fetch_metrika_rows(params: dict, clean_row: Callable[[dict], dict]) -> list[dict]:
+    """
+    Забирает все страницы stat/v1/data и приводит строки к виду ответа по мере получения.
+
+    В кэше хранится уже очищенный результат, сырые страницы в памяти не накапливаются.
+    """
+    headers = {'Authorization': f'OAuth {API_TOKEN}'}
+
+    async def fetch():
+        return [clean_row(row) async for row in iter_stat_rows(params, headers, API_URL or METRICA_STAT_URL)]
+
+    cache_params = {**params, "view": clean_row.__name__}
+    tags = [counter_tag(params['ids']), *range_tags(params['date1'], params['date2'])]
+    return await metrica_cache.get_or_fetch(cache_params, params['date2'], fetch, tags=tags)
+
+
+def metrika_error(e: HTTPException) -> dict:
+    return {
+        "error": "Ошибка получения данных",
+        "status_code": e.status_code,
+        "response_text": e.detail
+    }
+
+
 @router.get("/metrika_chart/")
 async def get_metrika_data():
-    headers = {'Authorization': f'OAuth {API_TOKEN}'}
     results = {}
 
     for counter_id in COUNTER_IDS:
@@ -29,52 +88,23 @@ async def get_metrika_data():
             'metrics': 'ym:s:visits,ym:s:users,ym:s:bounceRate,ym:s:pageDepth,ym:s:avgVisitDurationSeconds',
             'dimensions': 'ym:s:trafficSource,ym:s:date',
             'group': 'Day',
-            'accuracy': 'full',
-            'limit': 100
+            'accuracy': 'full'
         }
 
-        response = requests.get(API_URL, params=params, headers=headers)
-
-        if response.status_code == 200:
-            try:
-                data = response.json()
-                cleaned_data = []
-
-                for item in data.get("data", []):
-                    traffic_source = item["dimensions"][0]["name"]
-                    date = item["dimensions"][1]["name"]  # Сохраняем дату
-                    metrics = item["metrics"]
-
-                    # Преобразуем секунды в формат MM:SS для "avgVisitDurationSeconds"
-                    seconds = metrics[4]
-                    minutes = int(seconds // 60)
-                    sec = int(seconds % 60)
-                    metrics[4] = f"{minutes}:{sec:02d}"  # Формат MM:SS
-
-                    cleaned_data.append({
-                        "date": date,  # Добавляем дату
-                        "traffic_source": traffic_source,
-                        "visits": metrics[0],
-                        "users": metrics[1],
-                        "bounce_rate": metrics[2],
-                        "page_depth": metrics[3],
-                        "avg_visit_duration": metrics[4]
-                    })
-
-                # Сортировка данных по дате
-                sorted_data = sorted(cleaned_data, key=lambda x: x["date"])
-
-                # Сохраняем отсортированные данные в результат
-                results[counter_id] = sorted_data
-                return results
-            except ValueError:
-                return {"error": "Ошибка при разборе JSON-ответа", "response_text": response.text}
-        else:
-            return {
-                "error": "Ошибка получения данных",
-                "status_code": response.status_code,
-                "response_text": response.text
-            }
+        try:
+            cleaned_data = await fetch_metrika_rows(params, clean_chart_row)
+        except HTTPException as e:
+            # Перегрузка (503 + Retry-After от шлюза или бюджета запроса) отдается клиенту как есть
+            if e.status_code == 503:
+                raise
+            return metrika_error(e)
+
+        # Сортировка данных по дате
+        sorted_data = sorted(cleaned_data, key=lambda x: x["date"])
+
+        # Сохраняем отсортированные данные в результат
+        results[counter_id] = sorted_data
+        return results
     return results
 
 
@@ -83,7 +113,6 @@ async def get_metrika_summary(
         date1: str = Query(default=str(date.today().replace(day=1)), description="Начальная дата (YYYY-MM-DD)"),
         date2: str = Query(default=str(date.today()), description="Конечная дата (YYYY-MM-DD)")
 ):
-    headers = {'Authorization': f'OAuth {API_TOKEN}'}
     results = {}
 
     for counter_id in COUNTER_IDS:
@@ -96,50 +125,19 @@ async def get_metrika_summary(
             'accuracy': 'full'
         }
 
-        response = requests.get(API_URL, params=params, headers=headers)
-
-        if response.status_code == 200:
-            try:
-                data = response.json()
-
-                if "data" not in data or not data["data"]:
-                    results[counter_id] = {"error": "Нет данных за указанный период"}
-                    continue
-
-                summary_data = []
-
-                for item in data["data"]:
-                    traffic_source = item["dimensions"][0]["name"]
-                    metrics = item["metrics"]
-
-                    total_visits = int(metrics[0])
-                    total_users = int(metrics[1])
-                    avg_bounce_rate = round(metrics[2], 2)
-                    avg_page_depth = round(metrics[3], 2)
-
-                    avg_seconds = metrics[4]
-                    minutes = int(avg_seconds // 60)
-                    seconds = int(avg_seconds % 60)
-                    avg_visit_duration = f"{minutes}:{seconds:02d}"
-
-                    summary_data.append({
-                        "traffic_source": traffic_source,
-                        "total_visits": total_visits,
-                        "total_users": total_users,
-                        "avg_bounce_rate": avg_bounce_rate,
-                        "avg_page_depth": avg_page_depth,
-                        "avg_visit_duration": avg_visit_duration
-                    })
-
-                results[counter_id] = summary_data
-            except ValueError:
-                results[counter_id] = {"error": "Ошибка при разборе JSON-ответа", "response_text": response.text}
-        else:
-            results[counter_id] = {
-                "error": "Ошибка получения данных",
-                "status_code": response.status_code,
-                "response_text": response.text
-            }
+        try:
+            summary_data = await fetch_metrika_rows(params, clean_summary_row)
+        except HTTPException as e:
+            if e.status_code == 503:
+                raise
+            results[counter_id] = metrika_error(e)
+            continue
+
+        if not summary_data:
+            results[counter_id] = {"error": "Нет данных за указанный период"}
+            continue
+
+        results[counter_id] = summary_data
 
     return results
 
@@ -150,8 +148,9 @@ async def get_counters():
         "Authorization": f"OAuth {API_TOKEN}"
     }
 
-    # Выполнение запроса к API
-    response = requests.get(API_COUNTER_URL, headers=headers)
+    # Выполнение запроса к API (синхронный requests блокировал event loop на время ответа)
+    async with metrica_gate.slot():
+        response = await get_http_client().get(API_COUNTER_URL, headers=headers, timeout=upstream_timeout())
 
     # Выводим тело ответа для диагностики
     if response.status_code != 200:
@@ -171,4 +170,18 @@ async def get_counters():
         for counter in counters
     ]
 
-    return {"counters": result}
\ No newline at end of file
+    return {"counters": result}
+
+
+@router.get("/metrika_cache/stats", summary="Статистика кэша запросов к Метрике", dependencies=[Depends(require_admin)])
+async def get_metrika_cache_stats():
+    return metrica_cache.stats()
+
+
+@router.delete(
+    "/metrika_cache/tags",
+    summary="Сбросить кэш по тегам (counter:<id>, goal:<id>, month:YYYY-MM, user:<id>)",
+    dependencies=[Depends(require_admin)],
+)
+async def delete_metrika_cache_tags(tag: List[str] = Query(...)):
+    return {"deleted_keys": await invalidate_tags(*tag)}
\ No newline at end of file
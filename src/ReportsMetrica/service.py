@@ -1,13 +1,14 @@
 import os
 
-import requests
 from dotenv import load_dotenv
-from fastapi import HTTPException
+
+from src.cache import metrica_cache
+from src.metrica import METRICA_STAT_URL, fetch_stat_rows
 
 load_dotenv()
 
-API_TOKEN = os.getenv("API_METRICA_URL")
-API_URL = os.getenv("API_METRICA_TOKEN")
+API_TOKEN = os.getenv("API_METRICA_TOKEN", os.getenv("API_TOKEN"))
+API_URL = os.getenv("API_METRICA_URL")
 
 async def get_metrika_data(counter_id: str, date1: str, date2: str):
     params = {
@@ -20,10 +21,8 @@ async def get_metrika_data(counter_id: str, date1: str, date2: str):
     }
 
     headers = {'Authorization': f'OAuth {API_TOKEN}'}
-    response = requests.get(API_URL, params=params, headers=headers)
 
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=response.text)
+    async def fetch():
+        return await fetch_stat_rows(params, headers, API_URL or METRICA_STAT_URL)
 
-    data = response.json()
-    return data['data']
+    return await metrica_cache.get_or_fetch(params, date2, fetch)
@@ -14,6 +14,8 @@ class User(Base):
     display_name = Column(String)  # display_name
     access_token = Column(String, nullable=False)  # access_token
     refresh_token = Column(String, nullable=False)  # refresh_token
+    token_expires_at = Column(DateTime, nullable=True, index=True)  # Когда истекает access_token
+    token_refresh_failed_at = Column(DateTime, nullable=True)  # Когда oauth.yandex.ru отклонил refresh_token
     created_at = Column(DateTime, default=datetime.datetime.utcnow)  # Дата создания
 
     def __repr__(self):
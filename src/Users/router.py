@@ -1,11 +1,19 @@
-import os
 import httpx
 from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from dotenv import load_dotenv
-from src.database import get_db
+from src.cache import invalidate_tags, user_tag
+from src.database import get_db, mark_recent_write
+from src.upstreams import oauth_gate, upstream_timeout
 from src.Users.models import User
+from src.Users.service import (
+    YANDEX_CLIENT_ID,
+    YANDEX_CLIENT_SECRET,
+    YANDEX_TOKEN_URL,
+    invalidate_user_credentials,
+    token_expires_at,
+)
 import logging
 from datetime import datetime
 
@@ -16,12 +24,9 @@ load_dotenv()
 
 router = APIRouter()
 
-YANDEX_CLIENT_ID = os.getenv("YANDEX_CLIENT_ID")
-YANDEX_CLIENT_SECRET = os.getenv("YANDEX_CLIENT_SECRET")
 YANDEX_REDIRECT_URI = "http://localhost:8000/auth/callback"
 
 YANDEX_AUTH_URL = "https://oauth.yandex.ru/authorize"
-YANDEX_TOKEN_URL = "https://oauth.yandex.ru/token"
 YANDEX_USER_INFO_URL = "https://login.yandex.ru/info"
 
 @router.get("/auth/login")
@@ -48,7 +53,8 @@ async def auth_callback(code: str, db: AsyncSession = Depends(get_db)):
 
     try:
         async with httpx.AsyncClient() as client:
-            response = await client.post(YANDEX_TOKEN_URL, data=data, headers=headers)
+            async with oauth_gate.slot():
+                response = await client.post(YANDEX_TOKEN_URL, data=data, headers=headers, timeout=upstream_timeout())
             if response.status_code != 200:
                 logger.error(f"Failed to get token: {response.text}")
                 raise HTTPException(status_code=400, detail="Ошибка получения токена")
@@ -56,11 +62,13 @@ async def auth_callback(code: str, db: AsyncSession = Depends(get_db)):
             tokens = response.json()
             access_token = tokens.get("access_token")
             refresh_token = tokens.get("refresh_token")
+            expires_at = token_expires_at(tokens.get("expires_in"))
             logger.info(f"Access token obtained: {access_token}")
 
-            user_info_response = await client.get(
-                YANDEX_USER_INFO_URL, headers={"Authorization": f"OAuth {access_token}"}
-            )
+            async with oauth_gate.slot():
+                user_info_response = await client.get(
+                    YANDEX_USER_INFO_URL, headers={"Authorization": f"OAuth {access_token}"}, timeout=upstream_timeout()
+                )
             if user_info_response.status_code != 200:
                 logger.error(f"Failed to get user info: {user_info_response.text}")
                 raise HTTPException(status_code=400, detail="Ошибка получения данных пользователя")
@@ -105,10 +113,21 @@ async def auth_callback(code: str, db: AsyncSession = Depends(get_db)):
             if not existing_user.refresh_token or existing_user.refresh_token != refresh_token:
                 existing_user.refresh_token = refresh_token
                 updated = True
+            if expires_at and existing_user.token_expires_at != expires_at:
+                existing_user.token_expires_at = expires_at
+                updated = True
+            # Новый refresh_token снова можно обновлять в фоне
+            if existing_user.token_refresh_failed_at is not None:
+                existing_user.token_refresh_failed_at = None
+                updated = True
 
             if updated:
                 await db.commit()
                 await db.refresh(existing_user)
+                await invalidate_user_credentials(existing_user.id)
+                # После повторной авторизации данные могли относиться к другому доступу
+                await invalidate_tags(user_tag(existing_user.id))
+                await mark_recent_write(existing_user.id)
                 logger.info("User data updated in database.")
 
             return {"message": "Пользователь уже авторизован.", "user": user_info}
@@ -121,12 +140,14 @@ async def auth_callback(code: str, db: AsyncSession = Depends(get_db)):
             display_name=display_name,
             access_token=access_token,
             refresh_token=refresh_token,
+            token_expires_at=expires_at,
             created_at=datetime.now(),
         )
 
         db.add(new_user)
         await db.commit()
         await db.refresh(new_user)
+        await mark_recent_write(new_user.id)
         logger.info(f"New user saved: {new_user}")
 
     except Exception as e:
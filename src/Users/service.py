@@ -0,0 +1,250 @@
+import os
+import time
+import asyncio
+import logging
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import or_
+from sqlalchemy.future import select
+
+from src.clients import get_http_client
+from src.invalidation import invalidation_bus
+from src.database import async_session, mark_recent_write, read_session_for
+from src.upstreams import oauth_gate, upstream_timeout
+from src.Users.models import User
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+YANDEX_CLIENT_ID = os.getenv("YANDEX_CLIENT_ID")
+YANDEX_CLIENT_SECRET = os.getenv("YANDEX_CLIENT_SECRET")
+YANDEX_TOKEN_URL = "https://oauth.yandex.ru/token"
+# Ошибки oauth.yandex.ru, после которых refresh_token больше не сработает (отозван или истек)
+TOKEN_REFRESH_FATAL_ERRORS = {"invalid_grant", "invalid_client", "unauthorized_client"}
+
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 300))
+USER_CACHE_MAX_ITEMS = int(os.getenv("USER_CACHE_MAX_ITEMS", 10000))
+
+# Фоновое обновление берет токены, истекающие в ближайшие TOKEN_REFRESH_HORIZON секунд
+TOKEN_REFRESH_HORIZON = int(os.getenv("TOKEN_REFRESH_HORIZON", 3 * 86400))
+TOKEN_REFRESH_CONCURRENCY = int(os.getenv("TOKEN_REFRESH_CONCURRENCY", 5))
+# Если токен все же почти истек, запрос обновит его сам, не дожидаясь ошибки 401
+TOKEN_INLINE_REFRESH_MARGIN = int(os.getenv("TOKEN_INLINE_REFRESH_MARGIN", 300))
+
+
+@dataclass(frozen=True)
+class UserCredentials:
+    """То, что нужно для запросов в Директ от имени пользователя."""
+
+    id: int
+    login: Optional[str]
+    access_token: str
+    expires_at: Optional[datetime] = None
+
+    def expires_soon(self, margin: int = TOKEN_INLINE_REFRESH_MARGIN) -> bool:
+        return self.expires_at is not None and self.expires_at - datetime.utcnow() < timedelta(seconds=margin)
+
+
+class UserCredentialsCache:
+    def __init__(self, ttl: int, max_items: int):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._data: "OrderedDict[int, tuple[float, UserCredentials]]" = OrderedDict()
+
+    def get(self, user_id: int) -> Optional[UserCredentials]:
+        item = self._data.get(user_id)
+        if item is None:
+            return None
+        expires_at, credentials = item
+        if expires_at <= time.monotonic() or not invalidation_bus.is_fresh(expires_at - self.ttl):
+            del self._data[user_id]
+            return None
+        return credentials
+
+    def set(self, credentials: UserCredentials):
+        self._data.pop(credentials.id, None)
+        self._data[credentials.id] = (time.monotonic() + self.ttl, credentials)
+        while len(self._data) > self.max_items:
+            self._data.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        self._data.pop(user_id, None)
+
+    # Интерфейс локального кэша для шины сброса: ключи приходят строками
+    def delete(self, key: str):
+        self.invalidate(int(key))
+
+    def delete_prefix(self, prefix: str):
+        self.clear()
+
+    def clear(self):
+        self._data.clear()
+
+
+user_credentials_cache = UserCredentialsCache(USER_CACHE_TTL, USER_CACHE_MAX_ITEMS)
+invalidation_bus.register("user_credentials", user_credentials_cache)
+
+
+def _credentials(user) -> UserCredentials:
+    return UserCredentials(
+        id=user.id, login=user.login, access_token=user.access_token, expires_at=user.token_expires_at
+    )
+
+
+async def get_user_credentials(user_id: int) -> Optional[UserCredentials]:
+    """
+    Логин и токен пользователя из памяти процесса.
+
+    Сессия БД открывается только при промахе, поэтому запросы, которые
+    обслуживаются из Redis, базу не трогают.
+    """
+    credentials = user_credentials_cache.get(user_id)
+    if credentials is None:
+        stmt = select(User.id, User.login, User.access_token, User.token_expires_at).where(User.id == user_id)
+        session_factory = await read_session_for(user_id)
+        async with session_factory() as db:
+            row = (await db.execute(stmt)).first()
+        if (row is None or not row.access_token) and session_factory is not async_session:
+            # Реплика могла еще не получить только что созданного пользователя
+            async with async_session() as db:
+                row = (await db.execute(stmt)).first()
+
+        if row is None or not row.access_token:
+            return None
+
+        credentials = _credentials(row)
+        user_credentials_cache.set(credentials)
+
+    if credentials.expires_soon():
+        credentials = await refresh_user_token(user_id) or credentials
+    return credentials
+
+
+async def invalidate_user_credentials(user_id: int):
+    """Сбрасывает закэшированные данные пользователя после обновления токенов во всех процессах."""
+    await invalidation_bus.publish("user_credentials", key=str(user_id))
+
+
+def token_expires_at(expires_in) -> Optional[datetime]:
+    """Момент истечения токена по полю expires_in ответа oauth.yandex.ru."""
+    if not expires_in:
+        return None
+    return datetime.utcnow() + timedelta(seconds=int(expires_in))
+
+
+async def request_token_refresh(refresh_token: str) -> Optional[dict]:
+    data = {
+        "grant_type": "refresh_token",
+        "refresh_token": refresh_token,
+        "client_id": YANDEX_CLIENT_ID,
+        "client_secret": YANDEX_CLIENT_SECRET,
+    }
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+
+    async with oauth_gate.slot():
+        response = await get_http_client().post(
+            YANDEX_TOKEN_URL, data=data, headers=headers, timeout=upstream_timeout()
+        )
+    if response.status_code != 200:
+        logger.error(f"Не удалось обновить токен: {response.status_code} - {response.text}")
+        try:
+            error = response.json().get("error")
+        except ValueError:
+            error = None
+        # Постоянную ошибку отдаем вызывающему коду, временную — как None
+        return {"error": error} if error in TOKEN_REFRESH_FATAL_ERRORS else None
+    return response.json()
+
+
+# Блокировка живет, пока ее держит или ждет хотя бы один вызов, поэтому словарь не растет
+_refresh_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _refresh_lock(user_id: int) -> asyncio.Lock:
+    lock = _refresh_locks.get(user_id)
+    if lock is None:
+        lock = _refresh_locks[user_id] = asyncio.Lock()
+    return lock
+
+
+async def refresh_user_token(user_id: int, margin: int = TOKEN_INLINE_REFRESH_MARGIN) -> Optional[UserCredentials]:
+    """
+    Обновляет access_token по refresh_token и сохраняет новые токены.
+
+    Параллельные вызовы для одного пользователя выполняют один запрос к oauth.yandex.ru;
+    если токен уже обновлен (например, другим процессом), запрос не делается.
+    """
+    async with _refresh_lock(user_id):
+        async with async_session() as db:
+            result = await db.execute(select(User).where(User.id == user_id))
+            user = result.scalars().first()
+            if not user or not user.refresh_token or user.token_refresh_failed_at is not None:
+                return None
+
+            credentials = _credentials(user)
+            if user.token_expires_at is not None and not credentials.expires_soon(margin):
+                user_credentials_cache.set(credentials)
+                return credentials
+
+            try:
+                tokens = await request_token_refresh(user.refresh_token)
+            except Exception as e:
+                logger.error(f"Ошибка сети при обновлении токена user_id={user_id}: {e}")
+                return None
+            if tokens and tokens.get("error"):
+                # Повторять бессмысленно: пользователь должен заново пройти авторизацию
+                user.token_refresh_failed_at = datetime.utcnow()
+                await db.commit()
+                logger.warning(f"refresh_token user_id={user_id} отклонен ({tokens['error']}), обновление отключено")
+                return None
+            if not tokens or not tokens.get("access_token"):
+                return None
+
+            user.access_token = tokens["access_token"]
+            user.refresh_token = tokens.get("refresh_token") or user.refresh_token
+            user.token_expires_at = token_expires_at(tokens.get("expires_in"))
+            await db.commit()
+            await mark_recent_write(user_id)
+
+            credentials = _credentials(user)
+
+    await invalidate_user_credentials(user_id)
+    user_credentials_cache.set(credentials)
+    logger.info(f"Токен обновлен для user_id={user_id}, истекает {credentials.expires_at}")
+    return credentials
+
+
+async def refresh_expiring_tokens(horizon: int = TOKEN_REFRESH_HORIZON) -> dict:
+    """
+    Пакетно обновляет токены, истекающие в пределах horizon секунд.
+
+    Пользователи без известного срока действия тоже обновляются, чтобы узнать expires_in.
+    Одновременно к oauth.yandex.ru уходит не больше TOKEN_REFRESH_CONCURRENCY запросов.
+    """
+    border = datetime.utcnow() + timedelta(seconds=horizon)
+    async with async_session() as db:
+        result = await db.execute(
+            select(User.id).where(
+                User.refresh_token.isnot(None),
+                User.token_refresh_failed_at.is_(None),
+                or_(User.token_expires_at.is_(None), User.token_expires_at < border),
+            )
+        )
+        user_ids = list(result.scalars().all())
+
+    semaphore = asyncio.Semaphore(TOKEN_REFRESH_CONCURRENCY)
+
+    async def refresh(user_id: int) -> bool:
+        async with semaphore:
+            return await refresh_user_token(user_id, margin=horizon) is not None
+
+    results = await asyncio.gather(*(refresh(user_id) for user_id in user_ids))
+    refreshed = sum(results)
+    logger.info(f"Обновлено токенов: {refreshed}, с ошибкой: {len(user_ids) - refreshed}")
+    return {"refreshed": refreshed, "failed": len(user_ids) - refreshed}
@@ -0,0 +1,362 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable, Iterable, Optional, Union
+
+import orjson
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+from src.clients import get_redis_client
+from src.invalidation import invalidation_bus
+from src.responses import ORJSON_OPTIONS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# TTL для диапазонов, которые полностью в прошлом (0 — хранить бессрочно)
+METRICA_CACHE_TTL_HISTORIC = int(os.getenv("METRICA_CACHE_TTL_HISTORIC", 30 * 86400))
+# TTL для диапазонов, которые захватывают сегодняшний день
+METRICA_CACHE_TTL_CURRENT = int(os.getenv("METRICA_CACHE_TTL_CURRENT", 300))
+# Метрика может досчитывать последние дни, поэтому они еще не считаются закрытыми
+METRICA_CACHE_SETTLE_DAYS = int(os.getenv("METRICA_CACHE_SETTLE_DAYS", 1))
+
+# TTL для ответов Директа (кампании и т.п.), которые меняются в течение дня
+DIRECT_CACHE_TTL = int(os.getenv("DIRECT_CACHE_TTL", 300))
+
+# Ограничения локального (in-process) уровня
+LOCAL_CACHE_MAX_ITEMS = int(os.getenv("LOCAL_CACHE_MAX_ITEMS", 512))
+LOCAL_CACHE_MAX_BYTES = int(os.getenv("LOCAL_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+LOCAL_CACHE_MAX_TTL = int(os.getenv("LOCAL_CACHE_MAX_TTL", 600))
+
+# Множество ключей кэша, помеченных тегом (пользователь, счетчик, цель, месяц)
+CACHE_TAG_KEY = "cache_tag:{tag}"
+# Сколько ключей удаляется одной командой при сбросе тега
+TAG_DELETE_BATCH = 1000
+
+# Значения кэша — только типы JSON: даты и прочее, что при чтении вернулось бы строкой,
+# вызывают TypeError при записи, а не подменяются молча
+CACHE_ORJSON_OPTIONS = ORJSON_OPTIONS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def normalize_query(params: dict) -> str:
+    """Приводит параметры запроса к каноничному виду: сортировка ключей и списков метрик."""
+    normalized = {}
+    for key, value in params.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            value = ",".join(sorted(str(v).strip() for v in value))
+        elif isinstance(value, str) and key in ("metrics", "dimensions"):
+            value = ",".join(part.strip() for part in value.split(","))
+        else:
+            value = str(value).strip()
+        normalized[key] = value
+    return json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+
+
+def make_cache_key(namespace: str, params: dict) -> str:
+    digest = hashlib.sha256(normalize_query(params).encode()).hexdigest()
+    return f"{namespace}:{digest}"
+
+
+def _as_date(value: Union[str, date, datetime]) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def ttl_for_range(date2: Union[str, date, datetime]) -> Optional[int]:
+    """
+    TTL в зависимости от того, закрыт ли период.
+
+    Данные за прошедшие дни неизменны и хранятся долго (None — без срока),
+    период, включающий сегодня, кэшируется коротко.
+    """
+    closed_before = date.today() - timedelta(days=METRICA_CACHE_SETTLE_DAYS)
+    if _as_date(date2) < closed_before:
+        return METRICA_CACHE_TTL_HISTORIC or None
+    return METRICA_CACHE_TTL_CURRENT
+
+
+def user_tag(user_id) -> str:
+    return f"user:{user_id}"
+
+
+def counter_tag(counter_id) -> str:
+    return f"counter:{counter_id}"
+
+
+def goal_tag(goal_id) -> str:
+    return f"goal:{goal_id}"
+
+
+def range_tags(date1: Union[str, date, datetime], date2: Union[str, date, datetime]) -> list[str]:
+    """Теги месяцев, которые затрагивает период: по ним сбрасываются пересчитанные Метрикой данные."""
+    current, end = _as_date(date1).replace(day=1), _as_date(date2)
+    tags = []
+    while current <= end:
+        tags.append(f"month:{current:%Y-%m}")
+        current = (current + timedelta(days=32)).replace(day=1)
+    return tags
+
+
+# Член множества тега, отмечающий, что в нем есть бессрочные ключи: такому множеству TTL не ставится
+PERSISTENT_TAG_MARKER = "__persistent__"
+# Продлевает TTL множества тега до ARGV[1], но никогда не сокращает его
+# и не ставит TTL множеству с бессрочными ключами
+EXTEND_TAG_TTL_SCRIPT = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[2]) == 1 then
+    return 0
+end
+local current = redis.call('TTL', KEYS[1])
+if current == -1 or current < tonumber(ARGV[1]) then
+    return redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+def add_tag_commands(pipe, keys: Iterable[str], tags: Iterable[str], ttl: Optional[int]):
+    """
+    Добавляет в pipeline регистрацию ключей под тегами.
+
+    Множество тега живет не меньше самого долгоживущего ключа в нем;
+    лишние ключи (уже истекшие) безопасно удаляются при сбросе.
+    """
+    keys = list(keys)
+    for tag in tags:
+        tag_key = CACHE_TAG_KEY.format(tag=tag)
+        pipe.sadd(tag_key, *keys)
+        if ttl:
+            pipe.eval(EXTEND_TAG_TTL_SCRIPT, 1, tag_key, ttl, PERSISTENT_TAG_MARKER)
+        else:
+            pipe.sadd(tag_key, PERSISTENT_TAG_MARKER)
+            pipe.persist(tag_key)
+
+
+async def tag_keys(keys: Iterable[str], tags: Iterable[str], ttl: Optional[int]):
+    """Регистрирует уже записанные ключи под тегами."""
+    tags = list(tags)
+    if not tags:
+        return
+    try:
+        async with get_redis_client().pipeline(transaction=False) as pipe:
+            add_tag_commands(pipe, keys, tags, ttl)
+            await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Не удалось записать теги кэша {tags}: {e}")
+
+
+async def invalidate_tags(*tags: str) -> int:
+    """
+    Удаляет все ключи, помеченные любым из тегов, и сами теги.
+
+    Работает через множества тегов и pipeline, без SCAN по всему keyspace.
+    Локальные копии этих ключей сбрасываются во всех процессах. Возвращает число удаленных ключей.
+    """
+    if not tags:
+        return 0
+    redis_client = get_redis_client()
+    tag_keys_list = [CACHE_TAG_KEY.format(tag=tag) for tag in tags]
+
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for tag_key in tag_keys_list:
+                pipe.smembers(tag_key)
+            members = await pipe.execute()
+
+        keys = sorted(
+            {key.decode() if isinstance(key, bytes) else key for group in members for key in group}
+            - {PERSISTENT_TAG_MARKER}
+        )
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for i in range(0, len(keys), TAG_DELETE_BATCH):
+                pipe.unlink(*keys[i:i + TAG_DELETE_BATCH])
+            pipe.unlink(*tag_keys_list)
+            results = await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Не удалось сбросить теги кэша {', '.join(tags)}: {e}")
+        return 0
+    deleted = sum(results[:-1])
+
+    keys_by_namespace = defaultdict(list)
+    for key in keys:
+        keys_by_namespace[key.split(":", 1)[0]].append(key)
+    for namespace, namespace_keys in keys_by_namespace.items():
+        await invalidation_bus.publish(namespace, keys=namespace_keys)
+
+    logger.info(f"Сброшены теги {', '.join(tags)}: удалено ключей {deleted}")
+    return deleted
+
+
+class LocalLRUCache:
+    """
+    Ограниченный по количеству элементов и объему LRU-кэш процесса.
+
+    Пока шина сброса не подключена, элементы старше invalidation_bus.max_staleness() не отдаются.
+    """
+
+    def __init__(self, max_items: int, max_bytes: int):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.evictions = 0
+        self._data: "OrderedDict[str, tuple[Optional[float], float, bytes]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, stored_at, payload = item
+        if (expires_at is not None and expires_at <= time.monotonic()) or not invalidation_bus.is_fresh(stored_at):
+            self.delete(key)
+            return None
+        self._data.move_to_end(key)
+        return payload
+
+    def set(self, key: str, payload: bytes, ttl: Optional[int]):
+        if len(payload) > self.max_bytes:
+            return
+        self.delete(key)
+        now = time.monotonic()
+        self._data[key] = (now + ttl if ttl else None, now, payload)
+        self.total_bytes += len(payload)
+        while len(self._data) > self.max_items or self.total_bytes > self.max_bytes:
+            _, (_, _, evicted) = self._data.popitem(last=False)
+            self.total_bytes -= len(evicted)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.total_bytes -= len(item[2])
+
+    def delete_prefix(self, prefix: str):
+        for key in [k for k in self._data if k.startswith(prefix)]:
+            self.delete(key)
+
+    def clear(self):
+        self._data.clear()
+        self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TwoTierCache:
+    """Двухуровневый кэш: локальный LRU перед Redis."""
+
+    def __init__(self, namespace: str, local: LocalLRUCache):
+        self.namespace = namespace
+        self.local = local
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def key(self, params: dict) -> str:
+        return make_cache_key(self.namespace, params)
+
+    async def get(self, key: str) -> Optional[Any]:
+        payload = self.local.get(key)
+        if payload is not None:
+            self.local_hits += 1
+            return orjson.loads(payload)
+
+        try:
+            redis_client = get_redis_client()
+            payload = await redis_client.get(key)
+            if payload is not None:
+                ttl = await redis_client.ttl(key)
+        except redis.RedisError as e:
+            logger.warning(f"Redis недоступен, кэш пропущен: {e}")
+            payload = None
+
+        if payload is None:
+            self.misses += 1
+            return None
+
+        self.redis_hits += 1
+        self.local.set(key, payload, self._local_ttl(ttl if ttl > 0 else None))
+        return orjson.loads(payload)
+
+    async def set(self, key: str, value: Any, ttl: Optional[int], tags: Iterable[str] = ()):
+        """Записывает значение; tags позволяют потом сбросить его вместе с другими (invalidate_tags)."""
+        payload = orjson.dumps(value, option=CACHE_ORJSON_OPTIONS)
+        self.local.set(key, payload, self._local_ttl(ttl))
+        try:
+            async with get_redis_client().pipeline(transaction=False) as pipe:
+                pipe.set(key, payload, ex=ttl)
+                add_tag_commands(pipe, [key], tags, ttl)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Не удалось записать в Redis {key}: {e}")
+
+    async def get_or_fetch(
+        self,
+        params: dict,
+        date2: Union[str, date, datetime],
+        fetch: Callable[[], Awaitable[Any]],
+        tags: Iterable[str] = (),
+    ) -> Any:
+        """Возвращает данные из кэша или вызывает fetch и сохраняет результат."""
+        key = self.key(params)
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+
+        value = await fetch()
+        await self.set(key, value, ttl_for_range(date2), tags)
+        return value
+
+    async def delete(self, key: str):
+        try:
+            await get_redis_client().delete(key)
+        except redis.RedisError as e:
+            logger.warning(f"Не удалось удалить {key} из Redis: {e}")
+        # Сброс рассылается после удаления из Redis: иначе другой процесс успеет
+        # перечитать старое значение из Redis в свой локальный уровень
+        await invalidation_bus.publish(self.namespace, key=key)
+
+    async def invalidate_local(self, prefix: str = ""):
+        """Сбрасывает локальные копии ключей с префиксом во всех процессах (Redis не трогает)."""
+        await invalidation_bus.publish(self.namespace, prefix=prefix)
+
+    @staticmethod
+    def _local_ttl(ttl: Optional[int]) -> int:
+        # Локальная копия живет не дольше LOCAL_CACHE_MAX_TTL, чтобы ограничить расхождение между воркерами
+        return min(ttl, LOCAL_CACHE_MAX_TTL) if ttl else LOCAL_CACHE_MAX_TTL
+
+    def stats(self) -> dict:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "namespace": self.namespace,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.local_hits + self.redis_hits) / lookups, 4) if lookups else 0.0,
+            "local_items": len(self.local),
+            "local_bytes": self.local.total_bytes,
+            "local_evictions": self.local.evictions,
+        }
+
+
+metrica_cache = TwoTierCache(
+    "metrica",
+    LocalLRUCache(max_items=LOCAL_CACHE_MAX_ITEMS, max_bytes=LOCAL_CACHE_MAX_BYTES),
+)
+
+direct_cache = TwoTierCache(
+    "direct",
+    LocalLRUCache(max_items=LOCAL_CACHE_MAX_ITEMS, max_bytes=LOCAL_CACHE_MAX_BYTES),
+)
+
+invalidation_bus.register(metrica_cache.namespace, metrica_cache.local)
+invalidation_bus.register(direct_cache.namespace, direct_cache.local)
@@ -0,0 +1,84 @@
+import os
+import asyncio
+import logging
+from typing import Optional
+
+import httpx
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6380/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 30))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", 20))
+
+# Хуки httpx для инструментирования (профилирование).
+# Регистрируются при старте приложения, до создания клиента: httpx копирует списки.
+HTTP_EVENT_HOOKS: dict[str, list] = {"request": [], "response": []}
+
+# Клиенты привязаны к event loop, в котором созданы: в API это loop uvicorn,
+# в Celery — постоянный loop процесса воркера (см. src/ReportsDirect/celery.py)
+_http_client: Optional[httpx.AsyncClient] = None
+_redis_client: Optional[redis.Redis] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _current_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _check_loop():
+    """Сбрасывает клиенты, если они были созданы в другом (уже чужом) event loop."""
+    global _http_client, _redis_client, _loop
+    loop = _current_loop()
+    if loop is not None and _loop is not None and loop is not _loop:
+        logger.info("Event loop сменился, общие клиенты будут созданы заново")
+        _http_client = None
+        _redis_client = None
+    if loop is not None:
+        _loop = loop
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Общий httpx-клиент с пулом keep-alive соединений."""
+    global _http_client
+    _check_loop()
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            ),
+            event_hooks=HTTP_EVENT_HOOKS,
+        )
+    return _http_client
+
+
+def get_redis_client() -> redis.Redis:
+    """Общий клиент Redis (пул соединений создается один раз на процесс)."""
+    global _redis_client
+    _check_loop()
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS)
+    return _redis_client
+
+
+async def close_clients():
+    """Закрывает общие клиенты при остановке приложения или воркера."""
+    global _http_client, _redis_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    if _redis_client is not None:
+        await _redis_client.aclose()
+        _redis_client = None
@@ -1,25 +1,110 @@
 import os
+import logging
+from typing import Optional
 
 from dotenv import load_dotenv
+from fastapi import Request
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
+from src.clients import get_redis_client
+from src.upstreams import check_budget
+
 
 load_dotenv()
+
+logger = logging.getLogger(__name__)
+
 # Строка подключения к базе данных
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Необязательная реплика для тяжелых чтений; без нее все запросы идут в основную базу
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+# Сколько секунд после записи чтения пользователя идут в основную базу (с запасом на лаг репликации)
+DB_READ_AFTER_WRITE_WINDOW = int(os.getenv("DB_READ_AFTER_WRITE_WINDOW", 10))
+RECENT_WRITE_KEY = "db_recent_write:{user_id}"
 
 # Создание асинхронного движка
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+)
+
+replica_engine = create_async_engine(
+    DATABASE_REPLICA_URL,
+    echo=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+) if DATABASE_REPLICA_URL else None
+
+all_engines = [engine] + ([replica_engine] if replica_engine is not None else [])
+
+
+def _check_request_deadline(conn, cursor, statement, parameters, context, executemany):
+    # Запрос к БД не начинается, если бюджет HTTP-запроса уже исчерпан
+    check_budget(needed=0)
+
+
+for _engine in all_engines:
+    event.listen(_engine.sync_engine, "before_cursor_execute", _check_request_deadline)
+
 
 # Создание сессии
 async_session = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
+# Сессии только для чтения: реплика, если настроена, иначе основная база
+async_read_session = sessionmaker(
+    replica_engine or engine, class_=AsyncSession, expire_on_commit=False
+)
 
 # Создание базового класса для моделей
 Base = declarative_base()
 
 async def get_db():
+    check_budget()
     async with async_session() as session:
         yield session
+
+
+async def mark_recent_write(user_id: int):
+    """Отмечает запись данных пользователя: ближайшие чтения пойдут в основную базу."""
+    if replica_engine is None:
+        return
+    try:
+        await get_redis_client().set(RECENT_WRITE_KEY.format(user_id=user_id), 1, ex=DB_READ_AFTER_WRITE_WINDOW)
+    except Exception as e:
+        logger.warning(f"Не удалось отметить запись user_id={user_id}: {e}")
+
+
+async def read_session_for(user_id: Optional[int] = None) -> sessionmaker:
+    """Фабрика сессий для чтения: реплика, кроме случаев, когда данные пользователя только что изменены."""
+    if replica_engine is None or user_id is None:
+        return async_read_session
+    try:
+        recent_write = await get_redis_client().exists(RECENT_WRITE_KEY.format(user_id=user_id))
+    except Exception:
+        # Без Redis не можем проверить свежесть реплики, поэтому читаем из основной базы
+        recent_write = True
+    return async_session if recent_write else async_read_session
+
+
+async def get_read_db(request: Request):
+    """
+    Зависимость для обработчиков, которые только читают.
+
+    Если в пути или параметрах есть user_id, а данные этого пользователя недавно
+    записывались, чтение идет в основную базу (read-your-writes).
+    """
+    check_budget()
+    user_id = request.path_params.get("user_id") or request.query_params.get("user_id")
+    session_factory = await read_session_for(int(user_id) if str(user_id or "").isdigit() else None)
+    async with session_factory() as session:
+        yield session
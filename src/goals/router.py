@@ -1,10 +1,10 @@
 import os
 from datetime import datetime, date, timedelta
 from collections import defaultdict
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Sequence
 
-from fastapi import APIRouter, Query, HTTPException, Depends
-from httpx import AsyncClient
+from fastapi import APIRouter, Query, HTTPException, Depends, Request
+from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -12,8 +12,23 @@ from dotenv import load_dotenv
 
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 
+from src.clients import get_http_client
+import orjson
+
+from src.cache import metrica_cache, METRICA_CACHE_TTL_CURRENT, counter_tag, goal_tag, range_tags, ttl_for_range
 from src.database import get_db
+from src.metrica import fetch_stat_rows_windowed
+from src.responses import (
+    ORJSON_OPTIONS,
+    RawJSONResponse,
+    conditional_headers,
+    is_not_modified,
+    make_etag,
+    not_modified_response,
+)
 from src.goals.models import GoalStatFinal
+from src.tracing import traced
+from src.upstreams import metrica_gate, upstream_timeout
 
 load_dotenv()
 
@@ -23,7 +38,9 @@ YANDEX_API_URL = os.getenv("API_METRICA_URL")
 YANDEX_OAUTH_TOKEN = os.getenv("API_TOKEN")
 
 GOAL_IDS = [183338431, 91705897, 339342936]
-METRIC_SUFFIXES = ["reaches", "conversionRate", "visits"]
+# Поле ответа -> суффикс метрики Метрики ym:s:goal<id><suffix>
+GOAL_FIELDS = {"reaches": "reaches", "conversion_rate": "conversionRate", "visits": "visits"}
+METRIC_SUFFIXES = list(GOAL_FIELDS.values())
 
 def parse_date_from_group(group_key: str, group_by: str) -> date:
     if group_by == "day":
@@ -35,12 +52,29 @@ def parse_date_from_group(group_key: str, group_by: str) -> date:
         return datetime.strptime(f"{year}-W{week}-1", "%Y-W%W-%w").date()
     raise ValueError("Unsupported group_by value")
 
+def parse_goal_fields(fields: Optional[List[str]]) -> List[str]:
+    """Поля из ?fields=reaches&fields=visits или ?fields=reaches,visits в каноничном порядке."""
+    if not fields:
+        return list(GOAL_FIELDS)
+    requested = {part.strip() for value in fields for part in value.split(",") if part.strip()}
+    unknown = requested - GOAL_FIELDS.keys()
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [field for field in GOAL_FIELDS if field in requested]
+
+
+@traced()
 async def get_goals(counter_id: str) -> Dict[int, str]:
+    cache_key = metrica_cache.key({"goals_counter": counter_id})
+    cached = await metrica_cache.get(cache_key)
+    if cached is not None:
+        return {int(goal_id): name for goal_id, name in cached.items()}
+
     url = f"https://api-metrika.yandex.ru/management/v1/counter/{counter_id}/goals"
     headers = {"Authorization": f"OAuth {YANDEX_OAUTH_TOKEN}"}
 
-    async with AsyncClient() as client:
-        response = await client.get(url, headers=headers)
+    async with metrica_gate.slot():
+        response = await get_http_client().get(url, headers=headers, timeout=upstream_timeout())
 
     if response.status_code != 200:
         raise HTTPException(
@@ -56,39 +90,61 @@ async def get_goals(counter_id: str) -> Dict[int, str]:
     if "goals" not in data:
         raise HTTPException(status_code=500, detail="No goals found in the response")
 
-    return {
+    goals = {
         goal["id"]: goal["name"]
         for goal in data["goals"]
         if goal.get("id") in GOAL_IDS and goal.get("name")
     }
+    # Список целей может меняться в любой момент, поэтому храним его недолго
+    await metrica_cache.set(cache_key, goals, METRICA_CACHE_TTL_CURRENT, tags=[counter_tag(counter_id)])
+    return goals
+
 
+@traced()
+async def save_goal_stats_final(session: AsyncSession, result, group_by) -> int:
+    """
+    Сохраняет итоги по периодам; в result должны быть все поля GOAL_FIELDS.
 
-async def save_goal_stats_final(session: AsyncSession, result, group_by):
+    Решение о записи принимается по содержимому таблицы: пишутся только отсутствующие
+    и изменившиеся строки. Возвращает число записанных строк.
+    """
     values_to_insert = []
 
     for item in result:
         period_date = parse_date_from_group(item['date'], group_by)
 
         for goal in item['goals']:
-            values_to_insert.append({
+            value = {
                 'goal_id': int(goal['id']),
                 'date': period_date,
                 'period_type': group_by,
-                'reaches': goal['reaches'],
-                'conversion_rate': goal['conversion_rate'],
-                'visits': goal['visits'],
-            })
+            }
+            value.update({field: goal[field] for field in GOAL_FIELDS})
+            values_to_insert.append(value)
+
+    if not values_to_insert:
+        return 0
 
     try:
+        stored = await session.execute(
+            select(GoalStatFinal.goal_id, GoalStatFinal.date, *(getattr(GoalStatFinal, field) for field in GOAL_FIELDS))
+            .where(
+                GoalStatFinal.period_type == group_by,
+                GoalStatFinal.goal_id.in_({value['goal_id'] for value in values_to_insert}),
+                GoalStatFinal.date.in_({value['date'] for value in values_to_insert}),
+            )
+        )
+        existing = {(row[0], row[1]): tuple(row[2:]) for row in stored}
+        values_to_insert = [
+            value for value in values_to_insert
+            if existing.get((value['goal_id'], value['date'])) != tuple(value[field] for field in GOAL_FIELDS)
+        ]
+
         for value in values_to_insert:
             stmt = pg_insert(GoalStatFinal).values(value)
             stmt = stmt.on_conflict_do_update(
                 index_elements=['goal_id', 'date', 'period_type'],
-                set_={
-                    'reaches': stmt.excluded.reaches,
-                    'conversion_rate': stmt.excluded.conversion_rate,
-                    'visits': stmt.excluded.visits,
-                }
+                set_={field: stmt.excluded[field] for field in GOAL_FIELDS}
             )
             await session.execute(stmt)
         await session.commit()
@@ -96,74 +152,53 @@ async def save_goal_stats_final(session: AsyncSession, result, group_by):
         await session.rollback()
         print(f"SQLAlchemy error: {e}")
         raise e
+    return len(values_to_insert)
 
 
-@router.get("/statistics", summary="Получить статистики по целям")
-async def get_parsed_goal_metrics(
-    date1: date = Query(...),
-    date2: date = Query(...),
-    ids: str = Query("181494"),
-    group_by: str = Query("day", pattern="^(day|week|month)$"),
-    goal_ids_filter: Optional[List[int]] = Query(None),
-    session: AsyncSession = Depends(get_db)
-) -> Dict:
-    all_goals = await get_goals(ids)
-    filtered_goals = {
-        gid: name for gid, name in all_goals.items()
-        if (goal_ids_filter is None or gid in goal_ids_filter)
-    }
-    goal_ids = list(filtered_goals.keys())
-
-    if not goal_ids:
-        raise HTTPException(status_code=400, detail="No goals found for the given filter")
-
-    metrics = [f"ym:s:goal{goal_id}{suffix}" for goal_id in goal_ids for suffix in METRIC_SUFFIXES]
-    params = {
-        "ids": ids,
-        "metrics": ",".join(metrics),
-        "dimensions": "ym:s:date",
-        "date1": str(date1),
-        "date2": str(date2),
-    }
-
-    headers = {"Authorization": f"OAuth {YANDEX_OAUTH_TOKEN}"}
+MONTH_NAMES_RU = {
+    "01": "январь", "02": "февраль", "03": "март", "04": "апрель",
+    "05": "май", "06": "июнь", "07": "июль", "08": "август",
+    "09": "сентябрь", "10": "октябрь", "11": "ноябрь", "12": "декабрь"
+}
 
-    async with AsyncClient() as client:
-        response = await client.get(YANDEX_API_URL, params=params, headers=headers)
 
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail={"error": "Failed to fetch Yandex Metrika"})
+@traced()
+def build_goal_groups(
+    rows: list[dict],
+    goal_ids: List[int],
+    date1: date,
+    date2: date,
+    group_by: str,
+    fields: Sequence[str] = tuple(GOAL_FIELDS),
+) -> list[dict]:
+    """
+    Раскладывает строки stat/v1/data по дням, группирует по day/week/month и подписывает периоды.
 
-    try:
-        data = response.json()
-    except ValueError:
-        raise HTTPException(status_code=500, detail="Invalid response from Yandex")
+    Метрики в строках идут по целям, внутри цели — в порядке fields.
+    """
+    fields = list(fields)
+    empty = {field: 0.0 if field == "conversion_rate" else 0 for field in fields}
 
     # Подготовка пустых значений на все дни
     all_dates = {}
     current = date1
     while current <= date2:
-        all_dates[str(current)] = {
-            str(gid): {"id": str(gid), "reaches": 0, "conversion_rate": 0.0, "visits": 0}
-            for gid in goal_ids
-        }
+        all_dates[str(current)] = {str(gid): {"id": str(gid), **empty} for gid in goal_ids}
         current += timedelta(days=1)
 
-    for row in data.get("data", []):
+    for row in rows:
         date_str = row["dimensions"][0]["name"]
         metrics_values = row["metrics"]
         for i, goal_id in enumerate(goal_ids):
-            offset = i * len(METRIC_SUFFIXES)
-            all_dates[date_str][str(goal_id)] = {
-                "id": str(goal_id),
-                "reaches": metrics_values[offset],
-                "conversion_rate": round(metrics_values[offset + 1], 2),
-                "visits": metrics_values[offset + 2],
-            }
+            offset = i * len(fields)
+            values = {"id": str(goal_id)}
+            for j, field in enumerate(fields):
+                value = metrics_values[offset + j]
+                values[field] = round(value, 2) if field == "conversion_rate" else value
+            all_dates[date_str][str(goal_id)] = values
 
-    grouped = defaultdict(lambda: defaultdict(lambda: {
-        "id": "", "reaches": 0, "conversion_rate_sum": 0.0, "visits": 0, "count": 0
-    }))
+    # conversion_rate в группе накапливается суммой и затем усредняется по дням
+    grouped = defaultdict(lambda: defaultdict(lambda: {"id": "", **empty, "count": 0}))
 
     for date_str, goals in all_dates.items():
         dt = datetime.strptime(date_str, "%Y-%m-%d").date()
@@ -178,32 +213,26 @@ async def get_parsed_goal_metrics(
         for goal_id, values in goals.items():
             g = grouped[group_key][goal_id]
             g["id"] = goal_id
-            g["reaches"] += values["reaches"]
-            g["conversion_rate_sum"] += values["conversion_rate"]
-            g["visits"] += values["visits"]
+            for field in fields:
+                g[field] += values[field]
             g["count"] += 1
 
-    month_names_ru = {
-        "01": "январь", "02": "февраль", "03": "март", "04": "апрель",
-        "05": "май", "06": "июнь", "07": "июль", "08": "август",
-        "09": "сентябрь", "10": "октябрь", "11": "ноябрь", "12": "декабрь"
-    }
-
     result = []
     for group_key in sorted(grouped.keys()):
         goals_data = []
         for goal_id, g in grouped[group_key].items():
-            goals_data.append({
-                "id": goal_id,
-                "reaches": g["reaches"],
-                "conversion_rate": round(g["conversion_rate_sum"] / g["count"], 2) if g["count"] else 0.0,
-                "visits": g["visits"]
-            })
+            goal_data = {"id": goal_id}
+            for field in fields:
+                if field == "conversion_rate":
+                    goal_data[field] = round(g[field] / g["count"], 2) if g["count"] else 0.0
+                else:
+                    goal_data[field] = g[field]
+            goals_data.append(goal_data)
 
         # Генерация label
         if group_by == "month":
             year, month = group_key.split("-")
-            label = f"{year} - {month_names_ru[month]}"
+            label = f"{year} - {MONTH_NAMES_RU[month]}"
         elif group_by == "week":
             year, week = group_key.split("-W")
             year, week = int(year), int(week)
@@ -222,12 +251,104 @@ async def get_parsed_goal_metrics(
             "goals": goals_data
         })
 
-    await save_goal_stats_final(session, result, group_by)
+    return result
+
+
+def goal_stats_validator_key(
+    ids: str, date1: date, date2: date, group_by: str, goal_ids_filter: Optional[List[int]], fields: List[str]
+) -> str:
+    return metrica_cache.key({
+        "goal_stats_validator": ids,
+        "date1": str(date1),
+        "date2": str(date2),
+        "group_by": group_by,
+        "goal_ids_filter": goal_ids_filter,
+        "fields": fields,
+    })
+
+
+async def get_goal_stats_validator(key: str) -> tuple[Optional[str], Optional[datetime]]:
+    """ETag и Last-Modified последнего ответа с такими параметрами, пока живы его данные в кэше."""
+    validator = await metrica_cache.get(key)
+    if not validator:
+        return None, None
+    return validator["etag"], datetime.fromisoformat(validator["last_modified"])
+
+
+@router.get("/statistics", summary="Получить статистики по целям")
+async def get_parsed_goal_metrics(
+    request: Request,
+    date1: date = Query(...),
+    date2: date = Query(...),
+    ids: str = Query("181494"),
+    group_by: str = Query("day", pattern="^(day|week|month)$"),
+    goal_ids_filter: Optional[List[int]] = Query(None),
+    fields: Optional[List[str]] = Query(
+        None, description="Какие метрики вернуть: reaches, conversion_rate, visits (по умолчанию все)"
+    ),
+    session: AsyncSession = Depends(get_db)
+):
+    fields = parse_goal_fields(fields)
+
+    # Валидатор живет столько же, сколько окна данных в кэше, и сбрасывается теми же тегами,
+    # поэтому 304 отдается до запросов к Метрике и записи в БД
+    validator_key = goal_stats_validator_key(ids, date1, date2, group_by, goal_ids_filter, fields)
+    etag, last_modified = await get_goal_stats_validator(validator_key)
+    if etag and is_not_modified(request, etag, last_modified):
+        return not_modified_response(conditional_headers(etag, last_modified))
+
+    all_goals = await get_goals(ids)
+    filtered_goals = {
+        gid: name for gid, name in all_goals.items()
+        if (goal_ids_filter is None or gid in goal_ids_filter)
+    }
+    goal_ids = list(filtered_goals.keys())
+
+    if not goal_ids:
+        raise HTTPException(status_code=400, detail="No goals found for the given filter")
 
-    return {
+    # У Метрики запрашиваются только нужные метрики, в том же порядке разбирается ответ
+    metrics = [f"ym:s:goal{goal_id}{GOAL_FIELDS[field]}" for goal_id in goal_ids for field in fields]
+    params = {
+        "ids": ids,
+        "metrics": ",".join(metrics),
+        "dimensions": "ym:s:date",
+        "sort": "ym:s:date",
+    }
+
+    headers = {"Authorization": f"OAuth {YANDEX_OAUTH_TOKEN}"}
+
+    goal_tags = [goal_tag(goal_id) for goal_id in goal_ids]
+    # Длинный период режется на окна, которые запрашиваются параллельно и постранично
+    rows = await fetch_stat_rows_windowed(params, headers, date1, date2, tags=goal_tags)
+
+    result = build_goal_groups(rows, goal_ids, date1, date2, group_by, fields)
+
+    body = orjson.dumps({
         "goal_meta": [{"id": gid, "name": filtered_goals[gid]} for gid in goal_ids],
         "data": result
-    }
+    }, option=ORJSON_OPTIONS)
+    new_etag = make_etag(body)
+    # Строка goal_stats_final — согласованный снимок всех метрик: по части полей ее не создать
+    # (остальные NOT NULL колонки получили бы 0) и не обновить (смешались бы данные разных выборок).
+    # Что писать, решает содержимое таблицы, а не кэш: удаленная или не записанная ранее строка
+    # восстановится при следующем полном ответе
+    if len(fields) == len(GOAL_FIELDS):
+        await save_goal_stats_final(session, result, group_by)
+    # Валидатор сохраняется только после записи в БД; данные не изменились — Last-Modified прежний
+    if new_etag != etag:
+        last_modified = datetime.utcnow()
+        await metrica_cache.set(
+            validator_key,
+            {"etag": new_etag, "last_modified": last_modified.isoformat()},
+            ttl_for_range(date2),
+            tags=[counter_tag(ids), *range_tags(date1, date2), *goal_tags],
+        )
+
+    response_headers = conditional_headers(new_etag, last_modified)
+    if is_not_modified(request, new_etag, last_modified):
+        return not_modified_response(response_headers)
+    return RawJSONResponse(body, headers=response_headers)
 
 
 @router.get("/info", summary="Получить список целей", response_model=List[dict])
@@ -237,5 +358,7 @@ async def get_goal_meta():
 
         goal_meta = [{"id": goal_id, "name": goal_name} for goal_id, goal_name in goals.items()]
         return goal_meta
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
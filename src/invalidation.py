@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from typing import Optional, Protocol
+
+from dotenv import load_dotenv
+
+from src.clients import get_redis_client
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "cache_invalidation"
+# Пока подписка не работает, локальные копии старше этого числа секунд не используются
+INVALIDATION_MAX_STALENESS = int(os.getenv("INVALIDATION_MAX_STALENESS", 30))
+
+
+class LocalCache(Protocol):
+    def delete(self, key: str): ...
+
+    def delete_prefix(self, prefix: str): ...
+
+    def clear(self): ...
+
+
+class InvalidationBus:
+    """
+    Сброс локальных (in-process) кэшей во всех процессах через Redis pub/sub.
+
+    Каждый процесс API подписывается на канал при старте. Сообщение сбрасывает
+    ключ или все ключи с префиксом в кэше с указанным именем. Пока подписка не
+    работает (процесс не подписан, соединение потеряно, воркер Celery без
+    постоянно работающего loop), max_staleness() ограничивает возраст локальных
+    копий; после переподключения локальные кэши очищаются целиком, потому что
+    сообщения за время разрыва потеряны.
+    """
+
+    def __init__(self, channel: str = INVALIDATION_CHANNEL, max_staleness: int = INVALIDATION_MAX_STALENESS):
+        self.channel = channel
+        self.staleness = max_staleness
+        self.origin = uuid.uuid4().hex
+        self.connected = False
+        self.received = 0
+        self.malformed = 0
+        self._caches: dict[str, LocalCache] = {}
+        self._listener: Optional[asyncio.Task] = None
+
+    def register(self, name: str, cache: LocalCache):
+        self._caches[name] = cache
+
+    def max_staleness(self) -> Optional[float]:
+        """Допустимый возраст локальной копии или None, если сообщения о сбросе доходят."""
+        return None if self.connected else self.staleness
+
+    def is_fresh(self, stored_at: float) -> bool:
+        staleness = self.max_staleness()
+        return staleness is None or time.monotonic() - stored_at <= staleness
+
+    def _apply(
+        self, name: str, key: Optional[str] = None, prefix: Optional[str] = None, keys: Optional[list[str]] = None
+    ):
+        cache = self._caches.get(name)
+        if cache is None:
+            return
+        if key is not None:
+            cache.delete(key)
+        elif keys is not None:
+            for key in keys:
+                cache.delete(key)
+        elif prefix is not None:
+            cache.delete_prefix(prefix)
+        else:
+            cache.clear()
+
+    def _clear_all(self):
+        for cache in self._caches.values():
+            cache.clear()
+
+    async def publish(
+        self, name: str, key: Optional[str] = None, prefix: Optional[str] = None, keys: Optional[list[str]] = None
+    ):
+        """Сбрасывает ключ (список ключей, префикс или весь кэш) локально и во всех остальных процессах."""
+        self._apply(name, key, prefix, keys)
+        message = json.dumps({"cache": name, "key": key, "prefix": prefix, "keys": keys, "origin": self.origin})
+        try:
+            await get_redis_client().publish(self.channel, message)
+        except Exception as e:
+            logger.warning(f"Не удалось разослать сброс кэша {name}: {e}")
+
+    def start(self):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        self.connected = False
+
+    async def _listen(self):
+        while True:
+            pubsub = get_redis_client().pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                # Пока подписки не было, сбросы могли быть пропущены
+                self._clear_all()
+                self.connected = True
+                logger.info("Подписка на сброс локальных кэшей установлена")
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    # Ошибка в одном сообщении не должна рвать подписку и сбрасывать все кэши
+                    try:
+                        event = json.loads(message["data"])
+                        if event.get("origin") == self.origin:
+                            continue
+                        self.received += 1
+                        self._apply(event["cache"], event.get("key"), event.get("prefix"), event.get("keys"))
+                    except Exception as e:
+                        self.malformed += 1
+                        logger.warning(f"Некорректное сообщение сброса кэша пропущено: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Подписка на сброс локальных кэшей прервана: {e}")
+            finally:
+                self.connected = False
+                await pubsub.aclose()
+            await asyncio.sleep(1)
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.connected,
+            "received": self.received,
+            "malformed": self.malformed,
+            "caches": sorted(self._caches),
+            "max_staleness": self.max_staleness(),
+        }
+
+
+invalidation_bus = InvalidationBus()
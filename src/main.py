@@ -1,22 +1,67 @@
+from contextlib import asynccontextmanager
+
+from brotli_asgi import BrotliMiddleware
 from fastapi import FastAPI
+from src.clients import close_clients
+from src.database import all_engines
+from src.invalidation import invalidation_bus
+from src.profiling import PROFILING_ENABLED, ProfilingMiddleware, install_profiling_hooks
+from src.upstreams import DeadlineMiddleware
+from src.tracing import TRACING_ENABLED, TracingMiddleware, exporter as span_exporter, install_tracing
+from src.responses import COMPRESSION_EXCLUDED_PATHS, COMPRESSION_MIN_SIZE, FastJSONResponse
 from src.Users.router import router as user_router
 from src.Campanies.router import router as campanos_router
 from src.ReportsDirect.router import router as report_router
 from src.ReportsMetrica.router import router as metrics_router
 from src.Metrica_goals.router import router as goals_router
 from src.goals.router import router as g_router
+from src.Exports.router import router as exports_router
+from src.Agency.router import router as agency_router
+from src.MetricaLogs.router import router as metrica_logs_router
 
-app = FastAPI()
 
-app.include_router(user_router, tags=["users"])
-app.include_router(campanos_router, tags=["campanies"])
-app.include_router(report_router, tags=["direct_reports"])
-app.include_router(metrics_router, tags=["metrica_reports"])
-app.include_router(goals_router)
-app.include_router(g_router)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Подписка на сброс локальных кэшей, который рассылают другие процессы
+    invalidation_bus.start()
+    yield
+    await invalidation_bus.stop()
+    # Общие HTTP/Redis клиенты и пул БД живут все время работы приложения
+    await close_clients()
+    for engine in all_engines:
+        await engine.dispose()
+    span_exporter.shutdown()
 
 
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
+# br для клиентов, которые его поддерживают, иначе gzip
+app.add_middleware(
+    BrotliMiddleware,
+    minimum_size=COMPRESSION_MIN_SIZE,
+    gzip_fallback=True,
+    excluded_handlers=COMPRESSION_EXCLUDED_PATHS,
+)
 
+# Бюджет времени запроса для вызовов внешних API и БД (503 + Retry-After при перегрузке)
+app.add_middleware(DeadlineMiddleware)
 
+# Профилирование отдельных запросов по заголовку или выборке; без флага не подключается вовсе
+if PROFILING_ENABLED:
+    install_profiling_hooks(all_engines)
+    app.add_middleware(ProfilingMiddleware)
 
+# Спаны обработчиков, внешних API, БД, Redis и задач Celery в OTLP/JSON
+if TRACING_ENABLED:
+    install_tracing(all_engines)
+    app.add_middleware(TracingMiddleware)
+
+app.include_router(user_router, tags=["users"])
+app.include_router(campanos_router, tags=["campanies"])
+app.include_router(report_router, tags=["direct_reports"])
+app.include_router(metrics_router, tags=["metrica_reports"])
+app.include_router(goals_router)
+app.include_router(g_router)
+app.include_router(exports_router)
+app.include_router(agency_router)
+app.include_router(metrica_logs_router)
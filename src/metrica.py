@@ -0,0 +1,139 @@
+import os
+import asyncio
+import logging
+from datetime import date, timedelta
+from typing import AsyncIterator, Iterable
+
+from aiolimiter import AsyncLimiter
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from src.cache import counter_tag, metrica_cache, range_tags
+from src.clients import get_http_client
+from src.tracing import traced
+from src.upstreams import metrica_gate, upstream_timeout
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+METRICA_STAT_URL = os.getenv("API_METRICA_URL", "https://api-metrika.yandex.ru/stat/v1/data")
+
+# Максимальный размер страницы stat/v1/data
+METRICA_PAGE_LIMIT = int(os.getenv("METRICA_PAGE_LIMIT", 100000))
+# Длинные диапазоны режутся на окна такой длины и запрашиваются параллельно
+METRICA_WINDOW_DAYS = int(os.getenv("METRICA_WINDOW_DAYS", 92))
+
+# Общий для процесса лимит запросов к API Метрики; число параллельных запросов ограничивает metrica_gate
+metrica_limiter = AsyncLimiter(max_rate=5, time_period=1)
+
+
+def split_date_range(date1: date, date2: date, window_days: int = METRICA_WINDOW_DAYS) -> list[tuple[date, date]]:
+    """Делит диапазон [date1, date2] на последовательные окна не длиннее window_days."""
+    windows = []
+    current = date1
+    while current <= date2:
+        window_end = min(current + timedelta(days=window_days - 1), date2)
+        windows.append((current, window_end))
+        current = window_end + timedelta(days=1)
+    return windows
+
+
+async def _fetch_stat_page(url: str, params: dict, headers: dict) -> dict:
+    async with metrica_gate.slot(), metrica_limiter:
+        response = await get_http_client().get(url, params=params, headers=headers, timeout=upstream_timeout())
+
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail={"error": "Failed to fetch Yandex Metrika", "response": response.text},
+        )
+
+    try:
+        return response.json()
+    except ValueError:
+        raise HTTPException(status_code=500, detail="Invalid response from Yandex")
+
+
+async def iter_stat_pages(
+    params: dict,
+    headers: dict,
+    url: str = METRICA_STAT_URL,
+    page_limit: int = METRICA_PAGE_LIMIT,
+) -> AsyncIterator[list[dict]]:
+    """
+    Постранично отдает строки stat/v1/data.
+
+    Первая страница сообщает total_rows, после чего остальные страницы запрашиваются
+    параллельно (под общим лимитом), но отдаются строго по порядку offset.
+    """
+    first_page = await _fetch_stat_page(url, {**params, "offset": 1, "limit": page_limit}, headers)
+    yield first_page.get("data", [])
+
+    total_rows = first_page.get("total_rows", 0)
+    tasks = [
+        asyncio.create_task(_fetch_stat_page(url, {**params, "offset": offset, "limit": page_limit}, headers))
+        for offset in range(1 + page_limit, total_rows + 1, page_limit)
+    ]
+    try:
+        for task in tasks:
+            page = await task
+            yield page.get("data", [])
+    finally:
+        # Если вызывающий код прекратил чтение раньше, незачем тратить лимит на оставшиеся страницы
+        for task in tasks:
+            task.cancel()
+        # Дожидаемся отмены (и забираем ошибки завершившихся страниц), чтобы задачи
+        # не пережили генератор и не держали соединения клиента
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def iter_stat_rows(
+    params: dict,
+    headers: dict,
+    url: str = METRICA_STAT_URL,
+    page_limit: int = METRICA_PAGE_LIMIT,
+) -> AsyncIterator[dict]:
+    """Построчно отдает все строки stat/v1/data, проходя по страницам."""
+    async for page_rows in iter_stat_pages(params, headers, url, page_limit):
+        for row in page_rows:
+            yield row
+
+
+async def fetch_stat_rows(params: dict, headers: dict, url: str = METRICA_STAT_URL) -> list[dict]:
+    """Забирает все строки stat/v1/data, проходя по страницам offset/limit до total_rows."""
+    return [row async for row in iter_stat_rows(params, headers, url)]
+
+
+@traced()
+async def fetch_stat_rows_windowed(
+    params: dict,
+    headers: dict,
+    date1: date,
+    date2: date,
+    url: str = METRICA_STAT_URL,
+    window_days: int = METRICA_WINDOW_DAYS,
+    tags: Iterable[str] = (),
+) -> list[dict]:
+    """
+    Забирает строки за длинный период, разбивая его на окна.
+
+    Окна запрашиваются параллельно (под общим лимитом) и кэшируются по отдельности,
+    поэтому закрытые окна не запрашиваются повторно, даже если весь период включает сегодня.
+    Строки возвращаются в порядке окон. Каждое окно помечается тегами счетчика,
+    своих месяцев и переданными tags (например, целей).
+    """
+    tags = list(tags)
+
+    async def fetch_window(window_start: date, window_end: date) -> list[dict]:
+        window_params = {**params, "date1": str(window_start), "date2": str(window_end)}
+        return await metrica_cache.get_or_fetch(
+            window_params,
+            window_end,
+            lambda: fetch_stat_rows(window_params, headers, url),
+            tags=[counter_tag(params["ids"]), *range_tags(window_start, window_end), *tags],
+        )
+
+    windows = split_date_range(date1, date2, window_days)
+    results = await asyncio.gather(*(fetch_window(start, end) for start, end in windows))
+    return [row for window_rows in results for row in window_rows]
@@ -0,0 +1,186 @@
+import os
+import time
+import uuid
+import random
+import asyncio
+import cProfile
+import logging
+from contextvars import ContextVar
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import Optional
+
+import orjson
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+from src.clients import HTTP_EVENT_HOOKS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Профилирование отдельных запросов; выключено по умолчанию
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+# Запрос профилируется, если заголовок совпадает с токеном (без токена заголовок игнорируется)
+PROFILING_HEADER = os.getenv("PROFILING_HEADER", "X-Profile").lower().encode()
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+# Доля случайно выбранных запросов, которые профилируются без заголовка
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0))
+PROFILING_DIR = os.getenv("PROFILING_DIR", "data/profiles")
+
+
+@dataclass
+class RequestProfile:
+    """Все, что собирается во время одного профилируемого запроса, кроме самого cProfile."""
+
+    method: str
+    path: str
+    route: Optional[str] = None
+    status_code: Optional[int] = None
+    wall_ms: float = 0.0
+    # CPU и простой всего потока event loop за время запроса, а не только этого запроса:
+    # при concurrent_requests > 0 сюда входит работа конкурентных запросов
+    loop_cpu_ms: float = 0.0
+    loop_idle_ms: float = 0.0
+    # Сколько других запросов выполнялось одновременно с профилируемым (максимум)
+    concurrent_requests: int = 0
+    db_ms: float = 0.0
+    db_queries: int = 0
+    upstream_calls: list[dict] = field(default_factory=list)
+
+
+_current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("current_profile", default=None)
+# cProfile перехватывает весь поток, поэтому одновременно профилируется только один запрос
+_profiling_active = False
+_active_profile: Optional[RequestProfile] = None
+_in_flight = 0
+
+
+async def _on_http_request(request):
+    if _current_profile.get() is not None:
+        request.extensions["profile_started"] = time.perf_counter()
+
+
+async def _on_http_response(response):
+    profile = _current_profile.get()
+    started = response.request.extensions.get("profile_started")
+    if profile is None or started is None:
+        return
+    profile.upstream_calls.append({
+        "method": response.request.method,
+        "url": str(response.request.url.copy_with(query=None)),
+        "status_code": response.status_code,
+        "ms": round((time.perf_counter() - started) * 1000, 3),
+    })
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile.get() is not None:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    started = conn.info.get("profile_started")
+    if profile is None or not started:
+        return
+    profile.db_ms += (time.perf_counter() - started.pop()) * 1000
+    profile.db_queries += 1
+
+
+def install_profiling_hooks(engines):
+    """Подключает учет вызовов к внешним API и времени запросов к БД."""
+    HTTP_EVENT_HOOKS["request"].append(_on_http_request)
+    HTTP_EVENT_HOOKS["response"].append(_on_http_response)
+    for engine in engines:
+        event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _write_artifacts(profiler: cProfile.Profile, profile: RequestProfile) -> str:
+    os.makedirs(PROFILING_DIR, exist_ok=True)
+    route = (profile.route or profile.path).strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+    base = os.path.join(PROFILING_DIR, f"{datetime.utcnow():%Y%m%dT%H%M%S}_{profile.method}_{route}_{uuid.uuid4().hex[:8]}")
+    # .prof открывается pstats/snakeviz и конвертируется во flamegraph (flameprof, gprof2dot)
+    profiler.dump_stats(f"{base}.prof")
+    with open(f"{base}.json", "wb") as f:
+        f.write(orjson.dumps(asdict(profile), option=orjson.OPT_INDENT_2))
+    return base
+
+
+class ProfilingMiddleware:
+    """
+    Профилирует отдельные запросы: по заголовку с токеном или по доле PROFILING_SAMPLE_RATE.
+
+    Для каждого такого запроса в PROFILING_DIR пишется .prof (cProfile) и .json
+    с маршрутом, временем CPU и простоя потока event loop, вызовами внешних API и временем БД.
+    cProfile и счетчик CPU видят весь поток, поэтому в .prof и loop_cpu_ms попадают
+    и конкурентные запросы (их число — в concurrent_requests); учет API и БД ведется
+    только по самому запросу. Остальные запросы проходят без изменений.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _should_profile(self, scope) -> bool:
+        if PROFILING_TOKEN:
+            for name, value in scope["headers"]:
+                if name == PROFILING_HEADER:
+                    return value.decode() == PROFILING_TOKEN
+        return PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        global _in_flight
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        _in_flight += 1
+        try:
+            if not _profiling_active and self._should_profile(scope):
+                await self._profile(scope, receive, send)
+            else:
+                profile = _active_profile
+                if profile is not None:
+                    profile.concurrent_requests = max(profile.concurrent_requests, _in_flight - 1)
+                await self.app(scope, receive, send)
+        finally:
+            _in_flight -= 1
+
+    async def _profile(self, scope, receive, send):
+        global _profiling_active, _active_profile
+
+        profile = RequestProfile(method=scope["method"], path=scope["path"])
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+            await send(message)
+
+        _profiling_active = True
+        _active_profile = profile
+        profile.concurrent_requests = _in_flight - 1
+        token = _current_profile.set(profile)
+        profiler = cProfile.Profile()
+        wall_started, cpu_started = time.perf_counter(), time.thread_time()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.disable()
+            profile.wall_ms = round((time.perf_counter() - wall_started) * 1000, 3)
+            profile.loop_cpu_ms = round((time.thread_time() - cpu_started) * 1000, 3)
+            profile.loop_idle_ms = round(max(profile.wall_ms - profile.loop_cpu_ms, 0.0), 3)
+            profile.db_ms = round(profile.db_ms, 3)
+            route = scope.get("route")
+            profile.route = getattr(route, "path", None)
+            _current_profile.reset(token)
+            _profiling_active = False
+            _active_profile = None
+
+        try:
+            base = await asyncio.to_thread(_write_artifacts, profiler, profile)
+            logger.info(f"Профиль запроса {profile.method} {profile.path} сохранен в {base}.prof")
+        except Exception as e:
+            logger.error(f"Не удалось сохранить профиль запроса {profile.path}: {e}")
@@ -0,0 +1,90 @@
+import os
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Optional
+
+import orjson
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+# Ответы меньше этого размера не сжимаются: выигрыш не окупает CPU
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+# Потоковые ответы (SSE, выгрузки) не сжимаются middleware
+COMPRESSION_EXCLUDED_PATHS = [r"^/yandex-reports-events/", r"^/export/", r"^/agency/accounts"]
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON-ответ на orjson.
+
+    Возвращенный из обработчика напрямую, обходит jsonable_encoder и валидацию
+    response_model, поэтому подходит для больших списков словарей.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+
+class RawJSONResponse(Response):
+    """Ответ из уже сериализованного JSON (например, из кеша Redis) без повторного разбора."""
+
+    media_type = "application/json"
+
+
+def make_etag(payload: bytes) -> str:
+    """Сильный ETag по содержимому ответа."""
+    return f'"{hashlib.sha256(payload).hexdigest()[:32]}"'
+
+
+def conditional_headers(etag: Optional[str], last_modified: Optional[datetime] = None) -> dict:
+    headers = {"Cache-Control": "no-cache"}
+    if etag:
+        headers["ETag"] = etag
+    if last_modified:
+        headers["Last-Modified"] = format_datetime(_as_utc(last_modified), usegmt=True)
+    return headers
+
+
+def is_not_modified(request: Request, etag: Optional[str], last_modified: Optional[datetime] = None) -> bool:
+    """
+    Проверяет If-None-Match / If-Modified-Since.
+
+    If-None-Match имеет приоритет: если он передан, If-Modified-Since не учитывается.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if not etag:
+            return False
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # Last-Modified передается с точностью до секунды
+        return _as_utc(last_modified).replace(microsecond=0) <= _as_utc(since)
+
+    return False
+
+
+def not_modified_response(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+def conditional_json_response(request: Request, content: Any) -> Response:
+    """JSON-ответ с ETag; при совпадении If-None-Match тело не отправляется."""
+    body = orjson.dumps(content, option=ORJSON_OPTIONS)
+    headers = conditional_headers(make_etag(body))
+    if is_not_modified(request, headers["ETag"]):
+        return not_modified_response(headers)
+    return RawJSONResponse(body, headers=headers)
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
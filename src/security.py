@@ -0,0 +1,17 @@
+import os
+import secrets
+
+from dotenv import load_dotenv
+from fastapi import Header, HTTPException
+
+load_dotenv()
+
+# Служебные ручки (сброс и статистика кэшей, запуск загрузок) доступны только с этим токеном;
+# без токена в окружении они закрыты
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+async def require_admin(x_admin_token: str = Header("", alias="X-Admin-Token")):
+    """Зависимость служебных ручек: заголовок X-Admin-Token должен совпадать с ADMIN_TOKEN."""
+    if not ADMIN_TOKEN or not secrets.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
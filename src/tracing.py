@@ -0,0 +1,435 @@
+import os
+import time
+import queue
+import random
+import inspect
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Optional
+
+import httpx
+import orjson
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Трассировка запросов; выключена по умолчанию
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "0") == "1"
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "yandex-api")
+# Спаны пишутся в файл построчно, каждая строка — ExportTraceServiceRequest в OTLP/JSON
+TRACING_FILE = os.getenv("TRACING_FILE", "data/traces/spans.jsonl")
+# Если задан, те же пакеты отправляются в коллектор по OTLP/HTTP (например, http://localhost:4318)
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "")
+TRACING_BATCH_SIZE = int(os.getenv("TRACING_BATCH_SIZE", 512))
+TRACING_FLUSH_INTERVAL = float(os.getenv("TRACING_FLUSH_INTERVAL", 5))
+TRACING_QUEUE_SIZE = int(os.getenv("TRACING_QUEUE_SIZE", 10000))
+
+# Значения SpanKind из OTLP
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT, KIND_PRODUCER, KIND_CONSUMER = 1, 2, 3, 4, 5
+STATUS_OK, STATUS_ERROR = 1, 2
+
+MAX_STATEMENT_LENGTH = 1000
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str = ""
+    kind: int = KIND_INTERNAL
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: int = 0
+    attributes: dict = field(default_factory=dict)
+    status: int = 0
+    status_message: str = ""
+
+    def set_error(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[tuple[str, str]]:
+    """(trace_id, span_id) из заголовка W3C traceparent или None."""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+def start_span(name: str, kind: int = KIND_INTERNAL, parent: Optional[tuple[str, str]] = None, **attributes) -> Span:
+    """Создает спан, не делая его текущим; родитель — текущий спан или явно переданный traceparent."""
+    if parent is None:
+        current = _current_span.get()
+        parent = (current.trace_id, current.span_id) if current else None
+    trace_id, parent_id = parent if parent else (_new_id(128), "")
+    return Span(name=name, trace_id=trace_id, span_id=_new_id(64), parent_id=parent_id, kind=kind, attributes=attributes)
+
+
+def end_span(span: Span):
+    span.end_ns = time.time_ns()
+    if not span.status:
+        span.status = STATUS_OK
+    exporter.export(span)
+
+
+@contextmanager
+def span(name: str, kind: int = KIND_INTERNAL, parent: Optional[tuple[str, str]] = None, **attributes):
+    """Спан вокруг блока кода; вложенные спаны и задачи asyncio наследуют его через contextvars."""
+    if not TRACING_ENABLED:
+        yield None
+        return
+
+    current = start_span(name, kind, parent, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        end_span(current)
+
+
+def traced(name: Optional[str] = None):
+    """Декоратор: оборачивает функцию (обычную или async) в спан. Без TRACING_ENABLED ничего не меняет."""
+    def decorator(func):
+        if not TRACING_ENABLED:
+            return func
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def otlp_payload(spans: list[Span]) -> bytes:
+    """Пакет спанов в формате OTLP/JSON (ExportTraceServiceRequest)."""
+    return orjson.dumps({
+        "resourceSpans": [{
+            "resource": {"attributes": [
+                _attribute("service.name", TRACING_SERVICE_NAME),
+                _attribute("process.pid", os.getpid()),
+            ]},
+            "scopeSpans": [{
+                "scope": {"name": __name__},
+                "spans": [
+                    {
+                        "traceId": s.trace_id,
+                        "spanId": s.span_id,
+                        "parentSpanId": s.parent_id,
+                        "name": s.name,
+                        "kind": s.kind,
+                        "startTimeUnixNano": str(s.start_ns),
+                        "endTimeUnixNano": str(s.end_ns),
+                        "attributes": [_attribute(k, v) for k, v in s.attributes.items() if v is not None],
+                        "status": {"code": s.status, "message": s.status_message},
+                    }
+                    for s in spans
+                ],
+            }],
+        }],
+    })
+
+
+class SpanExporter:
+    """
+    Экспорт спанов в фоновом потоке: запрос только кладет спан в очередь.
+
+    Поток создается лениво и заново после fork (воркеры Celery). При переполнении
+    очереди спаны отбрасываются, а не тормозят обработку запросов.
+    """
+
+    def __init__(self, path: str, endpoint: str, batch_size: int, flush_interval: float, queue_size: int):
+        self.path = path
+        self.endpoint = endpoint.rstrip("/")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def export(self, span: Span):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        spans_queue = self._queue
+        batch: list[Span] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = spans_queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                item = None
+
+            if item is not None and item is not _SHUTDOWN:
+                batch.append(item)
+            if batch and (item is None or item is _SHUTDOWN or len(batch) >= self.batch_size):
+                self._write(batch)
+                batch = []
+            if item is None:
+                deadline = time.monotonic() + self.flush_interval
+            if item is _SHUTDOWN:
+                return
+
+    def _write(self, batch: list[Span]):
+        payload = otlp_payload(batch)
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write(payload + b"\n")
+        except OSError as e:
+            logger.error(f"Не удалось записать спаны в {self.path}: {e}")
+
+        if self.endpoint:
+            try:
+                httpx.post(
+                    f"{self.endpoint}/v1/traces",
+                    content=payload,
+                    headers={"Content-Type": "application/json"},
+                    timeout=5,
+                )
+            except httpx.HTTPError as e:
+                logger.warning(f"Коллектор трасс недоступен: {e}")
+
+    def shutdown(self, timeout: float = 5):
+        """Дописывает накопленные спаны; вызывается при остановке приложения или воркера."""
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        self._queue.put(_SHUTDOWN)
+        self._thread.join(timeout)
+        if self.dropped:
+            logger.warning(f"Отброшено спанов из-за переполнения очереди: {self.dropped}")
+
+
+_SHUTDOWN = object()
+
+exporter = SpanExporter(TRACING_FILE, TRACING_OTLP_ENDPOINT, TRACING_BATCH_SIZE, TRACING_FLUSH_INTERVAL, TRACING_QUEUE_SIZE)
+
+
+class TracingMiddleware:
+    """Серверный спан на каждый HTTP-запрос; входящий traceparent продолжает внешнюю трассу."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                traceparent = parse_traceparent(value.decode())
+                break
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                server_span.attributes["http.response.status_code"] = message["status"]
+                if message["status"] >= 500:
+                    server_span.status = STATUS_ERROR
+            await send(message)
+
+        with span(
+            f"{scope['method']} {scope['path']}",
+            KIND_SERVER,
+            parent=traceparent,
+            **{"http.request.method": scope["method"], "url.path": scope["path"]},
+        ) as server_span:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    # Имя по шаблону маршрута, чтобы спаны одного обработчика группировались
+                    server_span.name = f"{scope['method']} {route}"
+                    server_span.attributes["http.route"] = route
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_span.get() is None:
+        return
+    db_span = start_span(
+        f"db {statement.split(None, 1)[0].upper() if statement else 'QUERY'}",
+        KIND_CLIENT,
+        **{"db.system": conn.dialect.name, "db.statement": statement[:MAX_STATEMENT_LENGTH]},
+    )
+    conn.info.setdefault("trace_spans", []).append(db_span)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get("trace_spans")
+    if spans:
+        end_span(spans.pop())
+
+
+def _handle_db_error(exception_context):
+    spans = exception_context.connection.info.get("trace_spans") if exception_context.connection else None
+    if spans:
+        db_span = spans.pop()
+        db_span.set_error(exception_context.original_exception)
+        end_span(db_span)
+
+
+def _instrument_httpx():
+    handle_async_request = httpx.AsyncHTTPTransport.handle_async_request
+
+    # Спан вокруг транспорта, а не пара хуков request/response: при таймауте или ошибке соединения
+    # хук ответа не вызывается, а такие вызовы трассировке важнее всего
+    @functools.wraps(handle_async_request)
+    async def traced_handle_async_request(self, request):
+        if _current_span.get() is None:
+            return await handle_async_request(self, request)
+        with span(
+            f"{request.method} {request.url.host}",
+            KIND_CLIENT,
+            **{"http.request.method": request.method, "server.address": request.url.host, "url.path": request.url.path},
+        ) as client_span:
+            response = await handle_async_request(self, request)
+            client_span.attributes["http.response.status_code"] = response.status_code
+            if response.status_code >= 400:
+                client_span.status = STATUS_ERROR
+            return response
+
+    httpx.AsyncHTTPTransport.handle_async_request = traced_handle_async_request
+
+
+def _instrument_redis():
+    from redis.asyncio.client import Pipeline, Redis
+
+    execute_command = Redis.execute_command
+    execute_pipeline = Pipeline.execute
+
+    @functools.wraps(execute_command)
+    async def traced_execute_command(self, *args, **options):
+        if _current_span.get() is None:
+            return await execute_command(self, *args, **options)
+        command = str(args[0]) if args else "UNKNOWN"
+        with span(f"redis {command}", KIND_CLIENT, **{"db.system": "redis", "db.operation": command}):
+            return await execute_command(self, *args, **options)
+
+    @functools.wraps(execute_pipeline)
+    async def traced_execute_pipeline(self, *args, **kwargs):
+        if _current_span.get() is None:
+            return await execute_pipeline(self, *args, **kwargs)
+        with span("redis PIPELINE", KIND_CLIENT, **{"db.system": "redis", "db.redis.commands": len(self.command_stack)}):
+            return await execute_pipeline(self, *args, **kwargs)
+
+    Redis.execute_command = traced_execute_command
+    Pipeline.execute = traced_execute_pipeline
+
+
+_celery_spans: dict[str, tuple[Span, object]] = {}
+
+
+def _before_task_publish(sender=None, headers=None, **kwargs):
+    current = _current_span.get()
+    if current is not None and headers is not None:
+        headers["traceparent"] = current.traceparent
+
+
+def _task_prerun(task_id=None, task=None, **kwargs):
+    parent = parse_traceparent(getattr(task.request, "traceparent", None))
+    task_span = start_span(f"celery {task.name}", KIND_CONSUMER, parent=parent, **{"celery.task_id": task_id})
+    _celery_spans[task_id] = (task_span, _current_span.set(task_span))
+
+
+def _task_postrun(task_id=None, state=None, **kwargs):
+    item = _celery_spans.pop(task_id, None)
+    if item is None:
+        return
+    task_span, token = item
+    task_span.attributes["celery.state"] = state
+    if state == "FAILURE":
+        task_span.status = STATUS_ERROR
+    _current_span.reset(token)
+    end_span(task_span)
+
+
+_installed = False
+
+
+def install_tracing(engines):
+    """Подключает спаны для httpx, SQLAlchemy, Redis и задач Celery (в API и в воркере)."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    from celery.signals import before_task_publish, task_postrun, task_prerun
+
+    _instrument_httpx()
+    for engine in engines:
+        event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine.sync_engine, "handle_error", _handle_db_error)
+    _instrument_redis()
+    before_task_publish.connect(_before_task_publish, weak=False)
+    task_prerun.connect(_task_prerun, weak=False)
+    task_postrun.connect(_task_postrun, weak=False)
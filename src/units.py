@@ -0,0 +1,143 @@
+import os
+import time
+import logging
+from datetime import date
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from src.clients import get_redis_client
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+UNITS_KEY = "direct_units:{login}"
+UNITS_SPENT_KEY = "direct_units_spent:{login}:{day}"
+UNITS_LOGINS_KEY = "direct_units_logins"
+
+# Запас баллов, который не расходуется запросами (остается для интерактивной работы)
+DIRECT_UNITS_RESERVE = int(os.getenv("DIRECT_UNITS_RESERVE", 100))
+# Остаток, ниже которого массовые операции (ночные обновления) откладываются
+DIRECT_UNITS_BULK_THRESHOLD = int(os.getenv("DIRECT_UNITS_BULK_THRESHOLD", 2000))
+
+# Оценка стоимости вызова с запасом: фиксированная цена метода плюс объекты в ответе
+DIRECT_METHOD_COST = {"get": 20, "add": 20, "update": 20, "delete": 10}
+# Запрос отчета учитываем как get: ответ сервиса Reports тоже несет заголовок Units
+DIRECT_REPORT_COST = int(os.getenv("DIRECT_REPORT_COST", DIRECT_METHOD_COST["get"]))
+
+
+def parse_units_header(value: Optional[str]) -> Optional[tuple[int, int, int]]:
+    """Разбирает заголовок Units вида "spent/remaining/limit"."""
+    if not value:
+        return None
+    try:
+        spent, remaining, limit = (int(part) for part in value.split("/"))
+    except ValueError:
+        logger.warning(f"Некорректный заголовок Units: {value}")
+        return None
+    return spent, remaining, limit
+
+
+async def record_units(login: Optional[str], headers) -> Optional[tuple[int, int, int]]:
+    """Сохраняет в Redis остаток баллов логина и учитывает израсходованные за день."""
+    units = parse_units_header(headers.get("Units"))
+    login = headers.get("Units-Used-Login") or login
+    if units is None or not login:
+        return units
+
+    spent, remaining, limit = units
+    redis_client = get_redis_client()
+    spent_key = UNITS_SPENT_KEY.format(login=login, day=date.today().isoformat())
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(UNITS_KEY.format(login=login), mapping={
+                "spent": spent,
+                "remaining": remaining,
+                "limit": limit,
+                "updated_at": time.time(),
+            })
+            pipe.incrby(spent_key, spent)
+            pipe.expire(spent_key, 2 * 86400)
+            pipe.sadd(UNITS_LOGINS_KEY, login)
+            await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить баллы для {login}: {e}")
+    return units
+
+
+async def get_units(login: str) -> Optional[dict]:
+    data = await get_redis_client().hgetall(UNITS_KEY.format(login=login))
+    if not data:
+        return None
+    units = {}
+    for key, value in data.items():
+        # Клиент Redis может быть создан как с decode_responses, так и без
+        key = key.decode() if isinstance(key, bytes) else key
+        value = value.decode() if isinstance(value, bytes) else str(value)
+        units[key] = float(value) if "." in value else int(value)
+    return units
+
+
+async def ensure_units(login: Optional[str], cost: int):
+    """Отклоняет запрос заранее, если он исчерпает известный остаток баллов логина."""
+    if not login:
+        return
+    try:
+        units = await get_units(login)
+    except Exception as e:
+        logger.warning(f"Не удалось получить баллы для {login}: {e}")
+        return
+
+    if units is not None and units["remaining"] - cost < DIRECT_UNITS_RESERVE:
+        logger.warning(f"Недостаточно баллов у {login}: осталось {units['remaining']}, нужно {cost}")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Недостаточно баллов API Яндекс.Директ для {login}: "
+                   f"осталось {units['remaining']} из {units['limit']}",
+        )
+
+
+async def split_by_units(logins: list[str], threshold: int = DIRECT_UNITS_BULK_THRESHOLD) -> tuple[list[str], list[str]]:
+    """
+    Упорядочивает логины для массовой работы по остатку баллов.
+
+    Возвращает (готовые — по убыванию остатка, отложенные — остаток ниже порога).
+    Логины без данных о баллах считаются готовыми.
+    """
+    remaining = {}
+    for login in logins:
+        try:
+            units = await get_units(login)
+        except Exception:
+            units = None
+        remaining[login] = units["remaining"] if units else None
+
+    ready = [login for login in logins if remaining[login] is None or remaining[login] >= threshold]
+    deferred = [login for login in logins if login not in ready]
+    ready.sort(key=lambda login: remaining[login] if remaining[login] is not None else float("inf"), reverse=True)
+    return ready, deferred
+
+
+async def get_units_metrics() -> list[dict]:
+    """Расход и остаток баллов по каждому логину для мониторинга."""
+    redis_client = get_redis_client()
+    logins = sorted(
+        login.decode() if isinstance(login, bytes) else login
+        for login in await redis_client.smembers(UNITS_LOGINS_KEY)
+    )
+    today = date.today().isoformat()
+
+    metrics = []
+    for login in logins:
+        units = await get_units(login) or {}
+        spent_today = await redis_client.get(UNITS_SPENT_KEY.format(login=login, day=today))
+        metrics.append({
+            "login": login,
+            "spent_today": int(spent_today or 0),
+            "remaining": units.get("remaining"),
+            "limit": units.get("limit"),
+            "updated_at": units.get("updated_at"),
+        })
+    return metrics
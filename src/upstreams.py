@@ -0,0 +1,199 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from src.clients import HTTP_TIMEOUT
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Бюджет времени на HTTP-запрос к API; все вызовы внешних API и БД внутри укладываются в него
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", 30))
+# Меньше этого остатка бюджета новый вызов внешнего API не начинается
+DEADLINE_MIN_BUDGET = float(os.getenv("DEADLINE_MIN_BUDGET", 0.5))
+UPSTREAM_RETRY_AFTER = int(os.getenv("UPSTREAM_RETRY_AFTER", 5))
+# Потоковые ответы (SSE, выгрузки, NDJSON по многим аккаунтам) длятся дольше бюджета по своей природе
+DEADLINE_EXCLUDED_PATHS = [r"^/yandex-reports-events/", r"^/export/", r"^/agency/accounts"]
+
+# Момент (time.monotonic), к которому должен завершиться текущий запрос; None — без ограничения
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+def remaining_budget() -> Optional[float]:
+    """Сколько секунд осталось у текущего запроса или None, если дедлайна нет (Celery, фон)."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+@contextmanager
+def local_deadline(seconds: float):
+    """
+    Бюджет времени на блок кода внутри запроса без общего дедлайна (потоковые маршруты):
+    вызовы внешних API в блоке ограничены так же, как в обычном запросе.
+    """
+    current = _deadline.get()
+    deadline = time.monotonic() + seconds
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def service_unavailable(detail: str, retry_after: int = UPSTREAM_RETRY_AFTER) -> HTTPException:
+    return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(max(int(retry_after), 1))})
+
+
+def check_budget(needed: float = DEADLINE_MIN_BUDGET, retry_after: int = UPSTREAM_RETRY_AFTER):
+    """Отказывает сразу, если на следующий шаг запроса времени уже не хватит."""
+    budget = remaining_budget()
+    if budget is not None and budget < needed:
+        raise service_unavailable("Не хватает времени на обработку запроса", retry_after)
+
+
+def upstream_timeout(default: float = HTTP_TIMEOUT) -> float:
+    """Таймаут для httpx: не больше остатка бюджета запроса."""
+    budget = remaining_budget()
+    return default if budget is None else max(min(default, budget), 0.001)
+
+
+class UpstreamGate:
+    """
+    Ограничение параллельных вызовов одного внешнего API.
+
+    Ожидающих слота не больше max_queue: остальные сразу получают 503. Ожидание
+    слота ограничено остатком бюджета запроса, поэтому при деградации одного API
+    запросы к нему не копятся, а остальные маршруты продолжают работать.
+    Таймаут вызова, урезанный бюджетом (upstream_timeout), тоже превращается в 503.
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, retry_after: int = UPSTREAM_RETRY_AFTER):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._waiting = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        check_budget(retry_after=self.retry_after)
+        if self._semaphore.locked() and self._waiting >= self.max_queue:
+            self.rejected += 1
+            raise service_unavailable(f"{self.name}: слишком много запросов в очереди", self.retry_after)
+
+        self._waiting += 1
+        try:
+            acquired = await self._acquire(remaining_budget())
+        finally:
+            self._waiting -= 1
+        if not acquired:
+            self.rejected += 1
+            raise service_unavailable(f"{self.name}: не дождались свободного слота", self.retry_after)
+
+        try:
+            yield
+        except httpx.TimeoutException as e:
+            budget = remaining_budget()
+            if budget is not None and budget < DEADLINE_MIN_BUDGET:
+                self.rejected += 1
+                raise service_unavailable(f"{self.name}: не хватило времени на ответ", self.retry_after) from e
+            raise
+        finally:
+            self._semaphore.release()
+
+    async def _acquire(self, timeout: Optional[float]) -> bool:
+        """
+        Ждет слот не дольше timeout.
+
+        asyncio.wait_for до Python 3.12 может потерять уже полученный слот, если таймаут
+        или отмена совпадут с его выдачей; здесь полученный слот при отмене возвращается.
+        """
+        waiter = asyncio.ensure_future(self._semaphore.acquire())
+        try:
+            done, _ = await asyncio.wait({waiter}, timeout=timeout)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._semaphore.release()
+            else:
+                waiter.cancel()
+            raise
+        if not done:
+            # Ожидающий acquire сам передает слот следующему, если его успели выдать
+            waiter.cancel()
+            return False
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.concurrency - self._semaphore._value,
+            "waiting": self._waiting,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+        }
+
+
+def _gate(name: str, concurrency: int, max_queue: int) -> UpstreamGate:
+    prefix = f"UPSTREAM_{name.upper()}"
+    return UpstreamGate(
+        name,
+        concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", concurrency)),
+        max_queue=int(os.getenv(f"{prefix}_QUEUE", max_queue)),
+    )
+
+
+direct_gate = _gate("direct", concurrency=20, max_queue=50)
+metrica_gate = _gate("metrica", concurrency=int(os.getenv("METRICA_MAX_CONCURRENCY", 4)), max_queue=50)
+oauth_gate = _gate("oauth", concurrency=5, max_queue=20)
+# Logs API: долгие скачивания частей выгрузки не занимают слоты интерактивных запросов к Метрике
+metrica_logs_gate = _gate("metrica_logs", concurrency=2, max_queue=20)
+
+UPSTREAM_GATES = {gate.name: gate for gate in (direct_gate, metrica_gate, oauth_gate, metrica_logs_gate)}
+
+
+class DeadlineMiddleware:
+    """
+    Задает бюджет времени каждому HTTP-запросу.
+
+    После отправки ответа дедлайн снимается, чтобы фоновые задачи запроса
+    (BackgroundTasks выполняются в том же контексте) не обрывались.
+    Потоковые маршруты (excluded_paths) выполняются без дедлайна: задачи,
+    которые они запускают, копируют контекст до отправки первых байт.
+    """
+
+    def __init__(self, app, deadline: float = REQUEST_DEADLINE, excluded_paths: list[str] = DEADLINE_EXCLUDED_PATHS):
+        self.app = app
+        self.deadline = deadline
+        self.excluded_paths = [re.compile(pattern) for pattern in excluded_paths]
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or self.deadline <= 0
+            or any(pattern.search(scope["path"]) for pattern in self.excluded_paths)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                _deadline.set(None)
+
+        token = _deadline.set(time.monotonic() + self.deadline)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _deadline.reset(token)
@@ -2,14 +2,26 @@ import httpx
 import logging
 from typing import Optional
 
+from src.clients import get_http_client
+from src.units import DIRECT_METHOD_COST, ensure_units, record_units
+from src.upstreams import direct_gate, upstream_timeout
+
 YANDEX_DIRECT_API_URL = "https://api.direct.yandex.ru/json/v5/"
+DIRECT_PAGE_LIMIT = 10000  # Максимум объектов на страницу в методах get
 
 logger = logging.getLogger(__name__)
 
 async def request_yandex_direct(
-    method: str, token: str, resource: str, params: Optional[dict] = None
+    method: str, token: str, resource: str, params: Optional[dict] = None, login: Optional[str] = None
 ) -> Optional[dict]:
-    """Отправляет запрос в Яндекс.Директ API с динамическим указанием ресурса."""
+    """
+    Отправляет запрос в Яндекс.Директ API с динамическим указанием ресурса.
+
+    Если передан login, запрос заранее отклоняется при нехватке баллов,
+    а остаток из заголовка Units сохраняется для этого логина.
+    """
+    await ensure_units(login, DIRECT_METHOD_COST.get(method, DIRECT_METHOD_COST["get"]))
+
     headers = {
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json",
@@ -24,28 +36,77 @@ async def request_yandex_direct(
     }
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data, headers=headers)
+        async with direct_gate.slot():
+            response = await get_http_client().post(url, json=data, headers=headers, timeout=upstream_timeout())
+        await record_units(login, response.headers)
 
-            logger.info(f"Запрос в Яндекс.Директ: {url}, статус: {response.status_code}")
-            logger.debug(f"Заголовки ответа: {response.headers}")
+        logger.info(f"Запрос в Яндекс.Директ: {url}, статус: {response.status_code}")
+        logger.debug(f"Заголовки ответа: {response.headers}")
 
-            if response.status_code != 200:
-                logger.error(f"Ошибка в запросе к Yandex Direct: {response.status_code} - {response.text}")
-                return None
+        if response.status_code != 200:
+            logger.error(f"Ошибка в запросе к Yandex Direct: {response.status_code} - {response.text}")
+            return None
 
-            if not response.text.strip():
-                logger.error("Пустой ответ от Yandex Direct")
-                return None
+        if not response.text.strip():
+            logger.error("Пустой ответ от Yandex Direct")
+            return None
 
-            try:
-                json_response = response.json()
-                logger.debug(f"Ответ от Яндекс.Директ: {json_response}")
-                return json_response
-            except Exception as e:
-                logger.error(f"Ошибка парсинга JSON: {e}, ответ: {response.text}")
-                return None
+        try:
+            json_response = response.json()
+            logger.debug(f"Ответ от Яндекс.Директ: {json_response}")
+            return json_response
+        except Exception as e:
+            logger.error(f"Ошибка парсинга JSON: {e}, ответ: {response.text}")
+            return None
 
     except httpx.RequestError as e:
         logger.error(f"Ошибка сети при обращении к Yandex Direct API: {e}")
         return None
+
+
+async def request_yandex_direct_all_pages(
+    method: str,
+    token: str,
+    resource: str,
+    params: Optional[dict] = None,
+    login: Optional[str] = None,
+    page_limit: int = DIRECT_PAGE_LIMIT,
+) -> Optional[dict]:
+    """
+    Запрос к Яндекс.Директ с проходом по всем страницам.
+
+    Пока в ответе есть LimitedBy, запрашивается следующая страница (Page.Offset = LimitedBy),
+    списки объектов всех страниц склеиваются в один ответ.
+
+    Ошибка на первой странице возвращается как есть. Ошибка на следующих возвращается
+    вместе с уже полученными объектами и флагом partial: такой ответ не кэшируется как полный.
+    """
+    params = dict(params or {})
+    merged = None
+    offset = 0
+
+    while True:
+        params["Page"] = {"Limit": page_limit, "Offset": offset}
+        response = await request_yandex_direct(method, token, resource, params, login=login)
+        if response is None or "result" not in response:
+            if merged is None:
+                return response
+            error = response.get("error") if response else None
+            return {
+                "error": error or {"error_string": "Нет ответа от Яндекс.Директ"},
+                "result": merged["result"],
+                "partial": True,
+            }
+
+        result = response["result"]
+        limited_by = result.pop("LimitedBy", None)
+        if merged is None:
+            merged = response
+        else:
+            for key, value in result.items():
+                if isinstance(value, list):
+                    merged["result"].setdefault(key, []).extend(value)
+
+        if limited_by is None:
+            return merged
+        offset = limited_by
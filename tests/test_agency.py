@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace
+
+import orjson
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.Agency import router as agency
+from src.ReportsDirect import tasks
+from src.upstreams import check_budget
+
+
+@pytest.fixture
+def accounts(fake_redis, monkeypatch):
+    """Аккаунт 1 отвечает медленно, у 2 нет баллов, у 3 готов отчет в кеше, 4 не авторизован."""
+    state = {"refreshes": []}
+
+    async def fake_get_user_credentials(user_id):
+        if user_id == 4:
+            return None
+        return SimpleNamespace(id=user_id, login=f"login{user_id}", access_token="token")
+
+    async def fake_split_by_units(logins):
+        return ([], logins) if logins == ["login2"] else (logins, [])
+
+    async def fake_get_campaigns(user, field_names=None):
+        await asyncio.sleep(0.2 if user.id == 1 else 0)
+        return {"result": {"Campaigns": [{"Id": user.id}]}}
+
+    async def fake_get_report_response_data(redis_client, user_id):
+        return (b'[{"CampaignId":"3"}]', {}) if user_id == 3 else None
+
+    monkeypatch.setattr(agency, "get_user_credentials", fake_get_user_credentials)
+    monkeypatch.setattr(agency, "split_by_units", fake_split_by_units)
+    monkeypatch.setattr(agency, "get_campaigns", fake_get_campaigns)
+    monkeypatch.setattr(agency, "get_report_response_data", fake_get_report_response_data)
+    monkeypatch.setattr(tasks.refresh_user_report, "delay", state["refreshes"].append)
+
+    app = FastAPI()
+    app.include_router(agency.router)
+    return TestClient(app), state
+
+
+def _lines(response) -> list[dict]:
+    return [orjson.loads(line) for line in response.content.splitlines()]
+
+
+def test_accounts_are_streamed_as_they_complete(accounts):
+    client, _ = accounts
+
+    lines = _lines(client.post("/agency/accounts", json={"user_ids": [1, 2, 3, 4, 3]}))
+
+    by_user = {line["user_id"]: line for line in lines}
+    # Дубликаты убраны, медленный аккаунт приходит последним
+    assert len(lines) == 4
+    assert lines[-1]["user_id"] == 1
+    assert by_user[1]["campaigns"] == {"result": {"Campaigns": [{"Id": 1}]}}
+    assert "campaigns" not in by_user[2] and by_user[2]["error"]
+    assert by_user[4]["error"] == "Пользователь не авторизован в Яндексе"
+
+
+def test_reports_come_from_cache_or_are_queued_once(accounts):
+    client, state = accounts
+    body = {"user_ids": [1, 3], "campaigns": False, "reports": True}
+
+    first = {line["user_id"]: line for line in _lines(client.post("/agency/accounts", json=body))}
+    client.post("/agency/accounts", json=body)
+
+    assert first[3]["report"] == [{"CampaignId": "3"}]
+    assert first[1]["report_status"] == "pending"
+    # Повторный запрос не ставит обновление в очередь еще раз
+    assert state["refreshes"] == [1]
+
+
+def test_each_account_has_its_own_deadline(accounts, monkeypatch):
+    client, _ = accounts
+
+    async def slow_get_campaigns(user, field_names=None):
+        await asyncio.sleep(0.2 if user.id == 1 else 0)
+        check_budget()
+        return {"result": {"Campaigns": []}}
+
+    monkeypatch.setattr(agency, "get_campaigns", slow_get_campaigns)
+    monkeypatch.setattr(agency, "AGENCY_ACCOUNT_DEADLINE", 0.6)
+
+    by_user = {line["user_id"]: line for line in _lines(client.post("/agency/accounts", json={"user_ids": [1, 3]}))}
+
+    assert by_user[1]["status_code"] == 503
+    assert by_user[3]["campaigns"] == {"result": {"Campaigns": []}}
@@ -0,0 +1,118 @@
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+
+from src import cache
+from src.cache import LocalLRUCache, TwoTierCache, make_cache_key, normalize_query, range_tags, ttl_for_range
+
+
+def test_normalize_query_ignores_order_and_spacing():
+    a = {"ids": 1, "metrics": "ym:s:visits, ym:s:users", "filters": None, "goals": [3, 1]}
+    b = {"goals": [1, 3], "metrics": "ym:s:visits,ym:s:users", "ids": "1"}
+    assert normalize_query(a) == normalize_query(b)
+    assert make_cache_key("metrica", a) == make_cache_key("metrica", b)
+    assert make_cache_key("metrica", a) != make_cache_key("direct", a)
+
+
+def test_ttl_for_range(monkeypatch):
+    monkeypatch.setattr(cache, "METRICA_CACHE_SETTLE_DAYS", 1)
+    monkeypatch.setattr(cache, "METRICA_CACHE_TTL_CURRENT", 300)
+    monkeypatch.setattr(cache, "METRICA_CACHE_TTL_HISTORIC", 86400)
+    today = date.today()
+
+    assert ttl_for_range(today) == 300
+    # Вчерашний день Метрика еще может досчитать
+    assert ttl_for_range(today - timedelta(days=1)) == 300
+    assert ttl_for_range(today - timedelta(days=2)) == 86400
+    assert ttl_for_range(str(today - timedelta(days=30))) == 86400
+
+    monkeypatch.setattr(cache, "METRICA_CACHE_TTL_HISTORIC", 0)
+    assert ttl_for_range(today - timedelta(days=30)) is None
+
+
+def test_range_tags_cover_every_month():
+    assert range_tags("2024-11-15", date(2025, 1, 3)) == ["month:2024-11", "month:2024-12", "month:2025-01"]
+
+
+def test_lru_evicts_least_recently_used_by_count():
+    lru = LocalLRUCache(max_items=2, max_bytes=1024)
+    lru.set("a", b"1", None)
+    lru.set("b", b"2", None)
+    assert lru.get("a") == b"1"
+    lru.set("c", b"3", None)
+
+    assert lru.get("b") is None
+    assert lru.get("a") == b"1"
+    assert lru.get("c") == b"3"
+    assert lru.evictions == 1
+
+
+def test_lru_evicts_by_size_and_skips_oversized_values():
+    lru = LocalLRUCache(max_items=10, max_bytes=10)
+    lru.set("a", b"x" * 4, None)
+    lru.set("b", b"x" * 4, None)
+    lru.set("c", b"x" * 4, None)
+    assert lru.get("a") is None
+    assert lru.total_bytes == 8
+
+    lru.set("big", b"x" * 11, None)
+    assert lru.get("big") is None
+    assert len(lru) == 2
+
+
+def test_lru_expires_items(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(cache.invalidation_bus, "connected", True)
+    lru = LocalLRUCache(max_items=10, max_bytes=1024)
+    lru.set("a", b"1", 5)
+
+    now[0] += 4
+    assert lru.get("a") == b"1"
+    now[0] += 2
+    assert lru.get("a") is None
+    assert lru.total_bytes == 0
+
+
+def test_two_tier_cache_fills_local_tier_from_redis(fake_redis):
+    first = TwoTierCache("test", LocalLRUCache(max_items=10, max_bytes=1024))
+    second = TwoTierCache("test", LocalLRUCache(max_items=10, max_bytes=1024))
+    key = first.key({"ids": 1})
+
+    async def run():
+        await first.set(key, {"rows": [1, 2.5, "a"]}, 60)
+        assert await second.get(key) == {"rows": [1, 2.5, "a"]}
+        assert await second.get(key) == {"rows": [1, 2.5, "a"]}
+        assert await second.get(second.key({"ids": 2})) is None
+        return await fake_redis().ttl(key)
+
+    assert 0 < asyncio.run(run()) <= 60
+    stats = second.stats()
+    assert (stats["redis_hits"], stats["local_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["local_items"] == 1
+
+
+def test_get_or_fetch_calls_upstream_once(fake_redis):
+    store = TwoTierCache("test", LocalLRUCache(max_items=10, max_bytes=1024))
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return [{"visits": 3}]
+
+    async def run():
+        params = {"ids": 1, "date1": "2024-01-01", "date2": "2024-01-31"}
+        first = await store.get_or_fetch(params, "2024-01-31", fetch)
+        second = await store.get_or_fetch(params, "2024-01-31", fetch)
+        return first, second
+
+    assert asyncio.run(run()) == ([{"visits": 3}], [{"visits": 3}])
+    assert len(calls) == 1
+
+
+def test_cache_rejects_values_that_would_not_round_trip(fake_redis):
+    store = TwoTierCache("test", LocalLRUCache(max_items=10, max_bytes=1024))
+
+    with pytest.raises(TypeError):
+        asyncio.run(store.set("test:key", {"date": date(2024, 1, 1)}, 60))
@@ -0,0 +1,91 @@
+import asyncio
+
+import redis.asyncio as redis
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src import cache, security
+from src.cache import PERSISTENT_TAG_MARKER, invalidate_tags, metrica_cache, tag_keys
+from src.ReportsMetrica import router as metrica_reports
+
+
+def test_invalidation_removes_tagged_keys_everywhere(fake_redis):
+    async def run():
+        await metrica_cache.set("metrica:a", {"v": 1}, 3600, tags=["counter:1", "month:2024-01"])
+        await metrica_cache.set("metrica:b", {"v": 2}, 3600, tags=["counter:1"])
+        await metrica_cache.set("metrica:c", {"v": 3}, 3600, tags=["counter:2"])
+        deleted = await invalidate_tags("counter:1", "month:2024-01")
+        redis_client = fake_redis()
+        return (
+            deleted,
+            await redis_client.exists("metrica:a", "metrica:b", "cache_tag:counter:1"),
+            await metrica_cache.get("metrica:a"),
+            await metrica_cache.get("metrica:c"),
+        )
+
+    deleted, remaining, local_a, kept = asyncio.run(run())
+
+    assert deleted == 2
+    assert remaining == 0
+    # Локальная копия сброшена вместе с Redis
+    assert local_a is None
+    assert kept == {"v": 3}
+
+
+def test_tag_ttl_is_only_ever_extended(fake_redis):
+    async def run():
+        redis_client = fake_redis()
+        await tag_keys(["metrica:a"], ["counter:1"], 1000)
+        await tag_keys(["metrica:b"], ["counter:1"], 10)
+        after_shorter = await redis_client.ttl("cache_tag:counter:1")
+        await tag_keys(["metrica:c"], ["counter:1"], 5000)
+        return after_shorter, await redis_client.ttl("cache_tag:counter:1")
+
+    after_shorter, after_longer = asyncio.run(run())
+
+    assert 990 < after_shorter <= 1000
+    assert 4990 < after_longer <= 5000
+
+
+def test_tag_with_a_persistent_key_never_expires(fake_redis):
+    async def run():
+        redis_client = fake_redis()
+        await redis_client.set("metrica:a", 1, ex=1000)
+        await redis_client.set("metrica:b", 2)
+        await tag_keys(["metrica:a"], ["counter:1"], 1000)
+        await tag_keys(["metrica:b"], ["counter:1"], None)
+        await tag_keys(["metrica:c"], ["counter:1"], 5000)
+        members = await redis_client.smembers("cache_tag:counter:1")
+        return await redis_client.ttl("cache_tag:counter:1"), members, await invalidate_tags("counter:1")
+
+    ttl, members, deleted = asyncio.run(run())
+
+    assert ttl == -1
+    assert PERSISTENT_TAG_MARKER.encode() in members
+    # Маркер — не ключ кэша: удалены только два существующих ключа
+    assert deleted == 2
+
+
+def test_redis_failure_is_reported_as_nothing_deleted(monkeypatch):
+    class BrokenRedis:
+        def pipeline(self, transaction=True):
+            raise redis.ConnectionError("down")
+
+    monkeypatch.setattr(cache, "get_redis_client", lambda: BrokenRedis())
+
+    assert asyncio.run(invalidate_tags("counter:1")) == 0
+    assert asyncio.run(invalidate_tags()) == 0
+
+
+def test_tag_endpoint_requires_the_admin_token(fake_redis, monkeypatch):
+    monkeypatch.setattr(security, "ADMIN_TOKEN", "secret")
+    app = FastAPI()
+    app.include_router(metrica_reports.router)
+    client = TestClient(app)
+
+    assert client.delete("/metrika_cache/tags", params={"tag": "counter:1"}).status_code == 403
+    assert client.delete(
+        "/metrika_cache/tags", params={"tag": "counter:1"}, headers={"X-Admin-Token": "wrong"}
+    ).status_code == 403
+    response = client.delete("/metrika_cache/tags", params={"tag": "counter:1"}, headers={"X-Admin-Token": "secret"})
+    assert response.json() == {"deleted_keys": 0}
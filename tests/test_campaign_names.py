@@ -0,0 +1,69 @@
+import asyncio
+
+import orjson
+import pytest
+
+from src.Campanies.service import join_campaign_names, store_campaign_names
+from src.ReportsDirect import router as reports
+from src.ReportsDirect.router import get_cache_metadata, get_report_response_data, names_are_current, update_cache
+
+ROWS = [{"CampaignId": "5", "Date": "2024-06-01", "Clicks": "3"}, {"CampaignId": "6", "Date": "2024-06-01", "Clicks": "1"}]
+
+
+@pytest.fixture
+def redis_client(fake_redis, monkeypatch):
+    async def fake_store_report_rows_async(user_id, rows, date1, date2):
+        pass
+
+    # Архив закрытых дней проверяется отдельно
+    monkeypatch.setattr(reports, "store_report_rows_async", fake_store_report_rows_async)
+    return fake_redis()
+
+
+def test_join_does_not_mutate_rows(fake_redis):
+    async def run():
+        await store_campaign_names(1, [{"Id": 5, "Name": "Поиск"}])
+        return await join_campaign_names(1, ROWS)
+
+    joined = asyncio.run(run())
+
+    assert [row["CampaignName"] for row in joined] == ["Поиск", ""]
+    assert all("CampaignName" not in row for row in ROWS)
+
+
+def test_report_is_remerged_once_after_names_change(redis_client):
+    async def run():
+        await store_campaign_names(1, [{"Id": 5, "Name": "Старое"}])
+        payload, metadata = await update_cache(redis_client, 1, ROWS)
+        current_before = await names_are_current(1, metadata)
+
+        await store_campaign_names(1, [{"Id": 5, "Name": "Новое"}])
+        current_after_rename = await names_are_current(1, metadata)
+        remerged, remerged_metadata = await get_report_response_data(redis_client, 1)
+        stored_metadata = await get_cache_metadata(redis_client, 1)
+        return payload, metadata, current_before, current_after_rename, remerged, remerged_metadata, stored_metadata
+
+    payload, metadata, current_before, current_after_rename, remerged, remerged_metadata, stored = asyncio.run(run())
+
+    assert orjson.loads(payload)[0]["CampaignName"] == "Старое"
+    assert current_before and not current_after_rename
+    assert orjson.loads(remerged)[0]["CampaignName"] == "Новое"
+    # Новый ETag сохранен вместе с отчетом: следующий запрос отдаст байты без пересборки
+    assert remerged_metadata["etag"] != metadata["etag"]
+    assert stored["etag"] == remerged_metadata["etag"]
+    assert stored["last_updated"] == metadata["last_updated"]
+
+
+def test_remerge_does_not_overwrite_a_newer_report(redis_client):
+    async def run():
+        await store_campaign_names(1, [{"Id": 5, "Name": "Старое"}])
+        _, metadata = await update_cache(redis_client, 1, ROWS)
+        await store_campaign_names(1, [{"Id": 5, "Name": "Новое"}])
+        # Отчет перезаписан между чтением и подстановкой названий
+        newer = await update_cache(redis_client, 1, ROWS[:1])
+        await reports.remerge_campaign_names(redis_client, 1, metadata, orjson.dumps(ROWS))
+        return newer, await redis_client.get("yandex_report_1")
+
+    (newer_payload, _), stored = asyncio.run(run())
+
+    assert stored == newer_payload
@@ -0,0 +1,106 @@
+from datetime import datetime
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+from src.database import get_db
+from src.goals import router as goals
+from src.ReportsDirect.router import report_validators
+from src.responses import conditional_headers, conditional_json_response, is_not_modified, make_etag
+
+LAST_MODIFIED = datetime(2024, 6, 1, 12, 30, 15, 500000)
+
+
+def _request(**headers) -> Request:
+    return Request({
+        "type": "http",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def test_if_none_match_accepts_lists_weak_tags_and_wildcard():
+    etag = make_etag(b"{}")
+
+    assert is_not_modified(_request(if_none_match=f'"other", W/{etag}'), etag)
+    assert is_not_modified(_request(if_none_match="*"), etag)
+    assert not is_not_modified(_request(if_none_match='"other"'), etag)
+    assert not is_not_modified(_request(if_none_match=etag), None)
+
+
+def test_if_none_match_takes_priority_over_if_modified_since():
+    request = _request(if_none_match='"other"', if_modified_since="Sat, 01 Jun 2024 12:30:15 GMT")
+
+    assert not is_not_modified(request, make_etag(b"{}"), LAST_MODIFIED)
+
+
+def test_if_modified_since_compares_with_second_precision():
+    header = conditional_headers(None, LAST_MODIFIED)["Last-Modified"]
+
+    assert header == "Sat, 01 Jun 2024 12:30:15 GMT"
+    assert is_not_modified(_request(if_modified_since=header), None, LAST_MODIFIED)
+    assert not is_not_modified(_request(if_modified_since="Sat, 01 Jun 2024 12:30:14 GMT"), None, LAST_MODIFIED)
+    assert not is_not_modified(_request(if_modified_since="not a date"), None, LAST_MODIFIED)
+
+
+def test_conditional_json_response_skips_the_body_on_match():
+    first = conditional_json_response(_request(), {"a": 1})
+    second = conditional_json_response(_request(if_none_match=first.headers["etag"]), {"a": 1})
+
+    assert first.status_code == 200 and first.body == b'{"a":1}'
+    assert second.status_code == 304 and second.body == b""
+
+
+def test_report_validators_fall_back_to_last_updated():
+    assert report_validators({"etag": '"x"', "last_modified": "2024-06-01T10:00:00"}) == ('"x"', datetime(2024, 6, 1, 10))
+    assert report_validators({"last_updated": "2024-06-01T09:00:00"}) == (None, datetime(2024, 6, 1, 9))
+
+
+@pytest.fixture
+def goal_stats(fake_redis, monkeypatch):
+    """Обработчик /statistics без Метрики и БД: считает обращения к источнику и записи."""
+    calls = {"fetch": 0, "save": 0}
+
+    async def fake_get_goals(counter_id):
+        return {1: "Заявка"}
+
+    async def fake_fetch(params, headers, date1, date2, tags=()):
+        calls["fetch"] += 1
+        return [{"dimensions": [{"name": "2024-01-01"}], "metrics": [3, 50.0, 6]}]
+
+    async def fake_save(session, result, group_by):
+        calls["save"] += 1
+        return 0
+
+    monkeypatch.setattr(goals, "get_goals", fake_get_goals)
+    monkeypatch.setattr(goals, "fetch_stat_rows_windowed", fake_fetch)
+    monkeypatch.setattr(goals, "save_goal_stats_final", fake_save)
+
+    app = FastAPI()
+    app.include_router(goals.router)
+    app.dependency_overrides[get_db] = lambda: None
+    return TestClient(app), calls
+
+
+def test_goal_statistics_answer_304_before_fetching(goal_stats):
+    client, calls = goal_stats
+    url = "/yandex_metrika_goals/statistics?date1=2024-01-01&date2=2024-01-01"
+
+    first = client.get(url)
+    assert first.status_code == 200
+    assert calls == {"fetch": 1, "save": 1}
+
+    revalidated = client.get(url, headers={"If-None-Match": first.headers["etag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["last-modified"] == first.headers["last-modified"]
+    # Валидатор из кэша: ни Метрика, ни БД не затронуты
+    assert calls == {"fetch": 1, "save": 1}
+
+    stale = client.get(url, headers={"If-None-Match": '"stale"'})
+    assert stale.status_code == 200 and stale.content == first.content
+    assert calls == {"fetch": 2, "save": 2}
+    # Данные не изменились — валидаторы прежние
+    assert stale.headers["etag"] == first.headers["etag"]
+    assert stale.headers["last-modified"] == first.headers["last-modified"]
+
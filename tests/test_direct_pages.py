@@ -0,0 +1,90 @@
+import asyncio
+import copy
+from types import SimpleNamespace
+
+import pytest
+
+from src import utils
+from src.Campanies import service as campaigns
+from src.Campanies.service import get_campaigns
+from src.utils import request_yandex_direct_all_pages
+
+PAGES = {
+    0: {"result": {"Campaigns": [{"Id": 1, "Name": "A"}, {"Id": 2, "Name": "B"}], "LimitedBy": 2}},
+    2: {"result": {"Campaigns": [{"Id": 3, "Name": "C"}], "LimitedBy": 3}},
+    3: {"result": {"Campaigns": [{"Id": 4, "Name": "D"}]}},
+}
+
+
+@pytest.fixture
+def direct(monkeypatch):
+    """Директ, отдающий PAGES по Page.Offset; failing_offset отвечает ошибкой."""
+    state = {"offsets": [], "failing_offset": None}
+
+    async def fake_request_yandex_direct(method, token, resource, params, login=None):
+        offset = params["Page"]["Offset"]
+        state["offsets"].append(offset)
+        if offset == state["failing_offset"]:
+            return {"error": {"error_code": 152, "error_string": "Недостаточно баллов"}}
+        return copy.deepcopy(PAGES[offset])
+
+    monkeypatch.setattr(utils, "request_yandex_direct", fake_request_yandex_direct)
+    return state
+
+
+def test_pages_are_merged_until_limited_by_is_gone(direct):
+    response = asyncio.run(request_yandex_direct_all_pages("get", "token", "campaigns", {"FieldNames": ["Id"]}))
+
+    assert [c["Id"] for c in response["result"]["Campaigns"]] == [1, 2, 3, 4]
+    assert "LimitedBy" not in response["result"]
+    assert direct["offsets"] == [0, 2, 3]
+
+
+def test_first_page_error_is_returned_as_is(direct):
+    direct["failing_offset"] = 0
+
+    response = asyncio.run(request_yandex_direct_all_pages("get", "token", "campaigns"))
+
+    assert response == {"error": {"error_code": 152, "error_string": "Недостаточно баллов"}}
+
+
+def test_later_page_error_keeps_fetched_objects(direct):
+    direct["failing_offset"] = 3
+
+    response = asyncio.run(request_yandex_direct_all_pages("get", "token", "campaigns"))
+
+    assert response["partial"] is True
+    assert response["error"]["error_code"] == 152
+    assert [c["Id"] for c in response["result"]["Campaigns"]] == [1, 2, 3]
+
+
+def test_only_complete_responses_are_cached(direct, fake_redis):
+    user = SimpleNamespace(id=1, access_token="token", login="client")
+    direct["failing_offset"] = 3
+
+    async def run():
+        partial = await get_campaigns(user, ids=[1, 2, 3, 4])
+        direct["failing_offset"] = None
+        complete = await get_campaigns(user, ids=[1, 2, 3, 4])
+        cached = await get_campaigns(user, ids=[1, 2, 3, 4])
+        return partial, complete, cached
+
+    partial, complete, cached = asyncio.run(run())
+
+    assert partial["partial"] is True
+    assert cached == complete
+    # Частичный ответ не закэширован, полный запрошен один раз
+    assert direct["offsets"] == [0, 2, 3, 0, 2, 3]
+
+
+def test_full_campaign_list_updates_the_names_directory(direct, fake_redis):
+    user = SimpleNamespace(id=1, access_token="token", login="client")
+
+    async def run():
+        await get_campaigns(user, field_names=["Id", "Name"])
+        return await campaigns.get_campaign_names(1), await campaigns.get_campaign_names_meta(1)
+
+    names, metadata = asyncio.run(run())
+
+    assert names == {"1": "A", "2": "B", "3": "C", "4": "D"}
+    assert metadata["etag"]
@@ -0,0 +1,71 @@
+import asyncio
+import io
+from datetime import date
+
+import pyarrow.parquet as pq
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from src.Exports import router as exports
+from src.Exports.router import EXPORT_MODELS, arrow_schema, build_export_query, stream_csv, stream_parquet
+from src.goals.models import GoalStatFinal
+from src.ReportsMetrica.models import TrafficSourceData
+
+COLUMNS = ["id", "goal_id", "date", "period_type", "reaches", "conversion_rate", "visits"]
+PARTITIONS = [
+    [(1, 10, date(2024, 1, 1), "day", 3, 0.5, 6)],
+    [(2, 10, date(2024, 1, 2), "day", 0, 0.0, 4), (3, 11, date(2024, 1, 2), "day", 1, 1.0, 1)],
+]
+
+
+@pytest.fixture
+def partitions(monkeypatch):
+    """Подменяет серверный курсор двумя порциями строк."""
+
+    async def fake_stream_partitions(stmt):
+        for rows in PARTITIONS:
+            yield COLUMNS, rows
+
+    monkeypatch.setattr(exports, "stream_partitions", fake_stream_partitions)
+
+
+async def _collect(stream) -> list[bytes]:
+    return [chunk async for chunk in stream]
+
+
+def _sql(stmt) -> str:
+    return str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def test_query_filters_only_by_existing_columns():
+    sql = _sql(build_export_query(TrafficSourceData, date(2024, 1, 1), date(2024, 1, 31), goal_id=5, counter_id="42"))
+
+    assert "counter_id = '42'" in sql
+    assert "goal_id" not in sql
+    # У DateTime-колонки правая граница включает весь последний день
+    assert "'2024-01-31 23:59:59.999999'" in sql
+    assert build_export_query(GoalStatFinal, None, None, None, None).get_execution_options()["yield_per"] == exports.EXPORT_CHUNK_SIZE
+
+
+def test_arrow_schema_covers_every_model():
+    for model in EXPORT_MODELS.values():
+        assert arrow_schema(model).names == [column.name for column in model.__table__.columns]
+
+
+def test_csv_is_streamed_per_partition_with_a_single_header(partitions):
+    chunks = asyncio.run(_collect(stream_csv(None)))
+
+    assert len(chunks) == len(PARTITIONS)
+    lines = b"".join(chunks).decode().splitlines()
+    assert lines[0] == ",".join(COLUMNS)
+    assert lines[1:] == ["1,10,2024-01-01,day,3,0.5,6", "2,10,2024-01-02,day,0,0.0,4", "3,11,2024-01-02,day,1,1.0,1"]
+
+
+def test_parquet_round_trip_keeps_partitions_as_row_groups(partitions):
+    chunks = asyncio.run(_collect(stream_parquet(None, arrow_schema(GoalStatFinal))))
+
+    parquet = pq.ParquetFile(io.BytesIO(b"".join(chunks)))
+    assert parquet.metadata.num_row_groups == len(PARTITIONS)
+    table = parquet.read()
+    assert table.column("id").to_pylist() == [1, 2, 3]
+    assert table.column("date").to_pylist() == [date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 2)]
@@ -0,0 +1,108 @@
+import asyncio
+from datetime import date
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy.sql.dml import Insert
+
+from src.database import get_db
+from src.goals import router as goals
+from src.goals.router import build_goal_groups, parse_goal_fields, save_goal_stats_final
+
+
+def test_parse_goal_fields_returns_canonical_order():
+    assert parse_goal_fields(None) == ["reaches", "conversion_rate", "visits"]
+    assert parse_goal_fields(["visits,reaches"]) == ["reaches", "visits"]
+    assert parse_goal_fields(["visits", " reaches ", ""]) == ["reaches", "visits"]
+
+    with pytest.raises(HTTPException) as error:
+        parse_goal_fields(["reaches,clicks"])
+    assert error.value.status_code == 400
+
+
+def test_groups_contain_only_requested_fields():
+    rows = [{"dimensions": [{"name": "2024-01-01"}], "metrics": [3, 30, 1, 20]}]
+
+    result = build_goal_groups(rows, [1, 2], date(2024, 1, 1), date(2024, 1, 2), "day", ["reaches", "visits"])
+
+    assert result[0]["goals"] == [{"id": "1", "reaches": 3, "visits": 30}, {"id": "2", "reaches": 1, "visits": 20}]
+    assert result[1]["goals"][0] == {"id": "1", "reaches": 0, "visits": 0}
+
+
+class FakeGoalSession:
+    """Сессия с сохраненными строками goal_stats_final; запоминает выполненные upsert."""
+
+    def __init__(self, stored: list[tuple]):
+        self.stored = stored
+        self.upserts = []
+        self.commits = 0
+
+    async def execute(self, stmt):
+        if isinstance(stmt, Insert):
+            self.upserts.append(stmt.compile().params)
+            return None
+        return self.stored
+
+    async def commit(self):
+        self.commits += 1
+
+
+RESULT = [{"date": "2024-01-01", "goals": [
+    {"id": "1", "reaches": 3, "conversion_rate": 10.0, "visits": 30},
+    {"id": "2", "reaches": 1, "conversion_rate": 5.0, "visits": 20},
+]}]
+
+
+def test_only_missing_or_changed_rows_are_written():
+    session = FakeGoalSession([(1, date(2024, 1, 1), 3, 10.0, 30), (2, date(2024, 1, 1), 1, 4.0, 20)])
+
+    assert asyncio.run(save_goal_stats_final(session, RESULT, "day")) == 1
+    assert [(params["goal_id"], params["conversion_rate"]) for params in session.upserts] == [(2, 5.0)]
+
+    unchanged = FakeGoalSession([(1, date(2024, 1, 1), 3, 10.0, 30), (2, date(2024, 1, 1), 1, 5.0, 20)])
+    assert asyncio.run(save_goal_stats_final(unchanged, RESULT, "day")) == 0
+    assert unchanged.upserts == []
+
+
+@pytest.fixture
+def goal_stats(fake_redis, monkeypatch):
+    """Обработчик /statistics без Метрики и БД: запоминает запрошенные метрики и записи."""
+    calls = {"metrics": [], "saved": 0}
+
+    async def fake_get_goals(counter_id):
+        return {1: "Заявка"}
+
+    async def fake_fetch(params, headers, date1, date2, tags=()):
+        calls["metrics"].append(params["metrics"])
+        return [{"dimensions": [{"name": "2024-01-01"}], "metrics": list(range(1, params["metrics"].count(",") + 2))}]
+
+    async def fake_save(session, result, group_by):
+        calls["saved"] += 1
+        return 0
+
+    monkeypatch.setattr(goals, "get_goals", fake_get_goals)
+    monkeypatch.setattr(goals, "fetch_stat_rows_windowed", fake_fetch)
+    monkeypatch.setattr(goals, "save_goal_stats_final", fake_save)
+
+    app = FastAPI()
+    app.include_router(goals.router)
+    app.dependency_overrides[get_db] = lambda: None
+    return TestClient(app), calls
+
+
+def test_subset_of_fields_is_fetched_but_not_persisted(goal_stats):
+    client, calls = goal_stats
+    url = "/yandex_metrika_goals/statistics"
+    period = {"date1": "2024-01-01", "date2": "2024-01-01"}
+
+    subset = client.get(url, params={**period, "fields": "visits"})
+    full = client.get(url, params=period)
+
+    assert subset.json()["data"][0]["goals"] == [{"id": "1", "visits": 1}]
+    assert calls["metrics"] == ["ym:s:goal1visits", "ym:s:goal1reaches,ym:s:goal1conversionRate,ym:s:goal1visits"]
+    # Строка goal_stats_final пишется только по полному набору полей
+    assert calls["saved"] == 1
+    assert full.json()["data"][0]["goals"] == [{"id": "1", "reaches": 1, "conversion_rate": 2.0, "visits": 3}]
+    # Разные наборы полей — разные валидаторы
+    assert subset.headers["etag"] != full.headers["etag"]
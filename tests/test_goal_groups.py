@@ -0,0 +1,43 @@
+from datetime import date
+
+from src.goals.router import build_goal_groups, parse_date_from_group
+
+GOAL_IDS = [1, 2]
+# Метрики по целям, внутри цели — reaches, conversion_rate, visits
+ROWS = [
+    {"dimensions": [{"name": "2024-01-01"}], "metrics": [3, 10.0, 30, 1, 5.0, 20]},
+    {"dimensions": [{"name": "2024-01-02"}], "metrics": [2, 20.0, 10, 0, 0.0, 5]},
+]
+
+
+def test_days_without_rows_are_filled_with_zeros():
+    result = build_goal_groups(ROWS, GOAL_IDS, date(2024, 1, 1), date(2024, 1, 3), "day")
+
+    assert [group["label"] for group in result] == ["2024-01-01", "2024-01-02", "2024-01-03"]
+    assert result[0]["goals"] == [
+        {"id": "1", "reaches": 3, "conversion_rate": 10.0, "visits": 30},
+        {"id": "2", "reaches": 1, "conversion_rate": 5.0, "visits": 20},
+    ]
+    assert result[2]["goals"][0] == {"id": "1", "reaches": 0, "conversion_rate": 0.0, "visits": 0}
+
+
+def test_month_sums_counts_and_averages_conversion_over_days():
+    result = build_goal_groups(ROWS, GOAL_IDS, date(2024, 1, 1), date(2024, 1, 4), "month")
+
+    assert len(result) == 1
+    assert result[0]["date"] == "2024-01"
+    assert result[0]["label"] == "2024 - январь"
+    # conversion_rate усредняется по всем дням периода, включая пустые
+    assert result[0]["goals"][0] == {"id": "1", "reaches": 5, "conversion_rate": 7.5, "visits": 40}
+
+
+def test_weeks_are_labelled_with_their_bounds():
+    result = build_goal_groups(ROWS, GOAL_IDS, date(2024, 1, 1), date(2024, 1, 8), "week")
+
+    assert [group["label"] for group in result] == ["2024-01-01 — 2024-01-07", "2024-01-08 — 2024-01-14"]
+
+
+def test_parse_date_from_group():
+    assert parse_date_from_group("2024-01-02", "day") == date(2024, 1, 2)
+    assert parse_date_from_group("2024-03", "month") == date(2024, 3, 1)
+    assert parse_date_from_group("2024-W2", "week") == date(2024, 1, 8)
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from src import invalidation
+from src.cache import LocalLRUCache
+from src.invalidation import InvalidationBus
+
+
+def _cache(**items) -> LocalLRUCache:
+    cache = LocalLRUCache(max_items=100, max_bytes=10_000)
+    for key, value in items.items():
+        cache.set(key.replace("_", ":"), value.encode(), ttl=None)
+    return cache
+
+
+def test_apply_drops_keys_prefixes_or_everything():
+    bus = InvalidationBus()
+    cache = _cache(a_1="1", a_2="2", b_1="3")
+    bus.register("metrica", cache)
+
+    bus._apply("metrica", key="a:1")
+    assert cache.get("a:1") is None and cache.get("a:2") == b"2"
+
+    bus._apply("metrica", keys=["a:2", "b:1"])
+    assert len(cache) == 0
+
+    cache.set("a:3", b"4", ttl=None)
+    cache.set("c:1", b"5", ttl=None)
+    bus._apply("metrica", prefix="a:")
+    assert cache.get("a:3") is None and cache.get("c:1") == b"5"
+
+    bus._apply("unknown", key="c:1")
+    bus._apply("metrica")
+    assert len(cache) == 0
+
+
+def test_local_copies_expire_while_the_bus_is_disconnected(monkeypatch):
+    monkeypatch.setattr(invalidation.invalidation_bus, "staleness", 0)
+    cache = _cache(a_1="1")
+    time.sleep(0.01)
+
+    monkeypatch.setattr(invalidation.invalidation_bus, "connected", True)
+    assert invalidation.invalidation_bus.max_staleness() is None
+    assert cache.get("a:1") == b"1"
+
+    monkeypatch.setattr(invalidation.invalidation_bus, "connected", False)
+    assert cache.get("a:1") is None
+
+
+@pytest.fixture
+def bus_with_cache(fake_redis):
+    bus = InvalidationBus(channel="test_invalidation")
+    cache = _cache(a_1="1", a_2="2")
+    bus.register("metrica", cache)
+    return bus, cache, fake_redis
+
+
+def test_messages_from_other_processes_are_applied(bus_with_cache):
+    bus, cache, fake_redis = bus_with_cache
+
+    async def run():
+        cache.set("a:1", b"1", ttl=None)
+        bus.start()
+        await asyncio.sleep(0.05)
+        connected = bus.connected
+        # После подписки локальные копии сброшены: сообщения до нее могли быть пропущены
+        cleared = len(cache) == 0
+
+        cache.set("a:1", b"1", ttl=None)
+        cache.set("a:2", b"2", ttl=None)
+        redis_client = fake_redis()
+        await redis_client.publish("test_invalidation", "not json")
+        await redis_client.publish("test_invalidation", json.dumps({"cache": "metrica", "key": "a:2", "origin": bus.origin}))
+        await redis_client.publish("test_invalidation", json.dumps({"cache": "metrica", "key": "a:1", "origin": "other"}))
+        await asyncio.sleep(0.1)
+        result = connected, cleared, cache.get("a:1"), cache.get("a:2"), bus.stats()
+        await bus.stop()
+        return result
+
+    connected, cleared, a1, a2, stats = asyncio.run(run())
+
+    assert connected and cleared
+    assert a1 is None
+    # Собственные сообщения процесса уже применены при publish
+    assert a2 == b"2"
+    assert (stats["received"], stats["malformed"]) == (1, 1)
+    assert not bus.connected
+
+
+def test_publish_applies_locally_even_without_redis(monkeypatch):
+    class BrokenRedis:
+        async def publish(self, channel, message):
+            raise ConnectionError("down")
+
+    monkeypatch.setattr(invalidation, "get_redis_client", lambda: BrokenRedis())
+    bus = InvalidationBus()
+    cache = _cache(a_1="1")
+    bus.register("metrica", cache)
+
+    asyncio.run(bus.publish("metrica", key="a:1"))
+
+    assert cache.get("a:1") is None
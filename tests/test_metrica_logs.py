@@ -0,0 +1,139 @@
+import os
+import asyncio
+from datetime import date
+
+from src.MetricaLogs import service
+from src.MetricaLogs.client import LocalLogsClient
+from src.MetricaLogs.service import COPY_COLUMNS, _copy_value, goal_rows, iter_copy_chunks, month_partitions, traffic_source_rows
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data", "metrica_logs")
+COUNTER_ID = 181494
+
+
+async def _collect(chunks) -> str:
+    return b"".join([chunk async for chunk in chunks]).decode()
+
+
+def _copy_rows(date1: date, date2: date) -> list[dict]:
+    async def run():
+        client = LocalLogsClient(DATA_DIR)
+        request_id = await client.create(COUNTER_ID, date1, date2, [], "visits")
+        status = await client.status(COUNTER_ID, request_id)
+        assert status["status"] == "processed"
+        text = ""
+        for part in status["parts"]:
+            text += await _collect(iter_copy_chunks(client.download_part(COUNTER_ID, request_id, part["part_number"]), COUNTER_ID))
+        return text
+
+    text = asyncio.run(run())
+    return [dict(zip(COPY_COLUMNS, line.split("\t"))) for line in text.splitlines()]
+
+
+def test_copy_value():
+    assert _copy_value("goals_id", "[11,12]") == "{11,12}"
+    assert _copy_value("goals_id", "[]") == "{}"
+    assert _copy_value("client_id", "") == r"\N"
+    assert _copy_value("traffic_source", "") == ""
+    assert _copy_value("page_views", "3") == "3"
+
+
+def test_copy_rows_follow_header_and_period():
+    rows = _copy_rows(date(2024, 6, 1), date(2024, 6, 1))
+
+    assert [row["visit_id"] for row in rows] == ["1002", "1003"]
+    assert rows[0] == {
+        "counter_id": str(COUNTER_ID),
+        "visit_id": "1002",
+        "client_id": "17002",
+        "date": "2024-06-01",
+        "date_time": "2024-06-01 08:15:00",
+        "is_new_user": "0",
+        "page_views": "1",
+        "visit_duration": "0",
+        "bounce": "1",
+        "traffic_source": "ad",
+        "goals_id": "{}",
+    }
+    assert rows[1]["client_id"] == r"\N"
+    assert rows[1]["goals_id"] == "{12}"
+
+
+def test_copy_chunks_are_split_on_row_boundary(monkeypatch):
+    monkeypatch.setattr(service, "METRICA_LOGS_COPY_CHUNK_BYTES", 1)
+
+    async def run():
+        client = LocalLogsClient(DATA_DIR)
+        request_id = await client.create(COUNTER_ID, date(2024, 5, 1), date(2024, 6, 30), [], "visits")
+        return [chunk async for chunk in iter_copy_chunks(client.download_part(COUNTER_ID, request_id, 0), COUNTER_ID)]
+
+    chunks = asyncio.run(run())
+    assert len(chunks) == 4
+    assert all(chunk.endswith(b"\n") and chunk.count(b"\n") == 1 for chunk in chunks)
+    assert all(len(chunk.split(b"\t")) == len(COPY_COLUMNS) for chunk in chunks)
+
+
+def test_month_partitions():
+    assert month_partitions(date(2024, 5, 31), date(2024, 7, 1)) == [
+        ("metrica_visits_y2024m05", date(2024, 5, 1), date(2024, 6, 1)),
+        ("metrica_visits_y2024m06", date(2024, 6, 1), date(2024, 7, 1)),
+        ("metrica_visits_y2024m07", date(2024, 7, 1), date(2024, 8, 1)),
+    ]
+    assert month_partitions(date(2024, 12, 5), date(2025, 1, 2))[-1] == (
+        "metrica_visits_y2025m01", date(2025, 1, 1), date(2025, 2, 1)
+    )
+
+
+class _Result:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def mappings(self):
+        return self.rows
+
+
+class _Session:
+    def __init__(self, rows):
+        self.rows = rows
+        self.statements = []
+
+    async def execute(self, statement, params=None):
+        self.statements.append((str(statement), params))
+        return _Result(self.rows)
+
+
+def test_traffic_source_rows_match_stat_format():
+    session = _Session([
+        {"traffic_source": "organic", "date": date(2024, 6, 1), "visits": 10, "users": 8,
+         "bounce_rate": 20, "page_depth": 2.5, "avg_visit_duration": 61},
+        {"traffic_source": "unknown", "date": date(2024, 6, 1), "visits": 1, "users": 1,
+         "bounce_rate": None, "page_depth": None, "avg_visit_duration": None},
+    ])
+
+    rows = asyncio.run(traffic_source_rows(session, COUNTER_ID, date(2024, 6, 1), date(2024, 6, 1), by_date=True))
+
+    sql, params = session.statements[0]
+    assert "GROUP BY traffic_source, date" in sql
+    assert params == {"counter_id": COUNTER_ID, "date1": date(2024, 6, 1), "date2": date(2024, 6, 1)}
+    assert rows == [
+        {"dimensions": [{"name": "Переходы из поисковых систем"}, {"name": "2024-06-01"}],
+         "metrics": [10.0, 8.0, 20.0, 2.5, 61.0]},
+        {"dimensions": [{"name": "unknown"}, {"name": "2024-06-01"}],
+         "metrics": [1.0, 1.0, 0.0, 0.0, 0.0]},
+    ]
+
+
+def test_goal_rows_fill_missing_goals():
+    session = _Session([
+        {"date": date(2024, 6, 2), "goal_id": 11, "reaches": 1, "visits": 1, "conversion_rate": 100},
+        {"date": date(2024, 6, 1), "goal_id": 12, "reaches": 2, "visits": 1, "conversion_rate": 50},
+    ])
+
+    rows = asyncio.run(goal_rows(
+        session, COUNTER_ID, [11, 12], date(2024, 6, 1), date(2024, 6, 2), ["reaches", "conversion_rate"]
+    ))
+
+    assert session.statements[0][1]["goal_ids"] == [11, 12]
+    assert rows == [
+        {"dimensions": [{"name": "2024-06-01"}], "metrics": [0, 0.0, 2, 50.0]},
+        {"dimensions": [{"name": "2024-06-02"}], "metrics": [1, 100.0, 0, 0.0]},
+    ]
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src import metrica
+from src.metrica import iter_stat_pages
+
+TOTAL_ROWS = 7
+
+
+@pytest.fixture
+def pages(monkeypatch):
+    """Подмена stat/v1/data: TOTAL_ROWS строк, поздние страницы отвечают быстрее ранних."""
+    offsets = []
+
+    async def fake_fetch_stat_page(url, params, headers):
+        offset, limit = params["offset"], params["limit"]
+        offsets.append(offset)
+        await asyncio.sleep(0.01 * (TOTAL_ROWS + 1 - offset))
+        rows = [{"row": i} for i in range(offset, min(offset + limit, TOTAL_ROWS + 1))]
+        return {"data": rows, "total_rows": TOTAL_ROWS}
+
+    monkeypatch.setattr(metrica, "_fetch_stat_page", fake_fetch_stat_page)
+    return offsets
+
+
+async def _fetch_all(page_limit: int) -> list[dict]:
+    return [row async for page in iter_stat_pages({"ids": 1}, {}, page_limit=page_limit) for row in page]
+
+
+def test_pages_are_returned_in_offset_order(pages):
+    rows = asyncio.run(_fetch_all(page_limit=3))
+
+    assert [row["row"] for row in rows] == list(range(1, TOTAL_ROWS + 1))
+    # Первая страница запрашивается отдельно, остальные — разом после нее
+    assert pages[0] == 1
+    assert sorted(pages) == [1, 4, 7]
+
+
+def test_single_page_needs_no_extra_requests(pages):
+    rows = asyncio.run(_fetch_all(page_limit=100))
+
+    assert len(rows) == TOTAL_ROWS
+    assert pages == [1]
+
+
+def test_early_stop_cancels_remaining_pages(monkeypatch):
+    cancelled = []
+
+    async def fake_fetch_stat_page(url, params, headers):
+        offset = params["offset"]
+        if offset > 2:
+            # Дальние страницы так и не отвечают: их должна снять отмена
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.append(offset)
+                raise
+        return {"data": [{"row": offset}], "total_rows": TOTAL_ROWS}
+
+    monkeypatch.setattr(metrica, "_fetch_stat_page", fake_fetch_stat_page)
+
+    async def run():
+        generator = iter_stat_pages({"ids": 1}, {}, page_limit=1)
+        read = [await generator.__anext__(), await generator.__anext__()]
+        await generator.aclose()
+        return read
+
+    assert asyncio.run(asyncio.wait_for(run(), 5)) == [[{"row": 1}], [{"row": 2}]]
+    assert sorted(cancelled) == [3, 4, 5, 6, 7]
+
+
+def test_failed_page_is_raised(monkeypatch):
+    async def fake_fetch_stat_page(url, params, headers):
+        if params["offset"] > 1:
+            raise HTTPException(status_code=429, detail="limit")
+        return {"data": [{"row": 1}], "total_rows": 3}
+
+    monkeypatch.setattr(metrica, "_fetch_stat_page", fake_fetch_stat_page)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(_fetch_all(page_limit=1))
+    assert error.value.status_code == 429
@@ -0,0 +1,42 @@
+import asyncio
+from datetime import date
+
+from src import metrica
+from src.metrica import fetch_stat_rows_windowed, split_date_range
+
+
+def test_split_date_range():
+    assert split_date_range(date(2024, 1, 1), date(2024, 1, 10), window_days=4) == [
+        (date(2024, 1, 1), date(2024, 1, 4)),
+        (date(2024, 1, 5), date(2024, 1, 8)),
+        (date(2024, 1, 9), date(2024, 1, 10)),
+    ]
+    assert split_date_range(date(2024, 1, 1), date(2024, 1, 1), window_days=92) == [(date(2024, 1, 1), date(2024, 1, 1))]
+    assert split_date_range(date(2024, 1, 2), date(2024, 1, 1)) == []
+
+
+def test_windows_are_fetched_once_and_returned_in_order(fake_redis, monkeypatch):
+    requested = []
+
+    async def fake_fetch_stat_rows(params, headers, url):
+        requested.append((params["date1"], params["date2"]))
+        # Первое окно отвечает последним: порядок строк все равно по окнам
+        await asyncio.sleep(0.02 if params["date1"] == "2023-01-01" else 0)
+        return [{"dimensions": [{"name": params["date1"]}]}]
+
+    monkeypatch.setattr(metrica, "fetch_stat_rows", fake_fetch_stat_rows)
+    params = {"ids": 1, "metrics": "ym:s:visits"}
+
+    async def run():
+        first = await fetch_stat_rows_windowed(params, {}, date(2023, 1, 1), date(2023, 1, 10), window_days=5)
+        # Второй, более длинный период переиспользует уже закэшированные окна
+        second = await fetch_stat_rows_windowed(params, {}, date(2023, 1, 1), date(2023, 1, 15), window_days=5)
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert [row["dimensions"][0]["name"] for row in first] == ["2023-01-01", "2023-01-06"]
+    assert [row["dimensions"][0]["name"] for row in second] == ["2023-01-01", "2023-01-06", "2023-01-11"]
+    assert sorted(requested) == [
+        ("2023-01-01", "2023-01-05"), ("2023-01-06", "2023-01-10"), ("2023-01-11", "2023-01-15"),
+    ]
@@ -0,0 +1,61 @@
+import httpx
+import orjson
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src import profiling
+from src.profiling import ProfilingMiddleware
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "secret")
+    monkeypatch.setattr(profiling, "PROFILING_SAMPLE_RATE", 0)
+    monkeypatch.setattr(profiling, "PROFILING_DIR", str(tmp_path))
+
+    upstream = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, json={})),
+        event_hooks={"request": [profiling._on_http_request], "response": [profiling._on_http_response]},
+    )
+
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        await upstream.get("https://api.example/items", params={"id": item_id})
+        return {"id": item_id}
+
+    return TestClient(app)
+
+
+def _profiles(tmp_path) -> list[dict]:
+    return [orjson.loads(path.read_bytes()) for path in tmp_path.glob("*.json")]
+
+
+def test_request_with_token_is_profiled(client, tmp_path):
+    response = client.get("/items/1", headers={"X-Profile": "secret"})
+
+    assert response.json() == {"id": 1}
+    [profile] = _profiles(tmp_path)
+    assert len(list(tmp_path.glob("*.prof"))) == 1
+    assert profile["route"] == "/items/{item_id}"
+    assert profile["status_code"] == 200
+    # Параметры запроса к внешнему API в профиль не попадают
+    assert [(call["url"], call["status_code"]) for call in profile["upstream_calls"]] == [("https://api.example/items", 200)]
+
+
+def test_other_requests_are_not_profiled(client, tmp_path):
+    client.get("/items/1")
+    client.get("/items/1", headers={"X-Profile": "wrong"})
+
+    assert _profiles(tmp_path) == []
+
+
+def test_sampling_without_header(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_SAMPLE_RATE", 1.0)
+
+    client.get("/items/2")
+
+    assert len(_profiles(tmp_path)) == 1
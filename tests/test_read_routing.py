@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+import redis.asyncio as redis
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from src import database
+from src.database import get_read_db, mark_recent_write, read_session_for
+
+
+@pytest.fixture
+def replica(fake_redis, monkeypatch):
+    """Настроенная реплика; соединения с ней не открываются, пока сессия не выполняет запросов."""
+    replica_engine = create_async_engine("postgresql+asyncpg://u:p@localhost/replica")
+    replica_session = sessionmaker(replica_engine, class_=AsyncSession, expire_on_commit=False)
+    monkeypatch.setattr(database, "replica_engine", replica_engine)
+    monkeypatch.setattr(database, "async_read_session", replica_session)
+    return replica_session
+
+
+def test_reads_go_to_primary_right_after_a_write(replica):
+    async def run():
+        before = await read_session_for(1)
+        await mark_recent_write(1)
+        return before, await read_session_for(1), await read_session_for(2), await read_session_for(None)
+
+    before, after_write, other_user, anonymous = asyncio.run(run())
+
+    assert before is replica
+    assert after_write is database.async_session
+    assert other_user is replica and anonymous is replica
+
+
+def test_redis_failure_falls_back_to_primary(replica, monkeypatch):
+    class BrokenRedis:
+        async def exists(self, key):
+            raise redis.ConnectionError("down")
+
+    monkeypatch.setattr(database, "get_redis_client", lambda: BrokenRedis())
+
+    assert asyncio.run(read_session_for(1)) is database.async_session
+
+
+def test_without_replica_everything_reads_from_primary(fake_redis):
+    async def run():
+        await mark_recent_write(1)
+        return await read_session_for(1)
+
+    assert asyncio.run(run()) is database.async_read_session
+    assert asyncio.run(fake_redis().exists("db_recent_write:1")) == 0
+
+
+def test_read_dependency_uses_user_id_from_path_and_query(replica):
+    app = FastAPI()
+
+    @app.get("/users/{user_id}/report")
+    async def by_path(db: AsyncSession = Depends(get_read_db)):
+        return {"database": db.bind.url.database}
+
+    @app.get("/report")
+    async def by_query(db: AsyncSession = Depends(get_read_db)):
+        return {"database": db.bind.url.database}
+
+    client = TestClient(app)
+    primary = database.engine.url.database
+    asyncio.run(mark_recent_write(7))
+
+    assert client.get("/users/7/report").json()["database"] == primary
+    assert client.get("/report", params={"user_id": 7}).json()["database"] == primary
+    assert client.get("/users/8/report").json()["database"] == "replica"
+    assert client.get("/report", params={"user_id": "x"}).json()["database"] == "replica"
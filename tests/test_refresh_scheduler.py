@@ -0,0 +1,39 @@
+import asyncio
+import time
+
+from src.ReportsDirect.scheduler import get_report_access_times, plan_refreshes, record_report_access
+
+NOW = 1_700_000_000.0
+DAY = 86400
+
+
+def test_plan_orders_by_recent_activity_and_skips_idle_users():
+    access_times = {1: NOW - 3 * DAY, 2: NOW - 60, 3: NOW - 10 * DAY}
+
+    plan = plan_refreshes([1, 2, 3, 4], access_times, window_seconds=3600, idle_days=7, now=NOW, jitter=False)
+
+    assert plan == [(2, 0), (1, 1800)]
+
+
+def test_plan_spreads_over_the_window_with_jitter_inside_each_slot():
+    access_times = {user_id: NOW - user_id for user_id in range(100)}
+
+    plan = plan_refreshes(list(range(100)), access_times, window_seconds=1000, idle_days=7, now=NOW)
+
+    assert [user_id for user_id, _ in plan] == list(range(100))
+    assert all(i * 10 <= countdown <= (i + 1) * 10 for i, (_, countdown) in enumerate(plan))
+    assert max(countdown for _, countdown in plan) <= 1000
+
+
+def test_plan_is_empty_without_active_users():
+    assert plan_refreshes([1, 2], {}, window_seconds=3600, idle_days=7, now=NOW) == []
+
+
+def test_access_times_drop_entries_older_than_idle_window(fake_redis):
+    async def run():
+        redis_client = fake_redis()
+        await record_report_access(redis_client, 1)
+        await redis_client.zadd("yandex_report_access", {"2": time.time() - 8 * DAY})
+        return await get_report_access_times(redis_client, idle_days=7)
+
+    assert list(asyncio.run(run())) == [1]
@@ -0,0 +1,103 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import pytest
+
+from src.ReportsDirect import archive
+from src.ReportsDirect.archive import (
+    _evict,
+    _merge_intervals,
+    _month_ranges,
+    closed_date_border,
+    delete_user_archive,
+    read_report_rows,
+    store_report_rows,
+)
+
+
+@pytest.fixture(autouse=True)
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "REPORT_ARCHIVE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _rows(date1: date, date2: date, clicks: str = "1") -> list[dict]:
+    days = (date2 - date1).days + 1
+    return [{"CampaignId": "5", "Date": str(date1 + timedelta(days=i)), "Clicks": clicks} for i in range(days)]
+
+
+def test_month_ranges_and_interval_merge():
+    assert _month_ranges(date(2024, 1, 30), date(2024, 3, 2)) == [
+        ("2024-01", date(2024, 1, 30), date(2024, 1, 31)),
+        ("2024-02", date(2024, 2, 1), date(2024, 2, 29)),
+        ("2024-03", date(2024, 3, 1), date(2024, 3, 2)),
+    ]
+    assert _merge_intervals([
+        (date(2024, 1, 10), date(2024, 1, 20)),
+        (date(2024, 1, 1), date(2024, 1, 9)),
+        (date(2024, 1, 25), date(2024, 1, 31)),
+    ]) == [(date(2024, 1, 1), date(2024, 1, 20)), (date(2024, 1, 25), date(2024, 1, 31))]
+
+
+def test_round_trip_across_months():
+    date1, date2 = date(2024, 1, 20), date(2024, 2, 10)
+    assert store_report_rows(1, _rows(date1, date2), date1, date2) == 2
+
+    rows = read_report_rows(1, date(2024, 1, 25), date(2024, 2, 5))
+
+    assert [row["Date"] for row in rows] == [str(date(2024, 1, 25) + timedelta(days=i)) for i in range(12)]
+    # Период шире сохраненного покрыт не полностью
+    assert read_report_rows(1, date(2024, 1, 19), date(2024, 2, 5)) is None
+    assert read_report_rows(2, date1, date2) is None
+
+
+def test_open_days_are_not_archived():
+    border = closed_date_border()
+
+    store_report_rows(1, _rows(border - timedelta(days=2), border + timedelta(days=2)),
+                      border - timedelta(days=2), border + timedelta(days=2))
+
+    assert len(read_report_rows(1, border - timedelta(days=2), border)) == 3
+    assert read_report_rows(1, border - timedelta(days=2), border + timedelta(days=1)) is None
+
+
+def test_rewrite_replaces_rows_and_keeps_coverage():
+    store_report_rows(1, _rows(date(2024, 1, 1), date(2024, 1, 10)), date(2024, 1, 1), date(2024, 1, 10))
+    store_report_rows(1, _rows(date(2024, 1, 5), date(2024, 1, 15), "2"), date(2024, 1, 5), date(2024, 1, 15))
+
+    rows = read_report_rows(1, date(2024, 1, 1), date(2024, 1, 15))
+
+    assert [row["Clicks"] for row in rows] == ["1"] * 4 + ["2"] * 11
+
+
+def test_concurrent_writes_keep_each_others_intervals():
+    periods = [(date(2024, 3, day), date(2024, 3, day + 4)) for day in (1, 6, 11, 16, 21, 26)]
+
+    with ThreadPoolExecutor(max_workers=len(periods)) as pool:
+        list(pool.map(lambda period: store_report_rows(1, _rows(*period), *period), periods))
+
+    assert len(read_report_rows(1, date(2024, 3, 1), date(2024, 3, 30))) == 30
+
+
+def test_least_recently_read_files_are_evicted(archive_dir):
+    for month in (1, 2, 3):
+        start = date(2023, month, 1)
+        store_report_rows(1, _rows(start, start + timedelta(days=27)), start, start + timedelta(days=27))
+    paths = sorted((archive_dir / "1").glob("*.arrow"))
+    for age, path in enumerate(reversed(paths)):
+        os.utime(path, (1_000_000 + age, 1_000_000 + age))
+    # Январь прочитан последним
+    read_report_rows(1, date(2023, 1, 1), date(2023, 1, 28))
+
+    _evict(max_bytes=sum(path.stat().st_size for path in paths) - 1)
+
+    assert sorted(path.name for path in (archive_dir / "1").glob("*.arrow")) == ["2023-01.arrow", "2023-02.arrow"]
+
+
+def test_delete_user_archive():
+    store_report_rows(1, _rows(date(2024, 1, 1), date(2024, 1, 5)), date(2024, 1, 1), date(2024, 1, 5))
+
+    delete_user_archive(1)
+
+    assert read_report_rows(1, date(2024, 1, 1), date(2024, 1, 5)) is None
@@ -0,0 +1,62 @@
+import asyncio
+
+from src.ReportsDirect.events import ReportEventHub, publish_report_updated
+
+
+def test_slow_subscriber_keeps_only_the_latest_events():
+    async def run():
+        hub = ReportEventHub()
+        queue = asyncio.Queue(maxsize=2)
+        hub._subscribers[1].add(queue)
+        for i in range(5):
+            hub._dispatch(1, {"last_updated": i})
+        return [queue.get_nowait()["last_updated"] for _ in range(queue.qsize())]
+
+    assert asyncio.run(run()) == [3, 4]
+
+
+def test_events_reach_subscribers_and_bad_messages_are_skipped(fake_redis):
+    async def run():
+        hub = ReportEventHub()
+        queue = hub.subscribe(7)
+        other = hub.subscribe(8)
+        await asyncio.sleep(0.05)
+
+        redis_client = fake_redis()
+        await redis_client.publish("yandex_report_updates:7", "not json")
+        await redis_client.publish("yandex_report_updates:7", '{"no_user_id": 1}')
+        await publish_report_updated(redis_client, 7, "2024-06-01T00:00:00")
+        event = await asyncio.wait_for(queue.get(), 2)
+
+        hub.unsubscribe(7, queue)
+        hub.unsubscribe(8, other)
+        return event, other.empty()
+
+    event, other_empty = asyncio.run(run())
+    assert event == {"user_id": 7, "last_updated": "2024-06-01T00:00:00"}
+    assert other_empty
+
+
+def test_listener_stops_with_the_last_subscriber(fake_redis):
+    async def run():
+        hub = ReportEventHub()
+        queue = hub.subscribe(7)
+        await asyncio.sleep(0.05)
+        listener = hub._listener
+
+        hub.unsubscribe(7, queue)
+        await asyncio.sleep(0.05)
+        stopped = listener.done()
+
+        # Новый подписчик снова запускает подписку
+        queue = hub.subscribe(7)
+        await asyncio.sleep(0.05)
+        await publish_report_updated(fake_redis(), 7, "t")
+        event = await asyncio.wait_for(queue.get(), 2)
+        hub.unsubscribe(7, queue)
+        await asyncio.sleep(0)
+        return stopped, event
+
+    stopped, event = asyncio.run(run())
+    assert stopped
+    assert event["last_updated"] == "t"
@@ -0,0 +1,68 @@
+import numpy as np
+import orjson
+from brotli_asgi import BrotliMiddleware
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.responses import COMPRESSION_EXCLUDED_PATHS, COMPRESSION_MIN_SIZE, FastJSONResponse, RawJSONResponse
+
+
+def _app() -> FastAPI:
+    """Приложение с той же цепочкой ответов и сжатия, что и src.main."""
+    app = FastAPI(default_response_class=FastJSONResponse)
+    app.add_middleware(
+        BrotliMiddleware,
+        minimum_size=COMPRESSION_MIN_SIZE,
+        gzip_fallback=True,
+        excluded_handlers=COMPRESSION_EXCLUDED_PATHS,
+    )
+
+    @app.get("/small")
+    async def small():
+        return {"ok": True}
+
+    @app.get("/large")
+    async def large():
+        return FastJSONResponse([{"row": i, "name": "кампания"} for i in range(500)])
+
+    @app.get("/export/large")
+    async def export_large():
+        return FastJSONResponse([{"row": i} for i in range(500)])
+
+    @app.get("/raw")
+    async def raw():
+        return RawJSONResponse(b'{"cached":true}')
+
+    return app
+
+
+def test_fast_json_handles_numpy_and_non_string_keys():
+    body = FastJSONResponse({1: np.int64(5), "values": np.array([1.5, 2.5])}).body
+
+    assert orjson.loads(body) == {"1": 5, "values": [1.5, 2.5]}
+
+
+def test_raw_json_is_sent_as_is():
+    response = TestClient(_app()).get("/raw")
+
+    assert response.headers["content-type"] == "application/json"
+    assert response.content == b'{"cached":true}'
+
+
+def test_only_large_bodies_are_compressed():
+    client = TestClient(_app())
+
+    assert "content-encoding" not in client.get("/small", headers={"Accept-Encoding": "br"}).headers
+
+    br = client.get("/large", headers={"Accept-Encoding": "br"})
+    assert br.headers["content-encoding"] == "br"
+    assert len(br.json()) == 500
+
+    gzip = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert gzip.headers["content-encoding"] == "gzip"
+
+
+def test_streaming_paths_are_not_compressed():
+    response = TestClient(_app()).get("/export/large", headers={"Accept-Encoding": "br, gzip"})
+
+    assert "content-encoding" not in response.headers
@@ -0,0 +1,144 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from src.Users import service
+from src.Users.service import refresh_expiring_tokens, refresh_user_token, user_credentials_cache
+
+
+class FakeUserSession:
+    """Сессия с одним пользователем: отдает его в select и считает commit."""
+
+    def __init__(self, user):
+        self.user = user
+        self.commits = 0
+
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, stmt):
+        return SimpleNamespace(scalars=lambda: SimpleNamespace(first=lambda: self.user))
+
+    async def commit(self):
+        self.commits += 1
+
+
+def _user(expires_in=60, failed_at=None):
+    return SimpleNamespace(
+        id=1,
+        login="client",
+        access_token="old",
+        refresh_token="refresh",
+        token_expires_at=datetime.utcnow() + timedelta(seconds=expires_in),
+        token_refresh_failed_at=failed_at,
+    )
+
+
+@pytest.fixture
+def oauth(fake_redis, monkeypatch):
+    """Подменяет oauth.yandex.ru ответом, который задает тест, и считает запросы."""
+    state = {"response": None, "calls": 0}
+
+    async def fake_request_token_refresh(refresh_token):
+        state["calls"] += 1
+        await asyncio.sleep(0.01)
+        return state["response"]
+
+    async def fake_mark_recent_write(user_id):
+        pass
+
+    monkeypatch.setattr(service, "request_token_refresh", fake_request_token_refresh)
+    monkeypatch.setattr(service, "mark_recent_write", fake_mark_recent_write)
+    user_credentials_cache.clear()
+    yield state
+    user_credentials_cache.clear()
+
+
+def test_concurrent_refreshes_make_one_request(oauth, monkeypatch):
+    session = FakeUserSession(_user())
+    monkeypatch.setattr(service, "async_session", session)
+    oauth["response"] = {"access_token": "new", "expires_in": 3600}
+
+    async def run():
+        return await asyncio.gather(*(refresh_user_token(1) for _ in range(3)))
+
+    results = asyncio.run(run())
+
+    assert oauth["calls"] == 1
+    assert {credentials.access_token for credentials in results} == {"new"}
+    # refresh_token без нового значения в ответе сохраняется прежним
+    assert session.user.refresh_token == "refresh"
+    assert user_credentials_cache.get(1).access_token == "new"
+
+
+def test_fatal_error_disables_further_refreshes(oauth, monkeypatch):
+    session = FakeUserSession(_user())
+    monkeypatch.setattr(service, "async_session", session)
+    oauth["response"] = {"error": "invalid_grant"}
+
+    assert asyncio.run(refresh_user_token(1)) is None
+    assert session.user.token_refresh_failed_at is not None
+    assert session.commits == 1
+
+    assert asyncio.run(refresh_user_token(1)) is None
+    assert oauth["calls"] == 1
+
+
+def test_temporary_error_keeps_the_user_eligible(oauth, monkeypatch):
+    session = FakeUserSession(_user())
+    monkeypatch.setattr(service, "async_session", session)
+    oauth["response"] = None
+
+    assert asyncio.run(refresh_user_token(1)) is None
+    assert session.user.token_refresh_failed_at is None
+    assert session.user.access_token == "old"
+
+
+def test_fresh_token_is_not_refreshed(oauth, monkeypatch):
+    monkeypatch.setattr(service, "async_session", FakeUserSession(_user(expires_in=86400)))
+
+    credentials = asyncio.run(refresh_user_token(1))
+
+    assert credentials.access_token == "old"
+    assert oauth["calls"] == 0
+
+
+def test_batch_refresh_counts_results(monkeypatch):
+    session = FakeUserSession(None)
+    ids = SimpleNamespace(all=lambda: [1, 2, 3])
+
+    async def fake_execute(stmt):
+        return SimpleNamespace(scalars=lambda: ids)
+
+    async def fake_refresh_user_token(user_id, margin):
+        return None if user_id == 2 else SimpleNamespace(id=user_id)
+
+    session.execute = fake_execute
+    monkeypatch.setattr(service, "async_session", session)
+    monkeypatch.setattr(service, "refresh_user_token", fake_refresh_user_token)
+
+    assert asyncio.run(refresh_expiring_tokens()) == {"refreshed": 2, "failed": 1}
+
+
+def test_only_permanent_oauth_errors_are_reported(monkeypatch):
+    responses = iter([
+        httpx.Response(400, json={"error": "invalid_grant"}),
+        httpx.Response(400, json={"error": "invalid_request"}),
+        httpx.Response(503, text="unavailable"),
+    ])
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: next(responses)))
+    monkeypatch.setattr(service, "get_http_client", lambda: client)
+
+    async def run():
+        return [await service.request_token_refresh("refresh") for _ in range(3)]
+
+    assert asyncio.run(run()) == [{"error": "invalid_grant"}, None, None]
@@ -0,0 +1,162 @@
+import asyncio
+
+import httpx
+import orjson
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from src import tracing
+from src.tracing import (
+    KIND_CLIENT,
+    STATUS_ERROR,
+    STATUS_OK,
+    TracingMiddleware,
+    otlp_payload,
+    parse_traceparent,
+    span,
+    traced,
+)
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+class CollectingExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def by_name(self, name):
+        return next(s for s in self.spans if s.name == name)
+
+
+@pytest.fixture
+def spans(monkeypatch):
+    """Включает трассировку и собирает завершенные спаны вместо записи в файл."""
+    exporter = CollectingExporter()
+    monkeypatch.setattr(tracing, "TRACING_ENABLED", True)
+    monkeypatch.setattr(tracing, "exporter", exporter)
+    return exporter
+
+
+def test_parse_traceparent():
+    assert parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-01") == (TRACE_ID, PARENT_ID)
+    assert parse_traceparent(None) is None
+    assert parse_traceparent("00-short-id-01") is None
+
+
+def test_nested_spans_share_the_trace_and_record_errors(spans):
+    with pytest.raises(ValueError):
+        with span("outer") as outer:
+            with span("inner"):
+                raise ValueError("boom")
+
+    inner = spans.by_name("inner")
+    assert inner.trace_id == outer.trace_id and inner.parent_id == outer.span_id
+    assert (inner.status, inner.status_message) == (STATUS_ERROR, "ValueError: boom")
+    assert outer.status == STATUS_ERROR
+
+
+def test_traced_wraps_coroutines(spans):
+    @traced("work")
+    async def work():
+        return tracing.current_span().name
+
+    assert asyncio.run(work()) == "work"
+    assert spans.by_name("work").status == STATUS_OK
+
+
+def test_otlp_payload_types_attributes_and_skips_none(spans):
+    with span("op", flag=True, count=3, ratio=0.5, label="x", missing=None):
+        pass
+
+    [exported] = orjson.loads(otlp_payload(spans.spans))["resourceSpans"][0]["scopeSpans"][0]["spans"]
+
+    assert exported["attributes"] == [
+        {"key": "flag", "value": {"boolValue": True}},
+        {"key": "count", "value": {"intValue": "3"}},
+        {"key": "ratio", "value": {"doubleValue": 0.5}},
+        {"key": "label", "value": {"stringValue": "x"}},
+    ]
+
+
+def test_server_span_continues_incoming_trace(spans):
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        if item_id == 0:
+            raise HTTPException(status_code=503, detail="busy")
+        return {"id": item_id}
+
+    client = TestClient(app)
+    client.get("/items/1", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"})
+    client.get("/items/0")
+
+    ok, failed = spans.spans
+    assert ok.name == "GET /items/{item_id}"
+    assert (ok.trace_id, ok.parent_id) == (TRACE_ID, PARENT_ID)
+    assert ok.attributes["http.response.status_code"] == 200
+    assert failed.trace_id != TRACE_ID and failed.status == STATUS_ERROR
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    """Транспорт httpx с заданным ответом, обернутый так же, как при install_tracing."""
+    outcome = {"response": httpx.Response(200)}
+
+    async def fake_handle_async_request(self, request):
+        if isinstance(outcome["response"], Exception):
+            raise outcome["response"]
+        return outcome["response"]
+
+    # monkeypatch вернет исходный метод транспорта после теста
+    monkeypatch.setattr(httpx.AsyncHTTPTransport, "handle_async_request", fake_handle_async_request)
+    tracing._instrument_httpx()
+    return outcome
+
+
+def _call_upstream():
+    async def run():
+        with span("handler"):
+            async with httpx.AsyncClient() as client:
+                try:
+                    await client.get("https://api.example/v1/items?id=1")
+                except httpx.HTTPError:
+                    pass
+    asyncio.run(run())
+
+
+def test_client_span_records_status(spans, transport):
+    transport["response"] = httpx.Response(404)
+
+    _call_upstream()
+
+    client_span = spans.by_name("GET api.example")
+    assert client_span.kind == KIND_CLIENT
+    assert client_span.parent_id == spans.by_name("handler").span_id
+    assert client_span.attributes["url.path"] == "/v1/items"
+    assert (client_span.attributes["http.response.status_code"], client_span.status) == (404, STATUS_ERROR)
+
+
+def test_client_span_is_ended_on_connection_errors(spans, transport):
+    transport["response"] = httpx.ConnectTimeout("timed out")
+
+    _call_upstream()
+
+    client_span = spans.by_name("GET api.example")
+    assert client_span.end_ns > 0
+    assert client_span.status_message == "ConnectTimeout: timed out"
+
+
+def test_calls_outside_a_trace_are_not_wrapped(spans, transport):
+    async def run():
+        async with httpx.AsyncClient() as client:
+            await client.get("https://api.example/")
+    asyncio.run(run())
+
+    assert spans.spans == []
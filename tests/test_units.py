@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src import units
+from src.units import ensure_units, get_units_metrics, parse_units_header, record_units, split_by_units
+
+
+def test_parse_units_header():
+    assert parse_units_header("10/20828/64000") == (10, 20828, 64000)
+    assert parse_units_header(None) is None
+    assert parse_units_header("10/x/64000") is None
+
+
+def test_record_units_tracks_remaining_and_daily_spend(fake_redis):
+    async def run():
+        await record_units("agency", {"Units": "10/5000/64000", "Units-Used-Login": "client"})
+        await record_units("client", {"Units": "15/4985/64000"})
+        return await units.get_units("client"), await get_units_metrics()
+
+    client_units, metrics = asyncio.run(run())
+
+    assert client_units["remaining"] == 4985
+    assert client_units["limit"] == 64000
+    assert [(m["login"], m["spent_today"], m["remaining"]) for m in metrics] == [("client", 25, 4985)]
+
+
+def test_ensure_units_keeps_the_reserve(fake_redis, monkeypatch):
+    monkeypatch.setattr(units, "DIRECT_UNITS_RESERVE", 100)
+
+    async def run(cost):
+        await record_units("client", {"Units": "10/150/64000"})
+        await ensure_units("client", cost)
+
+    asyncio.run(run(50))
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(run(51))
+    assert error.value.status_code == 429
+    # Логин без данных о баллах не блокируется
+    asyncio.run(ensure_units("unknown", 10_000))
+
+
+def test_split_by_units_orders_ready_logins_and_defers_low_balances(fake_redis):
+    async def run():
+        await record_units("a", {"Units": "1/3000/64000"})
+        await record_units("b", {"Units": "1/500/64000"})
+        await record_units("c", {"Units": "1/9000/64000"})
+        return await split_by_units(["a", "b", "c", "new"], threshold=2000)
+
+    ready, deferred = asyncio.run(run())
+
+    assert ready == ["new", "c", "a"]
+    assert deferred == ["b"]
@@ -0,0 +1,158 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from src.ReportsMetrica import router as metrica_reports
+from src.upstreams import (
+    DeadlineMiddleware,
+    UpstreamGate,
+    local_deadline,
+    remaining_budget,
+    service_unavailable,
+    upstream_timeout,
+)
+
+
+def test_full_queue_is_rejected_immediately():
+    gate = UpstreamGate("test", concurrency=1, max_queue=1, retry_after=7)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def hold():
+            async with gate.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        with pytest.raises(HTTPException) as error:
+            async with gate.slot():
+                pass
+        stats = gate.stats()
+        release.set()
+        await asyncio.gather(holder, waiter)
+        return error.value, stats
+
+    error, stats = asyncio.run(run())
+
+    assert error.status_code == 503 and error.headers == {"Retry-After": "7"}
+    assert stats == {"concurrency": 1, "in_flight": 1, "waiting": 1, "max_queue": 1, "rejected": 1}
+    assert gate.stats()["in_flight"] == 0
+
+
+def test_waiting_for_a_slot_is_bounded_by_the_budget():
+    gate = UpstreamGate("test", concurrency=1, max_queue=10)
+
+    async def run():
+        async with gate.slot():
+            with local_deadline(0.6):
+                async with gate.slot():
+                    pass
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(run())
+    assert error.value.status_code == 503
+    assert "не дождались" in error.value.detail
+
+
+def test_timeout_cut_by_the_budget_becomes_503():
+    gate = UpstreamGate("test", concurrency=1, max_queue=1)
+
+    async def call():
+        async with gate.slot():
+            await asyncio.sleep(0.2)
+            raise httpx.ReadTimeout("timed out")
+
+    async def run():
+        with local_deadline(0.6):
+            await call()
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(run())
+    assert error.value.status_code == 503
+    assert gate.rejected == 1
+
+    # Без дедлайна таймаут — обычная ошибка внешнего API
+    with pytest.raises(httpx.ReadTimeout):
+        asyncio.run(call())
+
+
+def test_cancelled_waiters_do_not_leak_slots():
+    gate = UpstreamGate("test", concurrency=1, max_queue=10)
+
+    async def run():
+        async def hold(seconds):
+            async with gate.slot():
+                await asyncio.sleep(seconds)
+
+        holder = asyncio.create_task(hold(0.05))
+        waiters = [asyncio.create_task(hold(0)) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(holder, *waiters, return_exceptions=True)
+        # Слот свободен: следующий вызов получает его сразу
+        with local_deadline(1):
+            async with gate.slot():
+                return gate.stats()
+
+    stats = asyncio.run(run())
+    assert (stats["in_flight"], stats["waiting"]) == (1, 0)
+
+
+def test_local_deadline_never_extends_the_current_one():
+    async def run():
+        with local_deadline(5):
+            with local_deadline(60):
+                inner = remaining_budget()
+            timeout = upstream_timeout(default=30)
+        return inner, timeout, remaining_budget()
+
+    inner, timeout, outside = asyncio.run(run())
+
+    assert 4 < inner <= 5
+    assert 4 < timeout <= 5
+    assert outside is None
+
+
+def test_middleware_sets_budget_except_for_streaming_paths():
+    app = FastAPI()
+    app.add_middleware(DeadlineMiddleware, deadline=10)
+
+    @app.get("/report")
+    async def report():
+        return {"budget": remaining_budget()}
+
+    @app.get("/export/report")
+    async def export_report():
+        return {"budget": remaining_budget()}
+
+    client = TestClient(app)
+
+    assert 9 < client.get("/report").json()["budget"] <= 10
+    assert client.get("/export/report").json()["budget"] is None
+
+
+def test_overload_reaches_the_client_of_metrica_reports(monkeypatch):
+    async def fake_fetch_metrika_rows(params, clean_row):
+        if params["ids"] == "overloaded":
+            raise service_unavailable("metrica: слишком много запросов в очереди", 9)
+        raise HTTPException(status_code=400, detail="bad request")
+
+    monkeypatch.setattr(metrica_reports, "fetch_metrika_rows", fake_fetch_metrika_rows)
+    app = FastAPI()
+    app.include_router(metrica_reports.router)
+    client = TestClient(app)
+
+    monkeypatch.setattr(metrica_reports, "COUNTER_IDS", ["broken"])
+    # Прочие ошибки Метрики по-прежнему попадают в ответ по счетчику
+    assert client.get("/metrika_summary/").json()["broken"]["status_code"] == 400
+
+    monkeypatch.setattr(metrica_reports, "COUNTER_IDS", ["broken", "overloaded"])
+    response = client.get("/metrika_summary/")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "9"
@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from src.Users import service
+from src.Users.service import UserCredentials, UserCredentialsCache, get_user_credentials, user_credentials_cache
+
+
+class FakeSessionFactory:
+    """Фабрика сессий, отдающая заданные строки и считающая запросы."""
+
+    def __init__(self, rows: dict):
+        self.rows = rows
+        self.queries = 0
+
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, stmt):
+        self.queries += 1
+        user_id = stmt.whereclause.right.value
+        return SimpleNamespace(first=lambda: self.rows.get(user_id))
+
+
+def _row(user_id: int, expires_in: int = 86400) -> SimpleNamespace:
+    return SimpleNamespace(
+        id=user_id,
+        login=f"login{user_id}",
+        access_token=f"token{user_id}",
+        token_expires_at=datetime.utcnow() + timedelta(seconds=expires_in),
+    )
+
+
+@pytest.fixture
+def databases(monkeypatch):
+    """Основная БД и реплика; реплика еще не знает пользователя 2."""
+    user_credentials_cache.clear()
+    primary = FakeSessionFactory({1: _row(1), 2: _row(2)})
+    replica = FakeSessionFactory({1: _row(1)})
+
+    async def fake_read_session_for(user_id):
+        return replica
+
+    monkeypatch.setattr(service, "async_session", primary)
+    monkeypatch.setattr(service, "read_session_for", fake_read_session_for)
+    yield primary, replica
+    user_credentials_cache.clear()
+
+
+def test_cache_evicts_least_recently_set_and_expires():
+    cache = UserCredentialsCache(ttl=60, max_items=2)
+    for user_id in (1, 2, 3):
+        cache.set(UserCredentials(id=user_id, login=None, access_token="t"))
+
+    assert cache.get(1) is None
+    assert cache.get(3).id == 3
+    # Шина сброса передает ключи строками
+    cache.delete("3")
+    assert cache.get(3) is None
+
+    expired = UserCredentialsCache(ttl=0, max_items=2)
+    expired.set(UserCredentials(id=1, login=None, access_token="t"))
+    assert expired.get(1) is None
+
+
+def test_expires_soon():
+    now = datetime.utcnow()
+
+    assert UserCredentials(1, None, "t", now + timedelta(seconds=10)).expires_soon(margin=60)
+    assert not UserCredentials(1, None, "t", now + timedelta(hours=1)).expires_soon(margin=60)
+    assert not UserCredentials(1, None, "t").expires_soon()
+
+
+def test_database_is_queried_only_on_miss(databases):
+    primary, replica = databases
+
+    async def run():
+        return [await get_user_credentials(1) for _ in range(3)]
+
+    results = asyncio.run(run())
+
+    assert {credentials.access_token for credentials in results} == {"token1"}
+    assert (replica.queries, primary.queries) == (1, 0)
+
+
+def test_missing_user_on_replica_is_read_from_primary(databases):
+    primary, replica = databases
+
+    credentials = asyncio.run(get_user_credentials(2))
+
+    assert credentials.login == "login2"
+    assert (replica.queries, primary.queries) == (1, 1)
+    assert asyncio.run(get_user_credentials(3)) is None
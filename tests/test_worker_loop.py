@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from src import clients
+from src.ReportsDirect import celery as worker
+
+
+@pytest.fixture
+def worker_loop(monkeypatch):
+    monkeypatch.setattr(worker, "_worker_loop", None)
+    monkeypatch.setattr(clients, "_http_client", None)
+    monkeypatch.setattr(clients, "_redis_client", None)
+    monkeypatch.setattr(clients, "_loop", None)
+    yield
+    loop = worker._worker_loop
+    if loop is not None and not loop.is_closed():
+        loop.run_until_complete(clients.close_clients())
+        loop.close()
+    asyncio.set_event_loop(None)
+
+
+async def _shared_clients():
+    return asyncio.get_running_loop(), clients.get_http_client(), clients.get_redis_client()
+
+
+def test_tasks_share_one_loop_and_clients(worker_loop):
+    loop1, http1, redis1 = worker.run_async(_shared_clients())
+    loop2, http2, redis2 = worker.run_async(_shared_clients())
+
+    assert loop1 is loop2 is worker.get_worker_loop()
+    assert http1 is http2
+    assert redis1 is redis2
+
+
+def test_clients_are_recreated_in_a_new_loop(worker_loop):
+    _, http1, redis1 = worker.run_async(_shared_clients())
+
+    # Клиенты из другого loop непригодны: при смене loop они создаются заново
+    _, http2, redis2 = asyncio.run(_shared_clients())
+
+    assert http2 is not http1
+    assert redis2 is not redis1